@@ -0,0 +1,294 @@
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from stock.data import data_manager
+from stock.data.database import RwDatabase, MetadataDatabase, ExchangeDatabase
+from stock.data.database_updater import update_database, clear_update_record
+from stock.data.data_source import SyntheticDataSource
+from stock.processers.ma_processor import MovingAverageProcessor
+from stock.processers.indicator_processor import EMAProcessor, RSIProcessor, ATRProcessor, BollingerProcessor
+import datetime as dt
+import platform
+import sqlite3
+import tempfile
+import shutil
+import json
+import time
+import os
+import numpy as np
+import pandas as pd
+
+EXCHANGE = 'bench'
+
+# Maps the name of every benchmark to a function that prepares one run and returns it
+BENCHMARKS: Dict[str, Callable[[Environment], Callable[[], None]]] = {}
+
+
+class Environment:
+    """
+    Synthetic exchange the benchmarks run against, stored in a scratch working
+    directory since every database path of the project is relative.
+
+    === Representation Invariants ===
+    frames holds the history of every symbol of symbols
+    """
+    n_symbols: int
+    years: int
+    workdir: str
+    source: SyntheticDataSource
+    symbols: List[str]
+    frames: Dict[str, pd.DataFrame]
+
+    def __init__(self, n_symbols: int, years: int, workdir: str):
+        """
+        Generates n_symbols histories of years years each and loads them into
+        the bench exchange
+        """
+        self.n_symbols = n_symbols
+        self.years = years
+        self.workdir = workdir
+        first_date = (dt.date.today() - dt.timedelta(days=365 * years)).strftime('%Y-%m-%d')
+        self.source = SyntheticDataSource(n_symbols, first_date=first_date)
+        self.symbols = self.source.symbols()
+        end = int(time.mktime(dt.date.today().timetuple()))
+        self.frames = {symbol: self.source.download(symbol, 0, end) for symbol in self.symbols}
+        os.makedirs('findata', exist_ok=True)
+        os.makedirs('comdata', exist_ok=True)
+        with ExchangeDatabase(EXCHANGE) as exdb, exdb.bulk_load():
+            for symbol, df in self.frames.items():
+                exdb.write_stock_data(symbol, df, commit=False)
+
+    def rows(self) -> int:
+        """
+        Returns the number of rows of all histories
+        """
+        return sum(map(len, self.frames.values()))
+
+
+def benchmark(name: str) -> Callable:
+    """
+    Registers a benchmark. The decorated function is called with the Environment
+    before every run to prepare it, and returns the function to time.
+    """
+    def register(func: Callable[[Environment], Callable[[], None]]) -> Callable[[Environment], Callable[[], None]]:
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def _remove_database(name: str) -> None:
+    """
+    Removes findata/<name>.db with its WAL files and columnar store
+    """
+    for path in (f'findata/{name}.db', f'findata/{name}.db-wal', f'findata/{name}.db-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(f'findata/{name}.columns', ignore_errors=True)
+
+
+@benchmark('write_stock_data')
+def _write_stock_data(env: Environment) -> Callable[[], None]:
+    _remove_database('benchw')
+
+    def run():
+        with ExchangeDatabase('benchw') as exdb:
+            for symbol, df in env.frames.items():
+                exdb.write_stock_data(symbol, df)
+    return run
+
+
+@benchmark('write_stock_data_bulk')
+def _write_stock_data_bulk(env: Environment) -> Callable[[], None]:
+    _remove_database('benchw')
+
+    def run():
+        with ExchangeDatabase('benchw') as exdb, exdb.bulk_load():
+            for symbol, df in env.frames.items():
+                exdb.write_stock_data(symbol, df, commit=False)
+    return run
+
+
+@benchmark('read_stock_data')
+def _read_stock_data(env: Environment) -> Callable[[], None]:
+    def run():
+        with ExchangeDatabase(EXCHANGE, read_only=True) as exdb:
+            for symbol in env.symbols:
+                exdb.read_stock_data(symbol)
+    return run
+
+
+@benchmark('write_columns')
+def _write_columns(env: Environment) -> Callable[[], None]:
+    if os.path.exists('comdata/bench_columns.db'):
+        os.remove('comdata/bench_columns.db')
+    db = RwDatabase('comdata/', 'bench_columns.db')
+    columns = {}
+    for symbol, df in env.frames.items():
+        db.ensure_table(f'{EXCHANGE}/{symbol}', {'Date': 'TEXT'}, primary_key='Date')
+        columns[f'{EXCHANGE}/{symbol}'] = df['Close'].rolling(20).mean().to_frame('ma20_close')
+    db.commit()
+
+    def run():
+        for table, df in columns.items():
+            db.write_columns(table, df)
+        db.close()
+    return run
+
+
+@benchmark('get_data_multi')
+def _get_data_multi(env: Environment) -> Callable[[], None]:
+    data_manager.data.clear()
+
+    def run():
+        data_manager.get_data_multi({EXCHANGE: env.symbols})
+    return run
+
+
+@benchmark('get_data_multi_cached')
+def _get_data_multi_cached(env: Environment) -> Callable[[], None]:
+    data_manager.get_data_multi({EXCHANGE: env.symbols})
+
+    def run():
+        data_manager.get_data_multi({EXCHANGE: env.symbols}, '2010-01-01', '2015-12-31')
+    return run
+
+
+@benchmark('processor_compute')
+def _processor_compute(env: Environment) -> Callable[[], None]:
+    processor = MovingAverageProcessor(20, 'Close')
+
+    def run():
+        for df in env.frames.values():
+            processor.compute(df)
+    return run
+
+
+@benchmark('indicator_compute')
+def _indicator_compute(env: Environment) -> Callable[[], None]:
+    processors = [EMAProcessor(20, 'Close'), RSIProcessor(), ATRProcessor(), BollingerProcessor()]
+
+    def run():
+        for processor in processors:
+            for df in env.frames.values():
+                processor.compute(df)
+    return run
+
+
+@benchmark('update_database')
+def _update_database(env: Environment) -> Callable[[], None]:
+    _remove_database('benchu')
+    with MetadataDatabase() as metadb:
+        metadb.write_exchange('benchu', '', pd.DataFrame({'symbol': env.symbols}))
+    clear_update_record('benchu')
+
+    def run():
+        update_database('benchu', threads=8, source=env.source)
+    return run
+
+
+def run_suite(n_symbols: int = 50, years: int = 5, repeat: int = 3, names: Iterable[str] = None,
+              workdir: str = None, verbose: bool = False) -> Dict:
+    """
+    Runs the benchmarks in a scratch working directory
+    :param n_symbols:
+    Number of symbols of the synthetic exchange. Default: 50
+    :param years:
+    Years of daily history per symbol. Default: 5
+    :param repeat:
+    Number of timed runs of every benchmark. Default: 3
+    :param names:
+    Benchmarks to run. Defaults to all
+    :param workdir:
+    Directory to run in, which is kept. Defaults to a temporary directory that is removed
+    :return:
+    A dictionary holding the parameters of the run under meta and, under results,
+    the timings of every benchmark in seconds
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown Benchmark {name}")
+    cwd = os.getcwd()
+    scratch = workdir is None
+    workdir = tempfile.mkdtemp(prefix='stock-bench-') if scratch else workdir
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    try:
+        env = Environment(n_symbols, years, workdir)
+        results = {}
+        for name in names:
+            times = []
+            for _ in range(repeat):
+                run = BENCHMARKS[name](env)
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+            results[name] = {'min': min(times), 'median': float(np.median(times)), 'times': times}
+            if verbose:
+                print(f"{name:<24}{min(times):>10.4f}s")
+    finally:
+        os.chdir(cwd)
+        if scratch:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {'meta': {'symbols': n_symbols, 'years': years, 'rows': env.rows(), 'repeat': repeat,
+                     'date': dt.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version, 'pandas': pd.__version__, 'numpy': np.__version__},
+            'results': results}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1) -> List[Tuple[str, float, float, float]]:
+    """
+    Compares the fastest run of every benchmark in both results
+    :param tolerance:
+    Fraction by which a benchmark may be slower than the baseline. Default: 0.1
+    :return:
+    The name, baseline time, current time and ratio of every benchmark slower than
+    the baseline by more than tolerance
+    """
+    regressions = []
+    for name, timing in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = timing['min'] / base['min'] if base['min'] else float('inf')
+        if ratio > 1 + tolerance:
+            regressions.append((name, base['min'], timing['min'], ratio))
+    return regressions
+
+
+def _load(path: Optional[str]) -> Optional[Dict]:
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Benchmarks the storage and ingestion paths on a synthetic exchange")
+    parser.add_argument('--symbols', type=int, default=50, help="Number of symbols. Default: 50")
+    parser.add_argument('--years', type=int, default=5, help="Years of history per symbol. Default: 5")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark. Default: 3")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Benchmarks to run. Default: all")
+    parser.add_argument('--workdir', help="Directory to run in. Default: a temporary directory")
+    parser.add_argument('--output', help="File to write the results to as JSON. Default: stdout")
+    parser.add_argument('--baseline', help="Results to compare against. Exits with status 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown against the baseline. Default: 0.1")
+    parser.add_argument('--save-baseline', action='store_true', help="Also write the results to the baseline file")
+    args = parser.parse_args()
+
+    res = run_suite(args.symbols, args.years, args.repeat, args.only, args.workdir, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2)
+    else:
+        print(json.dumps(res, indent=2))
+    baseline = _load(args.baseline)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(res, f, indent=2)
+    elif baseline is not None:
+        regressed = compare(res, baseline, args.tolerance)
+        for name, before, after, ratio in regressed:
+            print(f"REGRESSION {name}: {before:.4f}s -> {after:.4f}s ({ratio:.2f}x)")
+        sys.exit(1 if regressed else 0)
@@ -0,0 +1,218 @@
+from __future__ import annotations
+from stock.data.database import MetadataDatabase, ExchangeDatabase
+from stock.data import data_manager
+from stock.data.database_updater import _Writer, _plan_update, backoff_delay
+from stock.data.data_source import YahooDataSource
+from typing import Awaitable, Callable, Iterable, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlencode
+from functools import partial
+from io import StringIO
+import datetime as dt
+import asyncio
+import time
+import pandas as pd
+
+Fetch = Callable[[str, int, int, str], Union[Optional[pd.DataFrame], Awaitable[Optional[pd.DataFrame]]]]
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing rate acquisitions per second on average and bursts
+    of up to capacity acquisitions
+
+    === Representation Invariants ===
+    0 <= _tokens <= capacity
+    """
+    rate: float
+    capacity: float
+    _tokens: float
+    _last: float
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Creates a full bucket
+        :param rate:
+        Tokens added per second
+        :param capacity:
+        Maximum number of tokens. Defaults to rate, or 1 if rate is smaller
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it
+        """
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HttpCsvFetcher:
+    """
+    Downloads histories as CSV files from an HTTP server, one file per symbol at
+    <base_url>/<symbol>.csv, with Yahoo's Date, Open, High, Low, Close, Adj Close
+    and Volume columns. The range is passed as period1/period2 query parameters and
+    also applied to the result, so a static file server such as
+    python -m http.server can stand in for the remote service.
+    """
+    base_url: str
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    async def __call__(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        """
+        Downloads the history of symbol from start to end
+        :return:
+        A pandas DataFrame indexed by yyyy-mm-dd dates or None if the server
+        has no file for symbol
+        """
+        url = urlsplit(f"{self.base_url}/{symbol}.csv?{urlencode({'period1': start, 'period2': end, 'interval': interval})}")
+        port = url.port or (443 if url.scheme == 'https' else 80)
+        reader, writer = await asyncio.open_connection(url.hostname, port, ssl=url.scheme == 'https')
+        try:
+            writer.write(f"GET {url.path}?{url.query} HTTP/1.0\r\nHost: {url.netloc}\r\n\r\n".encode())
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        status = int(head.split(None, 2)[1])
+        if status == 404:
+            return None
+        if status != 200:
+            raise ConnectionError(f"HTTP {status} for {symbol}")
+        hist = pd.read_csv(StringIO(body.decode()), index_col='Date')
+        first = dt.datetime.fromtimestamp(start).strftime('%Y-%m-%d')
+        last = dt.datetime.fromtimestamp(end).strftime('%Y-%m-%d')
+        return hist[(first <= hist.index) & (hist.index < last)]
+
+
+async def download_all(symbols: Iterable[Tuple[str, str, int]], write: Callable[[str, Optional[pd.DataFrame]], None],
+                       end: int, fetch: Fetch = None, concurrency: int = 16,
+                       rate: float = None, attempts: int = 5, timeout: float = 30.0, interval: str = '1d',
+                       verbose: bool = False) -> None:
+    """
+    Downloads symbols with at most concurrency downloads in flight and passes
+    every result to write on the event loop, one at a time.
+    :param symbols:
+        Tuples of the symbol to write, the symbol to download and the timestamp
+        to download from
+    :param write:
+        Called with the symbol and its history, or None if every attempt failed
+    :param fetch:
+        Downloads one history. May be a plain function or DataSource, which is run
+        in a thread, or a coroutine function. Default: Yahoo Finance
+    :param rate:
+        Maximum number of requests per second. Unlimited if unspecified
+    :param attempts:
+        Number of attempts per symbol. Failed attempts are retried after a jittered
+        exponential backoff
+    :param timeout:
+        Seconds after which an attempt is abandoned
+    """
+    fetch = fetch if fetch is not None else YahooDataSource()
+    loop = asyncio.get_event_loop()
+    bucket = TokenBucket(rate) if rate else None
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    symbols = iter(symbols)
+    executor = None if asyncio.iscoroutinefunction(fetch) or asyncio.iscoroutinefunction(getattr(fetch, '__call__', None)) \
+        else ThreadPoolExecutor(concurrency)
+
+    async def attempt(query: str, start: int) -> Optional[pd.DataFrame]:
+        if executor is None:
+            return await fetch(query, start, end, interval)
+        return await loop.run_in_executor(executor, partial(fetch, query, start, end, interval))
+
+    async def download() -> None:
+        for symbol, query, start in symbols:
+            if verbose:
+                print(f"Downloading {query}")
+            hist = None
+            for i in range(attempts):
+                if bucket is not None:
+                    await bucket.acquire()
+                try:
+                    hist = await asyncio.wait_for(attempt(query, start), timeout)
+                    break
+                except Exception as e:
+                    if verbose:
+                        print(f"Reattempting {query}. Attempt {i + 1}: {e!r}")
+                    if i + 1 < attempts:
+                        await asyncio.sleep(backoff_delay(i))
+            await queue.put((symbol, hist))
+
+    async def writer() -> None:
+        while True:
+            symbol, hist = await queue.get()
+            if symbol is None:
+                return
+            if verbose:
+                print(f"Writing {symbol}")
+            write(symbol, hist)
+
+    write_task = asyncio.ensure_future(writer())
+    downloads = asyncio.gather(*(download() for _ in range(concurrency)))
+    try:
+        await asyncio.wait((downloads, write_task), return_when=asyncio.FIRST_COMPLETED)
+        if write_task.done():
+            # The writer only stops early on an error, which is raised here
+            write_task.result()
+        await downloads
+        await queue.put((None, None))
+        await write_task
+    finally:
+        downloads.cancel()
+        write_task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def update_database_async(exchange: str, start_date: str = None, fetch: Fetch = None, concurrency: int = 16,
+                          rate: float = None, attempts: int = 5, timeout: float = 30.0, verbose: bool = False) -> None:
+    """
+    Updates the database corresponding to exchange with downloads driven by an
+    event loop. Results are written as they arrive.
+    :param exchange:
+        The exchange for which data should be updated
+    :param start_date:
+        The starting date for updating every symbol. If unspecified, every symbol is
+        updated from the day after its watermark, symbols already attempted today are
+        skipped and new symbols are downloaded from 1970-01-01
+    :param fetch:
+        Downloads one history. See download_all. Default: Yahoo Finance
+    :param concurrency:
+        Maximum number of downloads in flight. Default: 16
+    :param rate:
+        Maximum number of requests per second. Unlimited if unspecified
+    :param attempts:
+        Number of attempts per symbol. Default: 5
+    :param timeout:
+        Seconds after which an attempt is abandoned. Default: 30
+    :param verbose:
+        Whether or not to print the task that is currently being processed.
+        Default: False
+    """
+    with MetadataDatabase() as metadb:
+        ext, plan, end = _plan_update(metadb, exchange, start_date)
+        if plan:
+            with ExchangeDatabase(exchange) as exdb, exdb.bulk_load():
+                writer = _Writer(exchange, exdb, metadb)
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(download_all(((symbol, f'{symbol}.{ext}' if ext else symbol, start) for symbol, start in plan),
+                                                         writer.write, end, fetch, concurrency, rate,
+                                                         attempts, timeout, verbose=verbose))
+                finally:
+                    loop.close()
+                writer.commit()
+            data_manager.invalidate(exchange)
+        metadb.write_exchange_update_date(exchange, dt.datetime.today().strftime('%Y-%m-%d'))
@@ -0,0 +1,233 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Tuple
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import threading
+import sys
+
+
+class DataCache:
+    """
+    Least recently used cache bounded by the memory used by its values.
+    Data frames are measured with memory_usage(deep=True).
+
+    When the values held exceed max_bytes, the least recently used entries are
+    evicted and every listener is called with the evicted key and value. The
+    most recently stored entry is never evicted, even if it is larger than
+    max_bytes on its own.
+
+    === Representation Invariants ===
+    nbytes is the sum of the sizes stored in _entries
+    _entries is ordered from least to most recently used
+    """
+    max_bytes: int
+    nbytes: int
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict
+    _listeners: List[Callable[[Hashable, Any], None]]
+    _lock: threading.RLock
+
+    def __init__(self, max_bytes: int = 2 ** 30):
+        """
+        Creates an empty cache
+        :param max_bytes:
+        Memory budget of the cache. Default: 1 GiB
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value of key and marks it as recently used, or default
+        if key is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Stores value under key, evicting least recently used entries if the
+        budget is exceeded
+        """
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            evicted = self._evict()
+        self._notify(evicted)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes key from the cache without notifying listeners
+        :return:
+        The value of key or default if key is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.nbytes -= size
+            return value
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        Sets the memory budget, evicting entries if needed
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            evicted = self._evict()
+        self._notify(evicted)
+
+    def clear(self) -> None:
+        """
+        Removes every entry without notifying listeners
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def add_listener(self, listener: Callable[[Hashable, Any], None]) -> None:
+        """
+        Registers listener to be called with the key and value of every evicted entry.
+        Listeners are called after the cache is unlocked, so they may use it.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit, miss and eviction counts and the memory usage of the cache
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def view(self, owner: Hashable) -> CacheView:
+        """
+        Returns a dictionary like view of the entries stored under owner
+        """
+        return CacheView(self, owner)
+
+    def _evict(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Evicts least recently used entries until the budget is met
+
+        Precondition:
+        _lock is held
+        :return:
+        The key and value of every evicted entry
+        """
+        evicted = []
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            key, (value, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def _notify(self, evicted: List[Tuple[Hashable, Any]]) -> None:
+        """
+        Calls every listener with the key and value of every evicted entry
+
+        Precondition:
+        _lock is not held
+        """
+        if not evicted:
+            return
+        with self._lock:
+            listeners = list(self._listeners)
+        for key, value in evicted:
+            for listener in listeners:
+                listener(key, value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.put(key, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Returns a snapshot of the cached entries, from least to most recently used
+        """
+        with self._lock:
+            return [(key, value) for key, (value, size) in self._entries.items()]
+
+
+class CacheView:
+    """
+    Dictionary like view of the entries of a DataCache stored under (owner, key)
+    """
+    cache: DataCache
+    owner: Hashable
+
+    def __init__(self, cache: DataCache, owner: Hashable):
+        self.cache = cache
+        self.owner = owner
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.cache.get((self.owner, key), default)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self.cache.pop((self.owner, key), default)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Returns a snapshot of the entries stored under owner
+        """
+        return [(key[1], value) for key, value in self.cache.items()
+                if isinstance(key, tuple) and len(key) == 2 and key[0] is self.owner]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return (self.owner, key) in self.cache
+
+    def __getitem__(self, key: Hashable) -> Any:
+        return self.cache[(self.owner, key)]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.cache.put((self.owner, key), value)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter([key for key, value in self.items()])
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+
+def _sizeof(value: Any) -> int:
+    """
+    Returns the memory used by value in bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
@@ -0,0 +1,283 @@
+from __future__ import annotations
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+import json
+import os
+
+
+class ColumnarStore:
+    """
+    Memory mapped, fixed width columnar copy of an exchange database.
+
+    Every field is stored in its own flat binary file and the rows of a symbol
+    are kept contiguous and sorted by date. index.json maps every symbol to the
+    offset, length and capacity of its segment, so reading a symbol is a slice of
+    a np.memmap and no data is copied.
+
+    Segments are allocated with room to grow, so rows appended after the last
+    date of a symbol are written in place. A segment that is rewritten, or
+    outgrows its capacity, is moved to the end of the files, and the files are
+    compacted once most of their rows belong to no segment.
+
+    === Representation Invariants ===
+    Every field file holds at least _rows rows. Rows past _rows are garbage
+    left by an interrupted write and are truncated before the next write.
+    Every (offset, length, capacity) in _index satisfies length <= capacity and
+    offset + capacity <= _rows. Rows of a segment past its length are free
+    """
+    FIELDS: Dict[str, str] = {'Date': 'datetime64[D]', 'Open': 'float64', 'High': 'float64', 'Low': 'float64',
+                              'Close': 'float64', 'Adj Close': 'float64', 'Volume': 'float64'}
+    _dir: str
+    _index: Dict[str, Tuple[int, int, int]]
+    _rows: int
+    _mtime: Optional[int]
+    _maps: Dict[str, np.memmap]
+
+    def __init__(self, exchange: str, path: str = 'findata/'):
+        """
+        Creates a columnar store for exchange. Files are kept in
+        path/<exchange>.columns/
+        :param exchange:
+        Name of the exchange
+        :param path:
+        Path to database. Default: 'findata/'
+        """
+        self._dir = os.path.join(path, exchange.lower() + '.columns')
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        self._index = {}
+        self._rows = 0
+        self._mtime = None
+        self._maps = {}
+        self.refresh()
+
+    def _file(self, field: str, suffix: str = '') -> str:
+        return os.path.join(self._dir, field + '.bin' + suffix)
+
+    @property
+    def _index_file(self) -> str:
+        return os.path.join(self._dir, 'index.json')
+
+    def refresh(self) -> None:
+        """
+        Reloads the symbol index if it was changed by another writer
+        """
+        try:
+            mtime = os.stat(self._index_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self._index_file) as f:
+                meta = json.load(f)
+            # Stores written before segments had a capacity hold (offset, length)
+            self._index = {symbol: (loc[0], loc[1], loc[2] if len(loc) > 2 else loc[1])
+                           for symbol, loc in meta['index'].items()}
+            self._rows = meta['rows']
+            self._mtime = mtime
+            self._maps = {}
+
+    def _save_index(self) -> None:
+        with open(self._index_file + '.tmp', 'w') as f:
+            json.dump({'rows': self._rows, 'index': self._index}, f)
+        os.replace(self._index_file + '.tmp', self._index_file)
+        self._mtime = os.stat(self._index_file).st_mtime_ns
+        self._maps = {}
+
+    def _map(self, field: str) -> np.memmap:
+        if field not in self._maps:
+            self._maps[field] = np.memmap(self._file(field), dtype=self.FIELDS[field], mode='r', shape=(self._rows,))
+        return self._maps[field]
+
+    @staticmethod
+    def exists(exchange: str, path: str = 'findata/') -> bool:
+        """
+        Returns True iff a columnar copy of exchange was built in path
+        """
+        return os.path.exists(os.path.join(path, exchange.lower() + '.columns', 'index.json'))
+
+    def symbols(self) -> Tuple[str]:
+        """
+        Returns the symbols held in this store
+        """
+        self.refresh()
+        return tuple(self._index)
+
+    def have_symbol(self, symbol: str) -> bool:
+        """
+        Returns True iff symbol is held in this store
+        """
+        self.refresh()
+        return symbol in self._index
+
+    def read_symbol(self, symbol: str, start_date: str = None, end_date: str = None,
+                    fields: Iterable[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Reads the data of symbol from start_date to end_date inclusive. The returned
+        arrays are read only views into the memory mapped files.
+        :param fields:
+        Fields to read. Defaults to all fields
+        :return:
+        A dictionary mapping field names to arrays. Date is a datetime64[D] array
+        """
+        self.refresh()
+        if symbol not in self._index:
+            raise KeyError(f"Symbol {symbol} Not In Columnar Store")
+        if fields is None:
+            fields = self.FIELDS
+        offset, length, _ = self._index[symbol]
+        if length == 0:
+            return {field: np.empty(0, dtype=self.FIELDS[field]) for field in fields}
+        dates = self._map('Date')[offset:offset + length]
+        lo = 0 if start_date is None else dates.searchsorted(_to_day(start_date), 'left')
+        hi = length if end_date is None else dates.searchsorted(_to_day(end_date), 'right')
+        return {field: self._map(field)[offset + lo:offset + hi] for field in fields}
+
+    def write_symbol(self, symbol: str, df: pd.DataFrame) -> None:
+        """
+        Replaces the data of symbol with df. df is indexed by date and has a
+        column for every field other than Date.
+        """
+        self.refresh()
+        self._append(symbol, self._arrays(df))
+        self._save_index()
+
+    def update_symbol(self, symbol: str, df: pd.DataFrame) -> None:
+        """
+        Merges df into the data of symbol, its rows replacing the stored rows of the
+        same dates, as an INSERT OR REPLACE into the symbol table does. Rows after
+        the last stored date are written in place while the segment has room, so
+        appending a bar costs O(1). Symbols not held are written with write_symbol.
+        """
+        self.refresh()
+        if symbol not in self._index:
+            self.write_symbol(symbol, df)
+            return
+        new = self._arrays(df)
+        count = len(new['Date'])
+        if count == 0:
+            return
+        offset, length, capacity = self._index[symbol]
+        if length == 0 or new['Date'][0] > self._map('Date')[offset + length - 1]:
+            if length + count <= capacity:
+                self._write(offset + length, new)
+                self._index[symbol] = (offset, length + count, capacity)
+            else:
+                self._append(symbol, {field: np.concatenate([self._map(field)[offset:offset + length], new[field]])
+                                      for field in self.FIELDS})
+        else:
+            dates = self._map('Date')[offset:offset + length]
+            kept = ~np.isin(dates, new['Date'])
+            merged = {field: np.concatenate([self._map(field)[offset:offset + length][kept], new[field]])
+                      for field in self.FIELDS}
+            order = np.argsort(merged['Date'], kind='stable')
+            self._append(symbol, {field: array[order] for field, array in merged.items()})
+        self._save_index()
+
+    def rebuild(self, frames: Iterable[Tuple[str, pd.DataFrame]]) -> None:
+        """
+        Replaces the content of this store with frames, an iterable of
+        (symbol, data) pairs, compacting away stale segments.
+        """
+        self._replace(((symbol, self._arrays(df)) for symbol, df in frames))
+
+    def compact(self) -> None:
+        """
+        Rewrites the files with only the rows of the segments of every symbol
+        """
+        self.refresh()
+        self._replace((symbol, {field: self._map(field)[offset:offset + length] for field in self.FIELDS})
+                      for symbol, (offset, length, _) in list(self._index.items()))
+
+    def _arrays(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Returns the rows of df sorted by date as an array per field
+        """
+        df = df.sort_index()
+        arrays = {'Date': pd.to_datetime(df.index).values.astype('datetime64[D]')}
+        for field in self.FIELDS:
+            if field != 'Date':
+                arrays[field] = df[field].to_numpy(dtype=self.FIELDS[field], na_value=np.nan)
+        return arrays
+
+    def _write(self, offset: int, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Writes arrays at row offset of the files
+        """
+        for field, array in arrays.items():
+            with open(self._file(field), 'r+b') as f:
+                f.seek(offset * np.dtype(self.FIELDS[field]).itemsize)
+                f.write(np.ascontiguousarray(array, dtype=self.FIELDS[field]).tobytes())
+
+    def _append(self, symbol: str, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Writes arrays to a new segment of symbol at the end of the files, compacting
+        them first if most of their rows are free. Does not save the index.
+        """
+        length = len(arrays['Date'])
+        capacity = _capacity(length)
+        if symbol in self._index:
+            # Copied first, since the old segment may be moved by the compaction
+            arrays = {field: np.array(array) for field, array in arrays.items()}
+            del self._index[symbol]
+        if self._rows > 2 * sum(loc[2] for loc in self._index.values()) + capacity:
+            self.compact()
+        for field, array in arrays.items():
+            itemsize = np.dtype(self.FIELDS[field]).itemsize
+            with open(self._file(field), 'ab') as f:
+                f.truncate(self._rows * itemsize)
+                array.astype(self.FIELDS[field], copy=False).tofile(f)
+                f.truncate((self._rows + capacity) * itemsize)
+        self._index[symbol] = (self._rows, length, capacity)
+        self._rows += capacity
+
+    def _replace(self, segments: Iterable[Tuple[str, Dict[str, np.ndarray]]]) -> None:
+        """
+        Replaces the files and the index with segments, (symbol, arrays) pairs
+        """
+        index = {}
+        rows = 0
+        files = {field: open(self._file(field, '.new'), 'wb') for field in self.FIELDS}
+        try:
+            for symbol, arrays in segments:
+                length = len(arrays['Date'])
+                capacity = _capacity(length)
+                for field, f in files.items():
+                    f.write(np.ascontiguousarray(arrays[field], dtype=self.FIELDS[field]).tobytes())
+                    f.write(bytes((capacity - length) * np.dtype(self.FIELDS[field]).itemsize))
+                index[symbol] = (rows, length, capacity)
+                rows += capacity
+        finally:
+            for f in files.values():
+                f.close()
+        for field in self.FIELDS:
+            os.replace(self._file(field, '.new'), self._file(field))
+        self._index = index
+        self._rows = rows
+        self._save_index()
+
+
+def _capacity(length: int) -> int:
+    """
+    Returns the number of rows allocated to a segment of length rows, leaving
+    room for about a year of daily bars, or a quarter of length if more
+    """
+    return length + max(256, length // 4)
+
+def _to_day(date: str) -> np.datetime64:
+    """
+    Converts a yyyy-mm-dd string to a day. Out of range sentinels such as
+    '0000-00-00' and '9999-99-99' are clamped to the smallest or largest day
+    """
+    try:
+        return np.datetime64(date, 'D')
+    except ValueError:
+        return np.datetime64(-2 ** 62, 'D') if date < '1970-01-01' else np.datetime64(2 ** 62, 'D')
+
+
+if __name__ == '__main__':
+    import sys
+    from stock.data.database import ExchangeDatabase
+    for exchange in sys.argv[1:]:
+        with ExchangeDatabase(exchange, columnar=True) as exdb:
+            exdb.rebuild_columns()
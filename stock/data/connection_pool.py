@@ -0,0 +1,124 @@
+from __future__ import annotations
+from typing import Callable, Iterator, List, Tuple
+from contextlib import contextmanager
+from stock.data.database import RwDatabase
+import threading
+import time
+
+
+class DatabasePool:
+    """
+    Pool of read only database objects that can be checked out by any thread.
+
+    Databases are created on demand by factory, which should return an open
+    RwDatabase (or subclass) created with read_only=True. Once the writer has put
+    the database file in WAL mode (see ExchangeDatabase.bulk_load), readers never
+    block on it.
+
+    === Representation Invariants ===
+    len(_idle) + _checked_out <= max_size, or _idle is empty if max_size was
+    lowered below _checked_out
+    _idle is ordered by the time each database was checked in
+    """
+    max_size: int
+    idle_timeout: float
+    _factory: Callable[[], RwDatabase]
+    _idle: List[Tuple[RwDatabase, float]]
+    _checked_out: int
+    _cond: threading.Condition
+
+    def __init__(self, factory: Callable[[], RwDatabase], max_size: int = 8, idle_timeout: float = 300.0):
+        """
+        Creates a pool
+        :param factory:
+        Callable returning a new open read only database
+        :param max_size:
+        Maximum number of databases open at once. Default: 8
+        :param idle_timeout:
+        Seconds after which an idle database is closed. Default: 300
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._idle = []
+        self._checked_out = 0
+        self._cond = threading.Condition()
+
+    def checkout(self, timeout: float = None) -> RwDatabase:
+        """
+        Checks out a database. Blocks while max_size databases are checked out.
+        :param timeout:
+        Seconds to wait for a database. Waits forever if unspecified
+        :return:
+        An open database that must be returned with checkin
+        """
+        with self._cond:
+            self.evict_idle()
+            if not self._cond.wait_for(lambda: self._idle or self._checked_out < self.max_size, timeout):
+                raise TimeoutError("No Database Available In Pool")
+            self._checked_out += 1
+            if self._idle:
+                return self._idle.pop()[0]
+        try:
+            return self._factory()
+        except BaseException:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, db: RwDatabase) -> None:
+        """
+        Returns a database checked out from this pool
+        """
+        with self._cond:
+            self._checked_out -= 1
+            if len(self._idle) + self._checked_out < self.max_size:
+                self._idle.append((db, time.monotonic()))
+            else:
+                # max_size was lowered while db was checked out
+                db.close(commit=False)
+            self.evict_idle()
+            self._cond.notify()
+
+    @contextmanager
+    def database(self, timeout: float = None) -> Iterator[RwDatabase]:
+        """
+        Checks out a database for the duration of the with block
+        """
+        db = self.checkout(timeout)
+        try:
+            yield db
+        finally:
+            self.checkin(db)
+
+    def resize(self, max_size: int, idle_timeout: float = None) -> None:
+        """
+        Sets max_size and, if specified, idle_timeout. Idle databases above the new
+        size are closed, oldest first, and so are databases checked in above it.
+        """
+        with self._cond:
+            self.max_size = max_size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            while self._idle and len(self._idle) + self._checked_out > max_size:
+                self._idle.pop(0)[0].close(commit=False)
+            self.evict_idle()
+            self._cond.notify_all()
+
+    def evict_idle(self) -> None:
+        """
+        Closes databases that have been idle for longer than idle_timeout
+        """
+        with self._cond:
+            deadline = time.monotonic() - self.idle_timeout
+            while self._idle and self._idle[0][1] < deadline:
+                self._idle.pop(0)[0].close(commit=False)
+
+    def close(self) -> None:
+        """
+        Closes all idle databases
+        """
+        with self._cond:
+            while self._idle:
+                self._idle.pop()[0].close(commit=False)
@@ -1,24 +1,126 @@
-from typing import Iterable, Dict, Union, Tuple
+from typing import Iterable, Dict, Optional, Tuple
+import numpy as np
 import pandas as pd
 from stock.data.database import MetadataDatabase, ExchangeDatabase
+from stock.data.columnar_store import ColumnarStore
+from stock.data.connection_pool import DatabasePool
+from stock.data.cache import DataCache
+from stock.data.date_index import normalize, slice_dates
+import threading
 import atexit
 
-databases: Dict[str, Union[MetadataDatabase, ExchangeDatabase]] = {}
-data: Dict[str, Union[tuple, pd.DataFrame]] = {}
+pools: Dict[str, DatabasePool] = {}
+pool_size: int = 8
+pool_idle_timeout: float = 300.0
+stores: Dict[str, ColumnarStore] = {}
+data: DataCache = DataCache()
+_pools_lock = threading.Lock()
+_stores_lock = threading.Lock()
+
+
+def configure_pool(max_size: int = 8, idle_timeout: float = 300.0) -> None:
+    """
+    Sets the size limit and idle timeout of the read only connection pool
+    kept for every database. Applies to pools already created, closing their
+    idle connections above a lower limit.
+    """
+    global pool_size, pool_idle_timeout
+    with _pools_lock:
+        pool_size = max_size
+        pool_idle_timeout = idle_timeout
+        for pool in pools.values():
+            pool.resize(max_size, idle_timeout)
+
+
+def cache_stats() -> Dict[str, int]:
+    """
+    Returns the hit, miss and eviction counts and the memory usage of the cache
+    shared by data_manager and all processors
+    """
+    return data.stats()
+
+
+def _pool(exchange: str) -> DatabasePool:
+    """
+    Returns the read only connection pool of exchange, or of the metadata
+    database if exchange is 'meta'
+    """
+    with _pools_lock:
+        if exchange not in pools:
+            if exchange == 'meta':
+                factory = lambda: MetadataDatabase(read_only=True)
+            else:
+                factory = lambda: ExchangeDatabase(exchange, read_only=True)
+            pools[exchange] = DatabasePool(factory, pool_size, pool_idle_timeout)
+        return pools[exchange]
+
+
+def _store(exchange: str) -> Optional[ColumnarStore]:
+    """
+    Returns the columnar store of exchange, or None if no columnar copy of exchange
+    was built. Nothing is created on disk.
+    """
+    with _stores_lock:
+        if exchange not in stores:
+            if not ColumnarStore.exists(exchange):
+                return None
+            stores[exchange] = ColumnarStore(exchange)
+        return stores[exchange]
+
+
+def invalidate(exchange: str, symbol: str = None) -> None:
+    """
+    Drops the cached stock data of symbol in exchange, or of every symbol in
+    exchange, so it is read again after the database was updated. Results of
+    processors are kept and extended with the new bars when they are next read,
+    or recomputed if earlier bars changed.
+    """
+    prefix = exchange + '/'
+    for key, value in data.items():
+        if isinstance(key, str) and (key == prefix + symbol if symbol is not None else key.startswith(prefix)):
+            data.pop(key)
 
 
 def get_data(exchange: str, symbol: str, start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> pd.DataFrame:
     """
     Returns the stock data of symbol in exchange from start_date to end_date inclusive
     :return:
-    A pandas DataFrame containing the data
+    A pandas DataFrame indexed by a sorted DatetimeIndex containing the data
+    """
+    return slice_dates(get_frame(exchange, symbol), start_date, end_date)
+
+
+def get_frame(exchange: str, symbol: str) -> pd.DataFrame:
+    """
+    Returns all stock data of symbol in exchange as the cached data frame itself,
+    the same object until it is read again, so results derived from it can be
+    kept by its identity. It must not be modified.
+    :return:
+    A pandas DataFrame indexed by a sorted DatetimeIndex containing the data
+    """
+    df = data.get(exchange + '/' + symbol)
+    if df is None:
+        with _pool(exchange).database() as db:
+            df = normalize(db.read_stock_data(symbol))
+        data[exchange + '/' + symbol] = df
+    return df
+
+
+def get_arrays(exchange: str, symbol: str, start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> Dict[str, np.ndarray]:
+    """
+    Returns the stock data of symbol in exchange from start_date to end_date inclusive as
+    read only views into the columnar store of exchange. Symbols missing from the columnar
+    store are read from the exchange database instead.
+    :return:
+    A dictionary mapping field names to arrays. Date is a datetime64[D] array
     """
-    if exchange not in databases:
-        databases[exchange] = ExchangeDatabase(exchange)
-    if exchange + '/' + symbol not in data:
-        data[exchange + '/' + symbol] = databases[exchange].read_stock_data(symbol)
-    df = data[exchange + '/' + symbol]
-    return df[(start_date <= df.index) & (df.index <= end_date)]
+    store = _store(exchange)
+    if store is not None and store.have_symbol(symbol):
+        return store.read_symbol(symbol, start_date, end_date)
+    df = get_data(exchange, symbol, start_date, end_date)
+    res = {'Date': pd.to_datetime(df.index).values.astype('datetime64[D]')}
+    res.update((column, df[column].to_numpy()) for column in df.columns)
+    return res
 
 
 def get_data_multi(symbols: Dict[str, Iterable[str]], start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> Dict[str, Dict[str, pd.DataFrame]]:
@@ -35,15 +137,66 @@ def get_data_multi(symbols: Dict[str, Iterable[str]], start_date: str = '0000-00
     return res
 
 
+def get_panel(exchange: str, symbols: Iterable[str], fields: Iterable[str] = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'),
+              start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> pd.DataFrame:
+    """
+    Returns the stock data of symbols in exchange from start_date to end_date inclusive,
+    aligned on the union of their dates. Built in one pass over the exchange database
+    and not cached.
+    :param fields:
+    The columns to read
+    :return:
+    A pandas DataFrame indexed by a sorted DatetimeIndex with (field, symbol) columns. panel['Close'] is a
+    dates x symbols frame. Dates on which a symbol has no data are NaN.
+    """
+    symbols = list(symbols)
+    fields = list(fields)
+    with _pool(exchange).database() as db:
+        long = db.read_panel(symbols, fields, start_date, end_date)
+    res = normalize(long.pivot(index='Date', columns='Symbol', values=fields))
+    return res.reindex(columns=pd.MultiIndex.from_product([fields, symbols]))
+
+
+def get_snapshot(exchange: str, symbols: Iterable[str] = None) -> pd.DataFrame:
+    """
+    Returns the last bar and rolling statistics of symbols in exchange, or of every
+    symbol if unspecified, from the snapshot table kept by update_database. Not cached.
+    :return:
+    A pandas DataFrame indexed by symbol with the columns of ExchangeDatabase.SNAPSHOT_COLUMNS
+    """
+    with _pool(exchange).database() as db:
+        return db.read_snapshot(symbols)
+
+
+def screen(exchange: str, by: str = 'v_change', n: int = 50, ascending: bool = False,
+           bounds: Dict[str, Tuple[Optional[float], Optional[float]]] = None) -> pd.DataFrame:
+    """
+    Returns the n symbols of exchange with the largest values of by in the snapshot
+    table, or the smallest if ascending, with one indexed query
+    :param by:
+    A column of ExchangeDatabase.SNAPSHOT_COLUMNS. Default: v_change, the volume less
+    its 5 bar moving average
+    :param bounds:
+    A dictionary mapping columns to inclusive lower and upper bounds, None leaving a
+    side unbounded. screen('cse', bounds={'change': (0, None)}) only keeps symbols
+    whose close did not fall
+    :return:
+    A pandas DataFrame indexed by symbol, sorted by by
+    """
+    with _pool(exchange).database() as db:
+        return db.top_snapshot(by, n, ascending, bounds)
+
+
 def get_exchange_list() -> Tuple[str]:
     """
     Return a tuple containing the name of all exchanges
     """
-    if 'meta' not in databases:
-        databases['meta'] = MetadataDatabase()
-    if 'cplist' not in data:
-        data['cplist'] = databases['meta'].get_exchange_list()
-    return data['cplist']
+    res = data.get('cplist')
+    if res is None:
+        with _pool('meta').database() as db:
+            res = db.get_exchange_list()
+        data['cplist'] = res
+    return res
 
 
 def get_company_list(exchange: str) -> pd.DataFrame:
@@ -53,11 +206,12 @@ def get_company_list(exchange: str) -> pd.DataFrame:
     :return:
     A pandas DataFrame containing the companylist table
     """
-    if 'meta' not in databases:
-        databases['meta'] = MetadataDatabase()
-    if 'cplist' + exchange not in data:
-        data['cplist' + exchange] = databases['meta'].get_company_list(exchange)
-    return data['cplist' + exchange]
+    res = data.get('cplist' + exchange)
+    if res is None:
+        with _pool('meta').database() as db:
+            res = db.get_company_list(exchange)
+        data['cplist' + exchange] = res
+    return res
 
 
 @atexit.register
@@ -65,8 +219,8 @@ def _cleanup():
     """
     Closes all databases. Should not be called manually and only invoked on exit
     """
-    for db in databases.values():
-        db.close()
+    for pool in pools.values():
+        pool.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,226 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional
+import datetime as dt
+import numpy as np
+import pandas as pd
+import zlib
+import time
+import os
+
+
+class DataSource(ABC):
+    """
+    Source of price histories consumed by the database updaters.
+
+    A history is a pandas DataFrame indexed by yyyy-mm-dd date strings named Date,
+    with Yahoo's Open, High, Low, Close, Adj Close and Volume columns. Ranges are
+    given as unix timestamps, start inclusive and end exclusive.
+
+    Sources are called from several threads at once and must be thread safe.
+    Calling a source downloads a history, so a source can be passed anywhere a
+    fetch function is expected.
+    """
+
+    @abstractmethod
+    def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        """
+        Downloads the history of symbol from start to end. Errors are raised so
+        the caller can retry.
+        :return:
+        The history of symbol, empty if it has no data in the range, or None if
+        the source does not know symbol
+        """
+        pass
+
+    def __call__(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        return self.download(symbol, start, end, interval)
+
+
+class YahooDataSource(DataSource):
+    """
+    Downloads histories from Yahoo Finance with fix_yahoo_finance, which is only
+    imported on the first download
+    """
+
+    def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        """
+        Downloads the history of symbol from Yahoo Finance. The crumb is refreshed
+        before any error is raised so the next attempt uses a new one.
+        """
+        import fix_yahoo_finance as yf
+        try:
+            yf.get_yahoo_crumb()
+            hist = yf.download_one(symbol, start, end, interval)
+        except Exception:
+            yf.get_yahoo_crumb(force=True)
+            raise
+        if not isinstance(hist, pd.DataFrame):
+            return None
+        if not hist.empty:
+            hist.reset_index(inplace=True)
+            hist['Date'] = hist['Date'].dt.strftime('%Y-%m-%d')
+            hist.set_index('Date', inplace=True)
+        return hist
+
+
+class ReplayDataSource(DataSource):
+    """
+    Serves histories from fixture files, <directory>/<symbol>.csv or
+    <directory>/<symbol>.parquet, after a configurable delay. Files are read on
+    every download so the cost of the source is paid like a remote one would be.
+    Parquet fixtures need pyarrow or fastparquet.
+    """
+    directory: str
+    latency: float
+    jitter: float
+
+    def __init__(self, directory: str, latency: float = 0.0, jitter: float = 0.0):
+        """
+        :param directory:
+        Directory holding the fixtures
+        :param latency:
+        Seconds every download takes at least. Default: 0
+        :param jitter:
+        Maximum number of seconds added at random to latency. Default: 0
+        """
+        if not os.path.isdir(directory):
+            raise ValueError("Fixture Directory Not Found")
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+
+    def symbols(self) -> List[str]:
+        """
+        Returns the symbols that have a fixture
+        """
+        return sorted({os.path.splitext(name)[0] for name in os.listdir(self.directory)
+                       if name.endswith(('.csv', '.parquet'))})
+
+    def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        delay = self.latency + (np.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        path = os.path.join(self.directory, symbol)
+        if os.path.exists(path + '.parquet'):
+            hist = pd.read_parquet(path + '.parquet')
+            if 'Date' in hist.columns:
+                hist = hist.set_index('Date')
+        elif os.path.exists(path + '.csv'):
+            hist = pd.read_csv(path + '.csv', index_col='Date')
+        else:
+            return None
+        hist.index = pd.Index(pd.to_datetime(hist.index).strftime('%Y-%m-%d'), name='Date')
+        return _date_range(hist, start, end)
+
+
+class SyntheticDataSource(DataSource):
+    """
+    Generates geometric random walk histories for n_symbols symbols named
+    SYN00000, SYN00001, ... on every business day from first_date.
+
+    The history of a symbol only depends on the seed and the symbol, so repeated
+    and incremental downloads agree with each other.
+    """
+    n_symbols: int
+    first_date: str
+    seed: int
+    price: float
+    volatility: float
+    latency: float
+
+    def __init__(self, n_symbols: int = 100, first_date: str = '2000-01-03', seed: int = 0,
+                 price: float = 100.0, volatility: float = 0.02, latency: float = 0.0):
+        """
+        :param n_symbols:
+        Number of symbols generated. Default: 100
+        :param first_date:
+        First date of every history. Default: 2000-01-03
+        :param seed:
+        Seed of the generator. Default: 0
+        :param price:
+        Opening price of every history. Default: 100
+        :param volatility:
+        Standard deviation of the daily log returns. Default: 0.02
+        :param latency:
+        Seconds every download takes at least. Default: 0
+        """
+        if n_symbols < 0:
+            raise ValueError("Number Of Symbols Must Be Non Negative")
+        self.n_symbols = n_symbols
+        self.first_date = first_date
+        self.seed = seed
+        self.price = price
+        self.volatility = volatility
+        self.latency = latency
+
+    def symbols(self) -> List[str]:
+        """
+        Returns the generated symbols
+        """
+        return [f'SYN{i:05d}' for i in range(self.n_symbols)]
+
+    def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        if not (symbol.startswith('SYN') and symbol[3:].isdigit() and int(symbol[3:]) < self.n_symbols):
+            return None
+        if self.latency:
+            time.sleep(self.latency)
+        last = dt.datetime.fromtimestamp(end) - dt.timedelta(days=1)
+        dates = pd.bdate_range(self.first_date, max(last, pd.Timestamp(self.first_date) - pd.Timedelta(days=1)))
+        # Rows are drawn in order, so the first rows do not depend on end
+        noise = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())]).standard_normal((len(dates), 4))
+        close = self.price * np.exp(np.cumsum(noise[:, 0] * self.volatility))
+        open_ = np.concatenate(([self.price], close[:-1])) * np.exp(noise[:, 1] * self.volatility / 4)
+        spread = np.abs(noise[:, 2]) * self.volatility / 2
+        hist = pd.DataFrame({'Open': open_,
+                             'High': np.maximum(open_, close) * (1 + spread),
+                             'Low': np.minimum(open_, close) * (1 - spread),
+                             'Close': close,
+                             'Adj Close': close,
+                             'Volume': np.round(1e6 * np.exp(noise[:, 3] / 2)).astype(np.int64)},
+                            index=pd.Index(dates.strftime('%Y-%m-%d'), name='Date'))
+        return _date_range(hist, start, end)
+
+
+def write_fixtures(directory: str, source: DataSource, symbols: Iterable[str], start: int, end: int,
+                   file_format: str = 'csv') -> List[str]:
+    """
+    Downloads symbols from source and saves them as fixtures for a ReplayDataSource
+    :param file_format:
+    'csv' or 'parquet'. Default: csv
+    :return:
+    The symbols saved
+    """
+    if file_format not in ('csv', 'parquet'):
+        raise ValueError("File Format Must Be csv Or parquet")
+    os.makedirs(directory, exist_ok=True)
+    saved = []
+    for symbol in symbols:
+        hist = source.download(symbol, start, end)
+        if hist is None:
+            continue
+        path = os.path.join(directory, f'{symbol}.{file_format}')
+        if file_format == 'csv':
+            hist.to_csv(path)
+        else:
+            hist.to_parquet(path)
+        saved.append(symbol)
+    return saved
+
+
+def _date_range(hist: pd.DataFrame, start: int, end: int) -> pd.DataFrame:
+    """
+    Returns the rows of hist from the day of start up to the day of end, exclusive
+    """
+    first = dt.datetime.fromtimestamp(start).strftime('%Y-%m-%d')
+    last = dt.datetime.fromtimestamp(end).strftime('%Y-%m-%d')
+    return hist[(first <= hist.index) & (hist.index < last)]
+
+
+if __name__ == '__main__':
+    import sys
+    # python -m stock.data.data_source <directory> <number of symbols> [csv|parquet]
+    synthetic = SyntheticDataSource(int(sys.argv[2]))
+    print(len(write_fixtures(sys.argv[1], synthetic, synthetic.symbols(), 0,
+                             int(time.mktime(dt.date.today().timetuple())),
+                             sys.argv[3] if len(sys.argv) > 3 else 'csv')), "fixtures written")
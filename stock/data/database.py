@@ -1,10 +1,16 @@
 from __future__ import annotations
-from typing import Optional, Union, Tuple, Dict, Iterable
+from typing import Optional, Union, Tuple, Dict, Iterable, Iterator, List, Set
+from contextlib import contextmanager
 from itertools import repeat
 import sqlite3
 import pandas as pd
+import datetime as dt
 import re
 import os
+from urllib.request import pathname2url
+from stock.data.columnar_store import ColumnarStore
+
+_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
 
 
 class RwDatabase:
@@ -14,12 +20,20 @@ class RwDatabase:
     === Representation Invariants ===
     _conn is None iff no connection is open
     _cur is None iff _conn is None
+    If read_only, the connection is opened with mode=ro and may be
+    used by any thread, one thread at a time
+
+    === Schema Versions ===
+    0: Legacy. Tables have no primary key
+    2: Date keyed tables are WITHOUT ROWID tables clustered on a Date primary key
     """
+    SCHEMA_VERSION: int = 2
+    read_only: bool
     _db: str
     _conn: sqlite3.Connection
     _cur: sqlite3.Cursor
 
-    def __init__(self, db_path: str, db_name: str, open_db: bool = True):
+    def __init__(self, db_path: str, db_name: str, open_db: bool = True, read_only: bool = False):
         """
         Creates a base database object
         :param db_path:
@@ -28,12 +42,15 @@ class RwDatabase:
         Name of database
         :param open_db:
         Auto-open the database on creation. Default True.
+        :param read_only:
+        Open a read only connection that is not bound to the creating thread. Default False.
         """
         if not os.path.exists(db_path):
             os.makedirs(db_path)
         self._db = db_path + db_name
         self._conn = None
         self._cur = None
+        self.read_only = read_only
 
         if open_db:
             self.open()
@@ -44,8 +61,28 @@ class RwDatabase:
         nothing is done.
         """
         if not self.is_open():
-            self._conn = sqlite3.connect(self._db)
+            if self.read_only:
+                self._conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(self._db))}?mode=ro',
+                                             uri=True, check_same_thread=False)
+            else:
+                self._conn = sqlite3.connect(self._db)
             self._cur = self._conn.cursor()
+            if not self.read_only and self.schema_version == 0 and not self.get_tables():
+                self.schema_version = self.SCHEMA_VERSION
+
+    @property
+    def schema_version(self) -> int:
+        """
+        The schema version of this database, stored in its user_version
+        """
+        self._ensure_open()
+        self._cur.execute('PRAGMA user_version;')
+        return self._cur.fetchone()[0]
+
+    @schema_version.setter
+    def schema_version(self, version: int) -> None:
+        self._ensure_open()
+        self._cur.execute(f'PRAGMA user_version = {int(version)};')
 
     def close(self, commit=True, close=True) -> None:
         """
@@ -109,18 +146,56 @@ class RwDatabase:
         Precondition:
         Table table must exist
         """
-        self.ensure_table('temp', {'Date': 'TEXT'})
-        self._cur.executemany("INSERT INTO  temp (Date) VALUES (?);", zip(data.index))
-        self._cur.execute("INSERT INTO \"{0}\" (Date) "
-                          "SELECT temp.Date "
-                          "FROM temp "
-                          "LEFT JOIN \"{0}\" on \"{0}\".Date = temp.Date "
-                          "WHERE \"{0}\".Date is null;".format(table))
-        labels = list(data.columns.values)
-        for column in labels:
-            self.ensure_column(table, column, 'REAL')
-        self._cur.executemany(f"update \"{table}\" set  ({' '.join(labels)}) = ({' '.join(repeat('?', len(labels)))}) where Date = ?;", (map(lambda x: x[1:] + (x[0],), data.itertuples())))
-        self._cur.execute("DROP TABLE temp")
+        self.write_columns_multi({table: data})
+
+    def write_columns_multi(self, data: Dict[str, pd.DataFrame]) -> None:
+        """
+        Writes the columns of many tables at once. Rows of every table are loaded
+        into a staging table once and applied with a single UPDATE ... FROM join
+        per table. Missing columns and dates are added. Does not commit, so all
+        tables are written in the caller's transaction.
+        :param data:
+        A dictionary mapping table names to data frames indexed by date
+
+        Precondition:
+        Every table in data must exist
+        """
+        self._ensure_open()
+        groups: Dict[Tuple[str], Dict[str, pd.DataFrame]] = {}
+        for table, df in data.items():
+            groups.setdefault(tuple(df.columns.values), {})[table] = df
+        for labels, tables in groups.items():
+            columns = ''.join(f'"{column}" REAL, ' for column in labels)
+            self._cur.execute('DROP TABLE IF EXISTS temp.column_staging;')
+            self._cur.execute(f"CREATE TEMP TABLE column_staging (Tbl TEXT, Date TEXT, {columns}"
+                              f"PRIMARY KEY (Tbl, Date)) WITHOUT ROWID;")
+            for table, df in tables.items():
+                self._cur.executemany(f"INSERT OR REPLACE INTO temp.column_staging VALUES ({', '.join(repeat('?', len(labels) + 2))});",
+                                      zip(repeat(table), _date_keys(df.index), *(df[column].tolist() for column in labels)))
+            for table in tables:
+                for column in labels:
+                    self.ensure_column(table, column, 'REAL')
+                self._cur.execute(f"INSERT INTO \"{table}\" (Date) "
+                                  f"SELECT s.Date FROM temp.column_staging AS s "
+                                  f"WHERE s.Tbl = ? AND NOT EXISTS (SELECT 1 FROM \"{table}\" AS t WHERE t.Date = s.Date);", (table,))
+                if labels:
+                    self._cur.execute(self._update_columns_sql(table, labels), (table,))
+            self._cur.execute('DROP TABLE temp.column_staging;')
+
+    @staticmethod
+    def _update_columns_sql(table: str, labels: Tuple[str]) -> str:
+        """
+        Returns the statement applying the staged columns labels to table
+        """
+        columns = ', '.join(f'"{column}"' for column in labels)
+        staged = ', '.join(f's."{column}"' for column in labels)
+        if _UPDATE_FROM:
+            return (f'UPDATE "{table}" SET ({columns}) = ({staged}) FROM temp.column_staging AS s '
+                    f'WHERE s.Tbl = ?1 AND s.Date = "{table}".Date;')
+        # SQLite before 3.33 has no UPDATE ... FROM
+        return (f'UPDATE "{table}" SET ({columns}) = (SELECT {staged} FROM temp.column_staging AS s '
+                f'WHERE s.Tbl = ?1 AND s.Date = "{table}".Date) '
+                f'WHERE Date IN (SELECT Date FROM temp.column_staging WHERE Tbl = ?1);')
 
     def read_column(self, table: str, columns: Union[str, Iterable[str]]) -> pd.DataFrame:
         """
@@ -142,9 +217,12 @@ class RwDatabase:
         self._cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND UPPER(name) LIKE UPPER(?);", (table,))
         return self._cur.fetchone() is not None
 
-    def ensure_table(self, table: str, cols: Dict[str, str]) -> None:
+    def ensure_table(self, table: str, cols: Dict[str, str], primary_key: Union[str, Tuple[str, ...]] = None) -> None:
         """
         Ensures table exists in the database. If it does not exist, it is created
+        :param primary_key:
+        If specified, the table is created as a WITHOUT ROWID table clustered
+        on this column, or tuple of columns
         """
         self._ensure_open()
         if not self.have_table(table):
@@ -152,8 +230,68 @@ class RwDatabase:
                 print(f"create table \"{table}\";")
                 self._cur.execute(f"create table \"{table}\";")
             else:
-                self._cur.execute(f"create table \"{table}\" ({', '.join(map(' '.join, cols.items()))});")
+                self._cur.execute(self._create_table_sql(table, cols, primary_key))
 
+    @staticmethod
+    def _create_table_sql(table: str, cols: Dict[str, str], primary_key: Union[str, Tuple[str, ...]] = None) -> str:
+        columns = ', '.join('"{}" {}'.format(*item) for item in cols.items())
+        if primary_key is None:
+            return f"create table \"{table}\" ({columns});"
+        if isinstance(primary_key, str):
+            primary_key = (primary_key,)
+        keys = ', '.join(f'"{key}"' for key in primary_key)
+        return f"create table \"{table}\" ({columns}, PRIMARY KEY ({keys})) WITHOUT ROWID;"
+
+    def have_primary_key(self, table: str) -> bool:
+        """
+        Returns True iff table has a primary key
+        """
+        self._ensure_open()
+        self._cur.execute(f'PRAGMA table_info("{table}");')
+        return any(row[5] for row in self._cur.fetchall())
+
+    def migrate_table(self, table: str, primary_key: str = 'Date') -> bool:
+        """
+        Rebuilds table in place as a WITHOUT ROWID table clustered on primary_key.
+        Rows with a null key are dropped and for duplicated keys the last inserted
+        row is kept.
+        :return:
+        True iff the table was rebuilt
+        """
+        self._ensure_open()
+        self._cur.execute(f'PRAGMA table_info("{table}");')
+        info = self._cur.fetchall()
+        if any(row[5] for row in info) or primary_key not in (row[1] for row in info):
+            return False
+        cols = {row[1]: row[2] for row in info}
+        self._cur.execute('DROP TABLE IF EXISTS "__migrate";')
+        self._cur.execute(self._create_table_sql('__migrate', cols, primary_key))
+        self._cur.execute(f'INSERT OR REPLACE INTO "__migrate" SELECT * FROM "{table}" '
+                          f'WHERE "{primary_key}" IS NOT NULL ORDER BY rowid;')
+        self._cur.execute(f'DROP TABLE "{table}";')
+        self._cur.execute(f'ALTER TABLE "__migrate" RENAME TO "{table}";')
+        return True
+
+    def migrate(self, primary_key: str = 'Date') -> int:
+        """
+        Migrates every table keyed by primary_key to the current schema version
+        and commits.
+        :return:
+        The number of tables rebuilt
+        """
+        self._ensure_open()
+        count = sum(self.migrate_table(table, primary_key) for table in self.get_tables())
+        self.schema_version = self.SCHEMA_VERSION
+        self._conn.commit()
+        return count
+
+    def get_tables(self) -> Tuple[str]:
+        """
+        Returns the names of all tables in this database
+        """
+        self._ensure_open()
+        self._cur.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;")
+        return tuple(row[0] for row in self._cur.fetchall())
 
     def is_open(self) -> bool:
         """
@@ -174,7 +312,7 @@ class RwDatabase:
 
 class MetadataDatabase(RwDatabase):
 
-    def __init__(self, db_path: str = 'findata', db_name = 'metadata.db', open_db: bool = True):
+    def __init__(self, db_path: str = 'findata', db_name = 'metadata.db', open_db: bool = True, read_only: bool = False):
         """
         Creates a base database object
         :param db_path:
@@ -183,8 +321,10 @@ class MetadataDatabase(RwDatabase):
         Name of database
         :param open_db:
         Auto-open the database on creation. Default True.
+        :param read_only:
+        Open a read only connection. Default False.
         """
-        RwDatabase.__init__(self, db_path, db_name, open_db)
+        RwDatabase.__init__(self, db_path, db_name, open_db, read_only)
 
     def get_company_list(self, exchange: str) -> pd.DataFrame:
         """
@@ -236,6 +376,78 @@ class MetadataDatabase(RwDatabase):
             raise ValueError("Exchange Must Be Alphabetic")
         self._cur.execute("update exchange_list set last_update=? where Name=?", (date, exchange))
 
+    def ensure_watermarks(self) -> None:
+        """
+        Ensures the watermarks table, holding the last stored date and the last
+        download attempt of every symbol, exists
+        """
+        self.ensure_table('watermarks', {'Exchange': 'TEXT', 'Symbol': 'TEXT', 'last_date': 'TEXT',
+                                         'last_attempt': 'TEXT', 'status': 'TEXT'}, primary_key=('Exchange', 'Symbol'))
+
+    def get_watermarks(self, exchange: str) -> pd.DataFrame:
+        """
+        Returns the watermarks of every symbol of exchange
+        :return:
+        A pandas DataFrame indexed by symbol with last_date, last_attempt and status columns
+        """
+        self._ensure_open()
+        if not exchange.isalpha():
+            raise ValueError("Exchange Must Be Alphabetic")
+        self.ensure_watermarks()
+        res = pd.read_sql('select Symbol, last_date, last_attempt, status from watermarks where Exchange = ?;',
+                          self._conn, params=(exchange,))
+        res.set_index('Symbol', inplace=True)
+        return res
+
+    def write_watermarks(self, exchange: str, rows: Iterable[Tuple[str, Optional[str], str]], attempt: str = None) -> None:
+        """
+        Records the outcome of downloading symbols of exchange. The stored last_date
+        never decreases, so a last_date of None keeps the previously stored date.
+        :param rows:
+        Tuples of symbol, last stored date and status, which is one of 'ok', 'empty' or 'failed'
+        :param attempt:
+        Date of the attempt. Defaults to today
+        """
+        self._ensure_open()
+        if not exchange.isalpha():
+            raise ValueError("Exchange Must Be Alphabetic")
+        self.ensure_watermarks()
+        if attempt is None:
+            attempt = dt.date.today().strftime('%Y-%m-%d')
+        self._cur.executemany('INSERT OR REPLACE INTO watermarks VALUES (?1, ?2, (SELECT max(d) FROM (SELECT ?3 AS d UNION ALL '
+                              'SELECT last_date FROM watermarks WHERE Exchange = ?1 AND Symbol = ?2)), ?4, ?5);',
+                              ((exchange, symbol, last_date, attempt, status) for symbol, last_date, status in rows))
+
+    def write_exchange(self, exchange: str, ext: str, company_list: pd.DataFrame) -> None:
+        """
+        Registers exchange, or replaces its entry, and replaces its companylist table
+        :param exchange:
+        Name of the exchange
+        :param ext:
+        Extension appended to its symbols when downloading, or an empty string
+        :param company_list:
+        The companylist table. Must have a symbol column
+        """
+        self._ensure_open()
+        if not exchange.isalpha():
+            raise ValueError("Exchange Must Be Alphabetic")
+        if 'symbol' not in company_list.columns:
+            raise ValueError("Company List Must Have A symbol Column")
+        self._cur.execute('CREATE TABLE IF NOT EXISTS exchange_list (Name TEXT, ext TEXT, last_update TEXT);')
+        self._cur.execute('DELETE FROM exchange_list WHERE Name = ?;', (exchange,))
+        self._cur.execute('INSERT INTO exchange_list (Name, ext) VALUES (?, ?);', (exchange, ext))
+        company_list.to_sql(exchange.lower(), self._conn, if_exists='replace', index=False)
+
+    def clear_watermarks(self, exchange: str) -> None:
+        """
+        Removes the watermarks of every symbol of exchange
+        """
+        self._ensure_open()
+        if not exchange.isalpha():
+            raise ValueError("Exchange Must Be Alphabetic")
+        self.ensure_watermarks()
+        self._cur.execute('DELETE FROM watermarks WHERE Exchange = ?;', (exchange,))
+
     def get_exchange_metadata(self, exchange: str = None) -> Union[pd.DataFrame, tuple]:
         """
         Returns the metadata associated with exchange, or with all exchanges
@@ -257,7 +469,31 @@ class MetadataDatabase(RwDatabase):
 
 
 class ExchangeDatabase(RwDatabase):
-    def __init__(self, exchange: str, open_db: bool = True, path='findata/'):
+    """
+    Database holding one table of daily bars per symbol of an exchange
+
+    The SNAPSHOT table, once built, holds the last bar of every symbol with the
+    change of its close, the 5 and 20 bar moving averages of its closes and volumes,
+    the 20 bar standard deviation of its closes, and its volume against its 5 bar
+    moving average. It is refreshed whenever a symbol is written, and indexed on the
+    columns screened by.
+
+    === Representation Invariants ===
+    columns is None iff the columnar copy of this database is disabled
+    _staged is None iff the database is not in bulk load mode
+    """
+    FIELDS: List[str] = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+    SNAPSHOT: str = '_snapshot'
+    SNAPSHOT_COLUMNS: Dict[str, str] = {'Symbol': 'TEXT', 'Date': 'TEXT', 'Open': 'REAL', 'High': 'REAL', 'Low': 'REAL',
+                                        'Close': 'REAL', 'Adj Close': 'REAL', 'Volume': 'INTEGER', 'change': 'REAL',
+                                        'ma5': 'REAL', 'ma20': 'REAL', 'std20': 'REAL', 'v_ma5': 'REAL', 'v_ma20': 'REAL',
+                                        'v_change': 'REAL', 'v_ratio': 'REAL'}
+    SNAPSHOT_INDEXED: Tuple[str, ...] = ('Close', 'Volume', 'change', 'v_change', 'v_ratio')
+    columns: Optional[ColumnarStore]
+    _staged: Optional[Set[str]]
+    _batch_size: int
+
+    def __init__(self, exchange: str, open_db: bool = True, path='findata/', columnar: bool = None, read_only: bool = False):
         """
         Creates a exchange database object
 
@@ -267,14 +503,26 @@ class ExchangeDatabase(RwDatabase):
         Path to database. Default: 'findata/
         :param open_db:
         Auto-open the database on creation. Default True.
-        """
-        RwDatabase.__init__(self, path, exchange.lower() + '.db', open_db)
-
-    def ensure_table(self, table: str, cols: Dict[str, str] = {'Date': 'TEXT', 'Open': 'REAL', 'High': 'REAL', 'Low': 'REAL', 'Close': 'REAL', 'Adj Close': 'REAL', 'Volume': 'INTEGER'}) -> None:
+        :param columnar:
+        Keep the memory mapped columnar copy of this database in sync
+        with every write. Defaults to whether a copy was built, unless read_only,
+        so every writer keeps an existing copy up to date.
+        :param read_only:
+        Open a read only connection. Default False.
+        """
+        RwDatabase.__init__(self, path, exchange.lower() + '.db', open_db, read_only)
+        if columnar is None:
+            columnar = not read_only and ColumnarStore.exists(exchange, path)
+        self.columns = ColumnarStore(exchange, path) if columnar else None
+        self._staged = None
+        self._batch_size = 0
+
+    def ensure_table(self, table: str, cols: Dict[str, str] = {'Date': 'TEXT', 'Open': 'REAL', 'High': 'REAL', 'Low': 'REAL', 'Close': 'REAL', 'Adj Close': 'REAL', 'Volume': 'INTEGER'}, primary_key: str = 'Date') -> None:
         """
         Ensures table exists in the database. If it does not exist, it is created
+        clustered on its Date column
         """
-        RwDatabase.ensure_table(self, table, cols)
+        RwDatabase.ensure_table(self, table, cols, primary_key)
 
     def read_stock_data(self, symbol: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
         """
@@ -311,6 +559,60 @@ class ExchangeDatabase(RwDatabase):
         res.set_index('Date', inplace=True)
         return res
 
+    def read_panel(self, symbols: Iterable[str], fields: Iterable[str] = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'),
+                   start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """
+        Obtains the stock data of many symbols in one pass. Symbols without a table
+        are skipped.
+        :param symbols:
+        The symbols for which data to be obtained
+        :param fields:
+        The columns to read
+        :param start_date:
+        The start date from which to obtain data. If unspecified defaults to oldest entry
+        :param end_date:
+        The end date from which to obtain data. If unspecified defaults to earliest entry
+        :return:
+        A pandas DataFrame in long format with a Symbol and a Date column followed by fields
+        """
+        self._ensure_open()
+        fields = list(fields)
+        for field in fields:
+            if not re.fullmatch('[a-zA-Z ]+', field):
+                raise ValueError("Field Must Be Alphabetic")
+        if start_date is not None and not re.fullmatch(r'\d{4}-\d{2}-\d{2}', start_date):
+            raise ValueError("Start Date must be in the format yyyy-mm-dd")
+        if end_date is not None and not re.fullmatch(r'\d{4}-\d{2}-\d{2}', end_date):
+            raise ValueError("End Date must be in the format yyyy-mm-dd")
+        tables = set(self.get_tables())
+        symbols = [symbol for symbol in symbols if symbol in tables and re.fullmatch('[a-zA-Z0-9.]+', symbol)]
+        columns = ', '.join(f'"{field}"' for field in fields)
+        select = f"select '{{0}}' as Symbol, Date, {columns} from \"{{0}}\" WHERE date BETWEEN :start and :end"
+        bounds = {'start': start_date or '0000-00-00', 'end': end_date or '9999-99-99'}
+        chunks = []
+        # SQLite limits a compound select to 500 terms
+        for i in range(0, len(symbols), 500):
+            chunk = symbols[i:i + 500]
+            chunks.append(pd.read_sql(' UNION ALL '.join(map(select.format, chunk)) + ';', self._conn, params=bounds))
+        if not chunks:
+            return pd.DataFrame(columns=['Symbol', 'Date'] + fields)
+        return pd.concat(chunks, ignore_index=True)
+
+    def get_last_dates(self, symbols: Iterable[str]) -> Dict[str, str]:
+        """
+        Returns the last stored date of every symbol in symbols that has a table
+        """
+        self._ensure_open()
+        tables = set(self.get_tables())
+        res = {}
+        for symbol in symbols:
+            if symbol in tables:
+                self._cur.execute('SELECT max(date) from \"{}\"'.format(symbol))
+                last_date = self._cur.fetchone()[0]
+                if last_date is not None:
+                    res[symbol] = last_date
+        return res
+
     def write_stock_data(self, symbol: str, df: pd.DataFrame, commit: bool = True) -> None:
         """
         Write the new entries from data into the database
@@ -326,23 +628,288 @@ class ExchangeDatabase(RwDatabase):
         self._ensure_open()
         if not symbol.isalnum():
             raise ValueError("Symbol Must Be Alphanumeric")
-        self._ensure_table(symbol)
+        if self._staged is not None:
+            self._stage(symbol, df)
+            return
+        self.ensure_table(symbol)
         self._cur.execute('SELECT max(date) from \"{}\"'.format(symbol))
         last_date = self._cur.fetchone()[0]
         self._cur.execute('SELECT min(date) from \"{}\"'.format(symbol))
         first_date = self._cur.fetchone()[0]
         # print(list(data[(data.index >= last_date)].itertuples()))
         if first_date is not None and last_date is not None:
-            self._cur.executemany('insert into \"{}\" values  (?,?,?,?,?,?,?)'.format(symbol),
-                                  df[(df.index < first_date)].itertuples())
-            self._cur.executemany('insert into \"{}\" values  (?,?,?,?,?,?,?)'.format(symbol),
-                                  df[(df.index > last_date)].itertuples())
-        else:
-            self._cur.executemany('insert into \"{}\" values  (?,?,?,?,?,?,?)'.format(symbol), df.itertuples())
+            df = df[(df.index < first_date) | (df.index > last_date)]
+        self._cur.executemany('insert into \"{}\" values  (?,?,?,?,?,?,?)'.format(symbol), df.itertuples())
+        if self.columns is not None:
+            self._sync_columns(symbol, df)
+        if self.have_snapshot():
+            self.refresh_snapshot([symbol])
 
         if commit:
             self._conn.commit()
 
+    @contextmanager
+    def bulk_load(self, batch_size: int = 256, synchronous: str = 'NORMAL', cache_size: int = 256 * 1024) -> Iterator[ExchangeDatabase]:
+        """
+        Puts the database in bulk load mode for the duration of the with block.
+
+        In bulk load mode the journal is switched to WAL and write_stock_data stages
+        frames into a temporary table instead of writing them. Every batch_size symbols
+        the staged rows are merged into the symbol tables with one INSERT OR REPLACE
+        per symbol, so gaps are filled and existing dates are overwritten. Everything
+        staged is merged and committed when the block exits.
+        :param batch_size:
+        Number of symbols staged before they are merged. Default: 256
+        :param synchronous:
+        Value of PRAGMA synchronous during the load. Default: 'NORMAL'
+        :param cache_size:
+        Page cache size in KiB during the load. Default: 256 MiB
+        """
+        self._ensure_open()
+        if self._staged is not None:
+            raise ValueError("Already In Bulk Load Mode")
+        self._conn.commit()
+        self._cur.execute('PRAGMA synchronous;')
+        old_synchronous = self._cur.fetchone()[0]
+        self._cur.execute('PRAGMA cache_size;')
+        old_cache_size = self._cur.fetchone()[0]
+        self._cur.execute('PRAGMA journal_mode = WAL;')
+        self._cur.execute(f'PRAGMA synchronous = {synchronous};')
+        self._cur.execute(f'PRAGMA cache_size = {-int(cache_size)};')
+        columns = ', '.join(f'"{field}" REAL' for field in self.FIELDS)
+        self._cur.execute('DROP TABLE IF EXISTS temp.staging;')
+        self._cur.execute(f'CREATE TEMP TABLE staging (Symbol TEXT, Date TEXT, {columns}, '
+                          f'PRIMARY KEY (Symbol, Date)) WITHOUT ROWID;')
+        self._staged = set()
+        self._batch_size = batch_size
+        try:
+            yield self
+            self.flush()
+            self._conn.commit()
+        except BaseException:
+            # The pragmas below cannot run inside the failed transaction
+            self._conn.rollback()
+            raise
+        finally:
+            self._staged = None
+            self._cur.execute('DROP TABLE IF EXISTS temp.staging;')
+            self._cur.execute(f'PRAGMA synchronous = {old_synchronous};')
+            self._cur.execute(f'PRAGMA cache_size = {old_cache_size};')
+
+    def _stage(self, symbol: str, df: pd.DataFrame) -> None:
+        """
+        Stages df to be merged into the table of symbol
+        """
+        values = [df[field].tolist() for field in self.FIELDS]
+        self._cur.executemany(f'INSERT OR REPLACE INTO temp.staging VALUES ({", ".join(repeat("?", len(self.FIELDS) + 2))});',
+                              zip(repeat(symbol), _date_keys(df.index), *values))
+        self._staged.add(symbol)
+        if len(self._staged) >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Merges the frames staged in bulk load mode into their symbol tables. Does not commit.
+        """
+        if not self._staged:
+            return
+        columns = ', '.join(f'"{field}"' for field in self.FIELDS)
+        for symbol in sorted(self._staged):
+            self.ensure_table(symbol)
+            if not self.have_primary_key(symbol):
+                self._cur.execute(f'DELETE FROM "{symbol}" WHERE Date IN (SELECT Date FROM temp.staging WHERE Symbol = ?);', (symbol,))
+            self._cur.execute(f'INSERT OR REPLACE INTO "{symbol}" (Date, {columns}) '
+                              f'SELECT Date, {columns} FROM temp.staging WHERE Symbol = ?;', (symbol,))
+            if self.columns is not None:
+                self._sync_columns(symbol, pd.read_sql(f'SELECT Date, {columns} FROM temp.staging WHERE Symbol = ?;',
+                                                       self._conn, params=(symbol,), index_col='Date'))
+        if self.have_snapshot():
+            self.refresh_snapshot(self._staged)
+        self._cur.execute('DELETE FROM temp.staging;')
+        self._staged.clear()
+
+    def _sync_columns(self, symbol: str, df: pd.DataFrame) -> None:
+        """
+        Merges df, the rows just written to the table of symbol, into the columnar
+        copy. Symbols the copy does not hold yet are copied whole.
+        """
+        if self.columns.have_symbol(symbol):
+            self.columns.update_symbol(symbol, df)
+        else:
+            self.columns.write_symbol(symbol, self.read_stock_data(symbol))
+
+    def rebuild_columns(self) -> None:
+        """
+        Rebuilds the columnar copy of this database from every symbol table
+
+        Precondition:
+        The columnar copy is enabled
+        """
+        self._ensure_open()
+        if self.columns is None:
+            raise ValueError("Columnar Store Not Enabled")
+        self.columns.rebuild((symbol, self.read_stock_data(symbol)) for symbol in self.get_tables()
+                             if re.fullmatch('[a-zA-Z0-9.]+', symbol))
+
+    def have_snapshot(self) -> bool:
+        """
+        Returns True iff the snapshot table of this database was built
+        """
+        self._ensure_open()
+        return self._have_exact_table(self.SNAPSHOT)
+
+    def ensure_snapshot(self) -> None:
+        """
+        Ensures the snapshot table exists. If it does not exist, it is built from
+        every symbol table. Does not commit.
+        """
+        if not self.have_snapshot():
+            self.rebuild_snapshot()
+
+    def rebuild_snapshot(self) -> None:
+        """
+        Builds the snapshot table and its indexes again from every symbol table.
+        Does not commit.
+        """
+        self._ensure_open()
+        self._cur.execute(f'DROP TABLE IF EXISTS "{self.SNAPSHOT}";')
+        self._cur.execute(self._create_table_sql(self.SNAPSHOT, self.SNAPSHOT_COLUMNS, 'Symbol'))
+        for column in self.SNAPSHOT_INDEXED:
+            self._cur.execute(f'CREATE INDEX "{self.SNAPSHOT}_{column}" ON "{self.SNAPSHOT}" ("{column}");')
+        tables = {symbol for symbol in self.get_tables() if re.fullmatch('[a-zA-Z0-9.]+', symbol)}
+        self.refresh_snapshot(sorted(tables), tables)
+
+    def refresh_snapshot(self, symbols: Iterable[str], tables: Set[str] = None) -> None:
+        """
+        Recomputes the snapshot rows of symbols from the last 20 bars of their tables.
+        Symbols without a table or bars are removed from the snapshot. Does not commit.
+        :param tables:
+        The names of the tables of this database, if known. Otherwise the table of
+        every symbol is looked up on its own
+
+        Precondition:
+        The snapshot table exists
+        """
+        self._ensure_open()
+        columns = ', '.join(f'"{field}"' for field in self.FIELDS)
+        rows = []
+        missing = []
+        for symbol in symbols:
+            bars = []
+            exists = symbol in tables if tables is not None else self._have_exact_table(symbol)
+            if exists:
+                self._cur.execute(f'SELECT Date, {columns} FROM "{symbol}" ORDER BY Date DESC LIMIT 20;')
+                bars = self._cur.fetchall()[::-1]
+            if bars:
+                rows.append(_snapshot_row(symbol, bars))
+            else:
+                missing.append((symbol,))
+        self._cur.executemany(f'INSERT OR REPLACE INTO "{self.SNAPSHOT}" '
+                              f'VALUES ({", ".join(repeat("?", len(self.SNAPSHOT_COLUMNS)))});', rows)
+        self._cur.executemany(f'DELETE FROM "{self.SNAPSHOT}" WHERE Symbol = ?;', missing)
+
+    def _have_exact_table(self, table: str) -> bool:
+        """
+        Returns True iff a table named exactly table exists, with one lookup of the schema
+        """
+        self._cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?;", (table,))
+        return self._cur.fetchone() is not None
+
+    def read_snapshot(self, symbols: Iterable[str] = None) -> pd.DataFrame:
+        """
+        Returns the snapshot rows of symbols, or of every symbol if unspecified
+        :return:
+        A pandas DataFrame indexed by symbol with the columns of SNAPSHOT_COLUMNS,
+        Date parsed
+        """
+        self._ensure_open()
+        if not self.have_snapshot():
+            raise ValueError("Snapshot Not Built")
+        if symbols is None:
+            res = pd.read_sql(f'SELECT * FROM "{self.SNAPSHOT}";', self._conn, parse_dates=['Date'])
+        else:
+            symbols = list(symbols)
+            res = pd.concat([pd.read_sql(f'SELECT * FROM "{self.SNAPSHOT}" WHERE Symbol IN '
+                                         f'({", ".join(repeat("?", len(chunk)))});', self._conn, params=chunk,
+                                         parse_dates=['Date'])
+                             for chunk in (symbols[i:i + 500] for i in range(0, max(len(symbols), 1), 500))],
+                            ignore_index=True)
+        res.set_index('Symbol', inplace=True)
+        return res
+
+    def top_snapshot(self, by: str, n: int = 50, ascending: bool = False,
+                     bounds: Dict[str, Tuple[Optional[float], Optional[float]]] = None) -> pd.DataFrame:
+        """
+        Returns the n snapshot rows with the largest values of by, or the smallest if
+        ascending, with one query. Rows where by is unknown are left out.
+        :param bounds:
+        A dictionary mapping columns to the inclusive lower and upper bounds of the rows
+        returned. None leaves a side unbounded
+        :return:
+        A pandas DataFrame indexed by symbol, sorted by by, Date parsed
+        """
+        self._ensure_open()
+        bounds = bounds or {}
+        for column in (by, *bounds):
+            if column not in self.SNAPSHOT_COLUMNS:
+                raise ValueError(f"Unknown Snapshot Column {column}")
+        if n < 1:
+            raise ValueError("Number Of Rows Must Be Positive")
+        if not self.have_snapshot():
+            raise ValueError("Snapshot Not Built")
+        conditions = [f'"{by}" IS NOT NULL']
+        params = []
+        for column, (low, high) in bounds.items():
+            if low is not None:
+                conditions.append(f'"{column}" >= ?')
+                params.append(low)
+            if high is not None:
+                conditions.append(f'"{column}" <= ?')
+                params.append(high)
+        res = pd.read_sql(f'SELECT * FROM "{self.SNAPSHOT}" WHERE {" AND ".join(conditions)} '
+                          f'ORDER BY "{by}" {"ASC" if ascending else "DESC"} LIMIT ?;', self._conn, params=(*params, n),
+                          parse_dates=['Date'])
+        res.set_index('Symbol', inplace=True)
+        return res
+
+
+def _snapshot_row(symbol: str, bars: List[tuple]) -> tuple:
+    """
+    Returns the snapshot row of symbol given its last bars, oldest first, as rows
+    of Date followed by ExchangeDatabase.FIELDS. Statistics over more bars than
+    are known, or over unknown values, are None.
+    """
+    close = [bar[4] for bar in bars]
+    volume = [bar[6] for bar in bars]
+
+    def mean(values: List[Optional[float]], window: int) -> Optional[float]:
+        values = values[-window:]
+        if len(values) < window or None in values:
+            return None
+        return sum(values) / window
+
+    def std(values: List[Optional[float]], window: int) -> Optional[float]:
+        average = mean(values, window)
+        if average is None:
+            return None
+        return (sum((value - average) ** 2 for value in values[-window:]) / (window - 1)) ** 0.5
+
+    change = close[-1] / close[-2] - 1 if len(close) > 1 and close[-1] is not None and close[-2] else None
+    v_ma5 = mean(volume, 5)
+    v_change = volume[-1] - v_ma5 if v_ma5 is not None and volume[-1] is not None else None
+    v_ratio = volume[-1] / v_ma5 if v_ma5 and volume[-1] is not None else None
+    return ((symbol,) + tuple(bars[-1]) + (change, mean(close, 5), mean(close, 20), std(close, 20), v_ma5,
+                                           mean(volume, 20), v_change, v_ratio))
+
+
+def _date_keys(index: pd.Index) -> List[str]:
+    """
+    Returns the yyyy-mm-dd keys of a date index
+    """
+    if isinstance(index, pd.DatetimeIndex):
+        return index.strftime('%Y-%m-%d').tolist()
+    return index.astype(str).tolist()
+
 
 if __name__ == '__main__':
     pass
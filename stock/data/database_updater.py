@@ -1,73 +1,94 @@
 from stock.data.database import MetadataDatabase, ExchangeDatabase
-from typing import Optional, List
-import fix_yahoo_finance as yf
-from itertools import repeat
+from stock.data import data_manager
+from stock.data.frame_transport import SharedFrames
+from stock.data.data_source import DataSource, YahooDataSource
+from typing import Optional, List, Tuple, Union
 import datetime as dt
+import threading
+import random
+import queue
 import time
 import pandas as pd
 from multiprocessing.dummy import Pool
-from multiprocessing import Process, Manager, Queue
+from multiprocessing import Process, Queue
+import multiprocessing
 
 
-def update_database(exchange: str, start_date: str = None, threads: int = 16, multiprocess_write: bool = True, verbose: bool = False) -> None:
+def update_database(exchange: str, start_date: str = None, threads: int = 16, multiprocess_write: bool = True, verbose: bool = False,
+                    commit_every: int = 256, commit_interval: float = 30.0, source: DataSource = None) -> None:
     """
     Updates the database corresponding to exchange. Multi-threaded and multiprocess Write
     highly suggested.
     :param exchange:
         The exchange for which data should be updated
     :param start_date:
-        The starting date for updating the database. Defaults to the
-        last time the database was updated, or 1970-01-01, if the database
-        was never updated before
+        The starting date for updating every symbol. If unspecified, every symbol is
+        updated from the day after its watermark, symbols already attempted today are
+        skipped and new symbols are downloaded from 1970-01-01
     :param threads:
         Number of threads to use. If set to 1, multithreading is disabled.
         Default: 16
     :param multiprocess_write:
-        Whether or not to use a seperate process for writing the data.
-        Default: True
+        Whether or not to use a seperate process for writing the data. Downloaded
+        data is handed to it through shared memory. Default: True
     :param verbose:
         Whether or not to print the task that is currently being processed.
         Default: False
+    :param commit_every:
+        Number of symbols written between commits. Default: 256
+    :param commit_interval:
+        Maximum number of seconds between commits. Default: 30
+    :param source:
+        The source histories are downloaded from. Default: Yahoo Finance
     """
+    source = source if source is not None else YahooDataSource()
     with MetadataDatabase() as metadb:
-        metadata = metadb.get_exchange_metadata(exchange)
-        if metadata is None:
-            raise ValueError("Exchange Not Found In Database")
-        ext = metadata[1]
-        if start_date is None:
-            start_date = metadata[2]
-        if start_date is None:
-            start_date = '1970-01-01'
-        end_date = dt.datetime.today().strftime('%Y-%m-%d')
-        start = int(time.mktime(time.strptime(str(start_date), '%Y-%m-%d')))
-        end = int(time.mktime(time.strptime(str(end_date), '%Y-%m-%d')))
-        if start >= end:
-            return
-        symbols = metadb.get_symbols(exchange)
-        if threads is None or threads < 2:
-            with ExchangeDatabase(exchange) as exdb:
-                for item in zip(symbols, map(lambda *args: _download(*args, start=start, end=end, verbose=verbose), map(''.join, zip(symbols, repeat('.' + ext))) if ext else list(symbols))):
-                    exdb.write_stock_data(*item, commit=False)
+        ext, plan, end = _plan_update(metadb, exchange, start_date)
+        queries = [(f'{symbol}.{ext}' if ext else symbol, start) for symbol, start in plan]
+        if not queries:
+            if verbose:
+                print(f"{exchange} is up to date")
+        elif threads is None or threads < 2:
+            with ExchangeDatabase(exchange) as exdb, exdb.bulk_load():
+                writer = _Writer(exchange, exdb, metadb, commit_every, commit_interval)
+                for (symbol, _), (query, start) in zip(plan, queries):
+                    writer.write(symbol, _download(query, start=start, end=end, source=source, verbose=verbose))
+                writer.commit()
         else:
-            q = Manager().Queue()
-            if multiprocess_write:
-                writer = Process(target=_write_queue, args=(q, exchange, ext, verbose))
-                writer.start()
-            with Pool(processes=threads) as pool:
-                pool.starmap(lambda *args: _download(*args, start=start, end=end, q=q, verbose=verbose), zip(map(''.join, zip(symbols, repeat('.' + ext))) if ext else list(symbols)))
-                pool.close()
-                pool.join()
-            q.put(('Task Done', ''))
-
+            # Bounded, so downloads block while the writer is behind
             if multiprocess_write:
-                writer.join()
+                q = multiprocessing.Queue(4 * threads)
+                done = multiprocessing.Event()
+                writer = Process(target=_write_queue, args=(q, exchange, ext, verbose, commit_every, commit_interval, done))
             else:
-                _write_queue(q, exchange, ext, verbose)
+                q = queue.Queue(4 * threads)
+                done = threading.Event()
+                writer = threading.Thread(target=_write_queue, args=(q, exchange, ext, verbose, commit_every, commit_interval, done))
+            writer.start()
+            try:
+                with Pool(processes=threads) as pool:
+                    pool.starmap(lambda query, start: _download(query, start=start, end=end, q=q, share=multiprocess_write,
+                                                                source=source, verbose=verbose, writer=writer), queries)
+                    pool.close()
+                    pool.join()
+                _put(q, ('Task Done', ''), writer)
+                writer.join()
+                if not done.is_set():
+                    raise RuntimeError("Writer Stopped")
+            except BaseException:
+                # Histories still queued are not written, so their blocks are freed here
+                _discard(q)
+                if writer.is_alive():
+                    q.put(('Task Done', ''))
+                writer.join()
+                raise
+        data_manager.invalidate(exchange)
 
         metadb.write_exchange_update_date(exchange, dt.datetime.today().strftime('%Y-%m-%d'))
 
 
-def update_database_multi(exchanges: List[str], start_date: str = None, threads: int = 16, multiprocess_write: bool = True, verbose: bool = False) -> None:
+def update_database_multi(exchanges: List[str], start_date: str = None, threads: int = 16, multiprocess_write: bool = True, verbose: bool = False,
+                          commit_every: int = 256, commit_interval: float = 30.0, source: DataSource = None) -> None:
     """
     Updates the database for each exchange. Multi-threaded and multiprocess Write
     highly suggested.
@@ -88,60 +109,243 @@ def update_database_multi(exchanges: List[str], start_date: str = None, threads:
         Default: False
     """
     for exchange in exchanges:
-        update_database(exchange, start_date, threads, multiprocess_write, verbose)
+        update_database(exchange, start_date, threads, multiprocess_write, verbose, commit_every, commit_interval, source)
 
 
 def clear_update_record(exchange: str) -> None:
     """
-    Clears the last updated date of exchange
+    Clears the last updated date and the watermarks of exchange. Symbols are
+    updated from their last stored date on the next update.
     """
     with MetadataDatabase() as metadb:
         metadb.write_exchange_update_date(exchange, None)
+        metadb.clear_watermarks(exchange)
+
+
+def rebuild_snapshot(exchange: str) -> None:
+    """
+    Builds the snapshot table of exchange again from its stored data. Updates
+    keep it up to date afterwards.
+    """
+    with ExchangeDatabase(exchange) as exdb:
+        exdb.rebuild_snapshot()
+
+
+class _Writer:
+    """
+    Writes downloaded histories into an exchange database in bulk load mode and
+    commits every commit_every symbols or commit_interval seconds. The watermarks of
+    the symbols written are stored right after the data they describe is committed.
+    The snapshot table is built if missing, and refreshed as symbols are merged.
+    """
+    exchange: str
+    exdb: ExchangeDatabase
+    metadb: MetadataDatabase
+    commit_every: int
+    commit_interval: float
+    rows: List[Tuple[str, Optional[str], str]]
+    _last_commit: float
+
+    def __init__(self, exchange: str, exdb: ExchangeDatabase, metadb: MetadataDatabase,
+                 commit_every: int = 256, commit_interval: float = 30.0):
+        """
+        Precondition:
+        exdb is in bulk load mode
+        """
+        self.exchange = exchange
+        self.exdb = exdb
+        self.metadb = metadb
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.rows = []
+        self._last_commit = time.monotonic()
+        exdb.ensure_snapshot()
+
+    def write(self, symbol: str, hist: Optional[pd.DataFrame]) -> None:
+        """
+        Writes hist, the history of symbol or None if the download failed
+        """
+        if hist is None:
+            self.rows.append((symbol, None, 'failed'))
+        elif hist.empty:
+            self.rows.append((symbol, None, 'empty'))
+        else:
+            self.exdb.write_stock_data(symbol, hist, commit=False)
+            last_date = hist.index.max()
+            self.rows.append((symbol, last_date.strftime('%Y-%m-%d') if hasattr(last_date, 'strftime') else str(last_date), 'ok'))
+        if len(self.rows) >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
 
+    def commit(self) -> None:
+        """
+        Commits the data written so far, then stores and commits its watermarks
+        """
+        self.exdb.flush()
+        self.exdb.commit()
+        self.metadb.write_watermarks(self.exchange, self.rows)
+        self.metadb.commit()
+        self.rows = []
+        self._last_commit = time.monotonic()
 
-def _write_queue(q: Queue, exchange: str, ext: str, verbose: bool = False) -> None:
+
+def _plan_update(metadb: MetadataDatabase, exchange: str, start_date: str = None) -> Tuple[str, List[Tuple[str, int]], int]:
+    """
+    Returns the symbol extension of exchange, the symbols to download with the start
+    of their missing range as a timestamp, and the end of the update as a timestamp.
+
+    If start_date is specified, every symbol is downloaded from start_date. Otherwise
+    each symbol starts the day after its watermark, or after its last stored date if
+    it has none. Symbols attempted today without failing are skipped.
+    """
+    metadata = metadb.get_exchange_metadata(exchange)
+    if metadata is None:
+        raise ValueError("Exchange Not Found In Database")
+    ext = metadata[1]
+    today = dt.date.today()
+    end = _timestamp(today)
+    symbols = list(metadb.get_symbols(exchange))
+    if start_date is not None:
+        start = _timestamp(start_date)
+        return ext, [(symbol, start) for symbol in symbols] if start < end else [], end
+    watermarks = metadb.get_watermarks(exchange).to_dict('index')
     with ExchangeDatabase(exchange) as exdb:
+        stored = exdb.get_last_dates(symbol for symbol in symbols
+                                     if pd.isna(watermarks.get(symbol, {}).get('last_date')))
+    plan = []
+    for symbol in symbols:
+        watermark = watermarks.get(symbol, {})
+        if watermark.get('last_attempt') == today.strftime('%Y-%m-%d') and watermark.get('status') != 'failed':
+            continue
+        last_date = watermark.get('last_date')
+        if pd.isna(last_date):
+            last_date = stored.get(symbol)
+        if last_date is None:
+            start = _timestamp('1970-01-01')
+        else:
+            start = _timestamp(dt.datetime.strptime(last_date, '%Y-%m-%d') + dt.timedelta(days=1))
+        if start < end:
+            plan.append((symbol, start))
+    return ext, plan, end
+
+
+def _timestamp(date: Union[str, dt.date]) -> int:
+    """
+    Returns the local timestamp of the start of date
+    """
+    if not isinstance(date, str):
+        date = date.strftime('%Y-%m-%d')
+    return int(time.mktime(time.strptime(date, '%Y-%m-%d')))
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Returns the delay before retrying after attempt failed attempts, drawn
+    uniformly from [0, min(cap, base * 2 ** attempt)]
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _write_queue(q: Queue, exchange: str, ext: str, verbose: bool = False,
+                 commit_every: int = 256, commit_interval: float = 30.0, done=None) -> None:
+    """
+    Writes the histories put on q until 'Task Done' is received, then sets done
+    """
+    with ExchangeDatabase(exchange) as exdb, MetadataDatabase() as metadb, exdb.bulk_load():
+        writer = _Writer(exchange, exdb, metadb, commit_every, commit_interval)
         while True:
-            # try:
-                symbol, data = q.get()
-                if symbol == 'Task Done':
-                    break
-                if ext:
-                    symbol = symbol[:-len(ext)-1]
-                if verbose:
-                    print(f"Writing {symbol}")
-                exdb.write_stock_data(symbol, data, commit=False)
-                q.task_done()
-            # except Exception as e:
-            #     print(e)
+            symbol, data = q.get()
+            if symbol == 'Task Done':
+                break
+            if verbose:
+                print(f"Writing {symbol}")
+            if isinstance(data, SharedFrames):
+                try:
+                    with data.attach() as frames:
+                        writer.write(symbol[:-len(ext)-1] if ext else symbol, frames[symbol])
+                finally:
+                    data.unlink()
+            else:
+                writer.write(symbol[:-len(ext)-1] if ext else symbol, data)
         if verbose:
             print("Committing")
+        writer.commit()
+    if done is not None:
+        done.set()
 
 
-def _download(symbol: str, start: int, end: int, q: Queue = None,
-              interval: str = '1d', attempts: int = 5, verbose: bool = False) -> Optional[pd.DataFrame]:
-    force = False
+def _put(q: Queue, item: tuple, writer: Union[Process, threading.Thread], timeout: float = 1.0) -> None:
+    """
+    Puts item on q, waiting while q is full as long as writer is alive
+    """
+    while True:
+        try:
+            q.put(item, timeout=timeout)
+            return
+        except queue.Full:
+            if not writer.is_alive():
+                raise RuntimeError("Writer Stopped")
+
+
+def _discard(q: Queue) -> None:
+    """
+    Removes every item left on q, freeing the shared memory blocks of their histories
+    """
+    while True:
+        try:
+            symbol, data = q.get(timeout=0.1)
+        except queue.Empty:
+            return
+        if isinstance(data, SharedFrames):
+            data.unlink()
+
+
+def _download(symbol: str, start: int, end: int, q: Queue = None, share: bool = False,
+              interval: str = '1d', attempts: int = 5, source: DataSource = None, verbose: bool = False,
+              writer: Union[Process, threading.Thread] = None) -> Optional[pd.DataFrame]:
+    """
+    Downloads the history of symbol from source, Yahoo Finance by default, retrying
+    with backoff when the download raises. If q is specified, the history, or None if
+    source does not know symbol or every attempt failed, is put on q with symbol
+    instead of being returned. If
+    share, non empty histories are put on q as SharedFrames. If writer, the consumer
+    of q, stops, RuntimeError is raised instead of waiting on q forever.
+    """
+    if writer is not None and not writer.is_alive():
+        raise RuntimeError("Writer Stopped")
+    source = source if source is not None else YahooDataSource()
     if verbose:
         print(f"Downloading {symbol}")
+    hist = None
     for i in range(attempts):
         try:
-            yf.get_yahoo_crumb(force=force)
-            hist = yf.download_one(symbol, start, end, interval)
-            if isinstance(hist, pd.DataFrame):
-                if not hist.empty:
-                    hist.reset_index(inplace=True)
-                    hist['Date'] = hist['Date'].dt.strftime('%Y-%m-%d')
-                    hist.set_index('Date', inplace=True)
-                if q is not None:
-                    q.put((symbol, hist))
-                    return
-                else:
-                    return hist
-        except:
-            force = True
+            hist = source.download(symbol, start, end, interval)
+        except Exception as e:
             if verbose:
-                print(f"Reattempting {symbol}. Attempt {i+1}")
+                print(f"Reattempting {symbol}. Attempt {i+1}: {e}")
+            if i + 1 < attempts:
+                time.sleep(backoff_delay(i))
             continue
+        # None means source has no such symbol, which retrying does not change
+        break
+    if q is None:
+        return hist
+    _enqueue(q, symbol, SharedFrames({symbol: hist}) if share and hist is not None and not hist.empty else hist, writer)
+
+
+def _enqueue(q: Queue, symbol: str, data: Union[SharedFrames, pd.DataFrame, None],
+             writer: Union[Process, threading.Thread] = None) -> None:
+    """
+    Puts the history of symbol on q, freeing its shared memory block if the writer stopped
+    """
+    try:
+        if writer is None:
+            q.put((symbol, data))
+        else:
+            _put(q, (symbol, data), writer)
+    except BaseException:
+        if isinstance(data, SharedFrames):
+            data.unlink()
+        raise
 
 
 if __name__ == '__main__':
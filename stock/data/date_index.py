@@ -0,0 +1,54 @@
+from typing import Union
+from datetime import datetime
+import pandas as pd
+
+DateLike = Union[str, datetime, pd.Timestamp, None]
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns df indexed by a sorted DatetimeIndex named Date. df is returned
+    unchanged if its index already is one.
+    """
+    index = df.index
+    if not isinstance(index, pd.DatetimeIndex):
+        df = df.set_axis(pd.DatetimeIndex(pd.to_datetime(index), name='Date'), axis=0)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    return df
+
+
+def locate(index: pd.DatetimeIndex, date: DateLike, upper: bool = False) -> int:
+    """
+    Returns the position of date in index, found by binary search. If upper,
+    the position after the last entry on or before date is returned, otherwise
+    the position of the first entry on or after date. None is unbounded.
+
+    Precondition:
+    index is sorted
+    """
+    if date is None:
+        return len(index) if upper else 0
+    try:
+        ts = pd.Timestamp(date)
+    except ValueError:
+        # Unparsable sentinels such as '0000-00-00' or '9999-99-99' lie before or after every date
+        return 0 if str(date) < '1970-01-01' else len(index)
+    if not len(index) or ts < index[0]:
+        return 0
+    if ts > index[-1]:
+        return len(index)
+    if hasattr(index, 'unit'):
+        ts = ts.as_unit(index.unit)
+    return index.searchsorted(ts, side='right' if upper else 'left')
+
+
+def slice_dates(df: pd.DataFrame, start_date: DateLike = None, end_date: DateLike = None) -> pd.DataFrame:
+    """
+    Returns the rows of df from start_date to end_date inclusive without comparing
+    every entry of the index
+
+    Precondition:
+    df is indexed by a sorted DatetimeIndex
+    """
+    return df.iloc[locate(df.index, start_date):locate(df.index, end_date, upper=True)]
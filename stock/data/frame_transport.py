@@ -0,0 +1,164 @@
+from __future__ import annotations
+from typing import Dict, Hashable, Iterator, List, Tuple
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing import resource_tracker
+import numpy as np
+import pandas as pd
+import os
+
+# (column name, dtype, byte offset) of every column of a frame
+_Columns = List[Tuple[Hashable, str, int]]
+
+
+class SharedFrames:
+    """
+    Data frames packed into one shared memory block.
+
+    Only the block name and the layout of the frames are pickled, so a SharedFrames
+    can be put on a multiprocessing queue or passed to a worker process without
+    copying the data through a pipe. Every column must have a fixed width dtype, and
+    the index must be a DatetimeIndex or a yyyy-mm-dd string index.
+
+    The block is freed by unlink, which should be called by the last user once every
+    other process is done with it.
+
+    === Representation Invariants ===
+    Every column and index of _layout lies inside the block and is 8 byte aligned
+    """
+    name: str
+    _layout: Dict[Hashable, Tuple[int, Hashable, str, int, bool, _Columns]]
+
+    def __init__(self, frames: Dict[Hashable, pd.DataFrame]):
+        """
+        Copies frames into a new shared memory block
+        :param frames:
+        A dictionary mapping keys to the frames to share
+        """
+        layout = {}
+        size = 0
+        for key, df in frames.items():
+            string_index = not isinstance(df.index, pd.DatetimeIndex)
+            index = pd.to_datetime(df.index).values if string_index else df.index.values
+            index_offset = size
+            size += _aligned(index.nbytes)
+            columns = []
+            for column in df.columns:
+                dtype = df[column].dtype
+                if dtype.kind not in 'biufcmM':
+                    raise ValueError(f"Column {column} Must Have A Fixed Width Dtype")
+                columns.append((column, dtype.str, size))
+                size += _aligned(len(df) * dtype.itemsize)
+            layout[key] = (len(df), df.index.name, index.dtype.str, index_offset, string_index, columns)
+        shm = SharedMemory(create=True, size=max(size, 1))
+        _untrack(shm)
+        try:
+            for key, df in frames.items():
+                length, name, index_dtype, index_offset, string_index, columns = layout[key]
+                index = pd.to_datetime(df.index).values if string_index else df.index.values
+                np.ndarray(length, index_dtype, shm.buf, index_offset)[:] = index
+                for column, dtype, offset in columns:
+                    np.ndarray(length, dtype, shm.buf, offset)[:] = df[column].to_numpy()
+        except BaseException:
+            shm.close()
+            self.name = shm.name
+            self.unlink()
+            raise
+        self.name = shm.name
+        self._layout = layout
+        shm.close()
+
+    def keys(self) -> List[Hashable]:
+        """
+        Returns the keys of the shared frames
+        """
+        return list(self._layout)
+
+    @contextmanager
+    def attach(self) -> Iterator[Dict[Hashable, pd.DataFrame]]:
+        """
+        Maps the block for the duration of the with block
+        :return:
+        A dictionary mapping keys to frames whose columns are views into the block.
+        Frames must be copied if they are used after the with block.
+        """
+        shm = SharedMemory(name=self.name)
+        _untrack(shm)
+        frames = {}
+        try:
+            for key, (length, name, index_dtype, index_offset, string_index, columns) in self._layout.items():
+                index = pd.DatetimeIndex(np.ndarray(length, index_dtype, shm.buf, index_offset), name=name)
+                if string_index:
+                    index = pd.Index(index.strftime('%Y-%m-%d'), name=name)
+                frames[key] = pd.DataFrame({column: np.ndarray(length, dtype, shm.buf, offset)
+                                            for column, dtype, offset in columns}, index=index, copy=False)
+            yield frames
+        finally:
+            frames.clear()
+            try:
+                shm.close()
+            except BufferError:
+                # A caller still holds a view. The mapping is released with it.
+                pass
+
+    def unlink(self) -> None:
+        """
+        Frees the shared memory block
+        """
+        shm = SharedMemory(name=self.name)
+        shm.close()
+        shm.unlink()
+
+
+class SharedPanel:
+    """
+    A panel with (field, symbol) columns, as returned by data_manager.get_panel,
+    in one shared memory block. Like SharedFrames only the block name and the
+    layout are pickled. Freed by unlink.
+    """
+    fields: List[Hashable]
+    symbols: List[Hashable]
+    _frames: SharedFrames
+
+    def __init__(self, panel: pd.DataFrame):
+        """
+        Copies panel into a new shared memory block
+        """
+        self.fields = list(panel.columns.unique(level=0))
+        self.symbols = list(panel.columns.unique(level=1))
+        self._frames = SharedFrames({field: panel[field].reindex(columns=self.symbols) for field in self.fields})
+
+    @property
+    def name(self) -> str:
+        return self._frames.name
+
+    def load(self) -> pd.DataFrame:
+        """
+        Returns a copy of the panel read from the block
+        """
+        with self._frames.attach() as frames:
+            index = frames[self.fields[0]].index if self.fields else pd.DatetimeIndex([])
+            values = np.concatenate([frames[field].to_numpy() for field in self.fields], axis=1) if self.fields \
+                else np.empty((0, 0))
+            # Built from copies, since the block is unmapped once the with block ends
+            return pd.DataFrame(values, index=pd.Index(index.to_numpy(copy=True), name=index.name),
+                                columns=pd.MultiIndex.from_product([self.fields, self.symbols]))
+
+    def unlink(self) -> None:
+        """
+        Frees the shared memory block
+        """
+        self._frames.unlink()
+
+
+def _untrack(shm: SharedMemory) -> None:
+    """
+    Stops the resource tracker of this process from unlinking shm when the process
+    exits, since the block is owned by whoever calls SharedFrames.unlink
+    """
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + 7) // 8 * 8
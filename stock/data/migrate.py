@@ -0,0 +1,43 @@
+from stock.data.database import RwDatabase
+from typing import Iterable
+import argparse
+import glob
+import os
+
+
+def migrate_databases(paths: Iterable[str], vacuum: bool = True, verbose: bool = False) -> None:
+    """
+    Converts the Date keyed tables of every database file in paths in place to
+    the current schema version. Databases already at the current version are
+    skipped.
+    :param paths:
+    Paths of the database files
+    :param vacuum:
+    Whether or not to reclaim the space freed by the rebuilt tables. Default: True
+    :param verbose:
+    Whether or not to print the database that is currently being migrated.
+    Default: False
+    """
+    for path in paths:
+        db_path, db_name = os.path.split(path)
+        db = RwDatabase(os.path.join(db_path or '.', ''), db_name)
+        try:
+            if db.schema_version >= RwDatabase.SCHEMA_VERSION:
+                continue
+            if verbose:
+                print(f"Migrating {path}")
+            count = db.migrate()
+            if vacuum:
+                db.cursor.execute('VACUUM;')
+            if verbose:
+                print(f"Rebuilt {count} tables in {path}")
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrates database files to the current schema version')
+    parser.add_argument('paths', nargs='*', default=['findata/*.db'], help="Database files or glob patterns. Default: 'findata/*.db'")
+    parser.add_argument('--no-vacuum', action='store_true', help='Do not vacuum the migrated databases')
+    args = parser.parse_args()
+    migrate_databases([file for pattern in args.paths for file in sorted(glob.glob(pattern))], not args.no_vacuum, verbose=True)
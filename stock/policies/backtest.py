@@ -0,0 +1,198 @@
+from __future__ import annotations
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+
+
+class BacktestResult:
+    """
+    Outcome of a backtest of every symbol of a panel, each traded on its own
+    with a capital of 1.
+
+    Positions are fractions of the capital of a symbol. A position decided at
+    the close of a bar is filled at the open of the next bar of the symbol.
+
+    === Representation Invariants ===
+    positions, trades, fill_prices, returns and equity are dates x symbols frames
+    with the same index and columns. Rows on which a symbol has no bar are NaN,
+    except in equity, which carries the last value forward.
+    """
+    positions: pd.DataFrame
+    trades: pd.DataFrame
+    fill_prices: pd.DataFrame
+    returns: pd.DataFrame
+    equity: pd.DataFrame
+    portfolio_returns: pd.Series
+    portfolio: pd.Series
+
+    def __init__(self, positions: pd.DataFrame, trades: pd.DataFrame, fill_prices: pd.DataFrame, returns: pd.DataFrame):
+        """
+        Creates the result of the positions held during every bar, the trades filled
+        at the open of every bar, their prices and the returns of every bar net of costs.
+        Equity curves are the products of the returns, and the portfolio holds every
+        symbol with a bar in equal weights, rebalanced daily.
+        """
+        self.positions = positions
+        self.trades = trades
+        self.fill_prices = fill_prices
+        self.returns = returns
+        values = returns.to_numpy()
+        self.equity = pd.DataFrame(equity_curves(values), index=returns.index, columns=returns.columns)
+        daily = portfolio_returns(values)
+        self.portfolio_returns = pd.Series(daily, index=returns.index, name='portfolio')
+        self.portfolio = pd.Series(np.cumprod(1 + daily), index=returns.index, name='portfolio')
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Returns the total return, annualized volatility, Sharpe ratio, maximum
+        drawdown and number of trades of every symbol and of the portfolio
+        """
+        returns = np.column_stack([self.returns.to_numpy(), self.portfolio_returns.to_numpy()])
+        equity = np.column_stack([self.equity.to_numpy(), self.portfolio.to_numpy()])
+        trades = (np.nan_to_num(self.trades.to_numpy()) != 0).sum(axis=0)
+        res = pd.DataFrame(statistics(returns, equity), index=list(self.returns.columns) + ['portfolio'])
+        res['trades'] = np.append(trades, trades.sum())
+        return res
+
+
+class Market:
+    """
+    Prices of a panel prepared for backtests, so many sets of targets can be
+    traded on the same dates and symbols without preparing them again.
+
+    Prices are adjusted with Adj Close if the panel has it. A missing open is
+    filled at the close. A symbol has a bar on every date its Close is known.
+
+    === Representation Invariants ===
+    every array is dates x symbols
+    previous holds the flat position of the previous bar of the symbol where has_previous
+    """
+    index: pd.DatetimeIndex
+    symbols: pd.Index
+    open: np.ndarray
+    present: np.ndarray
+    has_previous: np.ndarray
+    previous: np.ndarray
+    overnight: np.ndarray
+    intraday: np.ndarray
+
+    def __init__(self, panel: pd.DataFrame, index: pd.DatetimeIndex, symbols: pd.Index):
+        """
+        :param panel:
+        A data frame with (field, symbol) columns, as returned by data_manager.get_panel,
+        holding at least Open and Close
+        :param index: Dates traded
+        :param symbols: Symbols traded
+        """
+        self.index = index
+        self.symbols = symbols
+        fields = panel.columns.unique(level=0)
+        close = panel['Close'].reindex(index=index, columns=symbols).to_numpy(dtype=float)
+        open_ = panel['Open'].reindex(index=index, columns=symbols).to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if 'Adj Close' in fields:
+                adjusted = panel['Adj Close'].reindex(index=index, columns=symbols).to_numpy(dtype=float)
+                factor = np.where(np.isnan(adjusted), 1.0, adjusted / close)
+                close = close * factor
+                open_ = open_ * factor
+            self.open = np.where(np.isnan(open_), close, open_)
+            self.present = ~np.isnan(close)
+            # Row of the previous bar of every symbol, or -1 before its first
+            last = np.maximum.accumulate(np.where(self.present, np.arange(len(index))[:, None], -1), axis=0)
+            previous = np.vstack([np.full((1, len(symbols)), -1), last[:-1]]) if len(index) else last
+            self.has_previous = self.present & (previous >= 0)
+            self.previous = np.maximum(previous, 0) * len(symbols) + np.arange(len(symbols))
+            self.overnight = self.open / close.ravel()[self.previous] - 1
+            self.intraday = close / self.open - 1
+
+    def trade(self, targets: np.ndarray, cost: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Trades towards targets, a dates x symbols array of the positions wanted at the
+        close of every bar, NaN being no position. The position held during a bar is
+        the target at the close of the previous bar of the symbol, and is filled at its
+        open. The return of a bar is that of the previous position from the previous
+        close to the open, times that of the new position from the open to the close,
+        less cost times the position traded.
+        :return:
+        The positions held during every bar, the trades filled at its open and its
+        returns, NaN where a symbol has no bar
+        """
+        target = np.nan_to_num(np.asarray(targets, dtype=float)).ravel()
+        with np.errstate(invalid='ignore'):
+            held = np.where(self.has_previous, target[self.previous], 0.0)
+            before = np.where(self.has_previous, held.ravel()[self.previous], 0.0)
+            gap = np.where(self.has_previous, before * self.overnight, 0.0)
+            returns = (1 + gap) * (1 + held * self.intraday) * (1 - cost * np.abs(held - before)) - 1
+        trades = held - before
+        return (np.where(self.present, held, np.nan), np.where(self.present, trades, np.nan),
+                np.where(self.present, returns, np.nan))
+
+
+def run_backtest(panel: pd.DataFrame, targets: pd.DataFrame, cost: float = 0.0) -> BacktestResult:
+    """
+    Simulates trading every symbol of targets towards its target positions, as
+    array operations over all symbols and dates at once. See Market.trade.
+
+    :param panel:
+    A data frame with (field, symbol) columns, as returned by data_manager.get_panel,
+    holding at least Open and Close. A symbol has a bar on every date its Close is known
+    :param targets:
+    A dates x symbols data frame of the positions wanted at the close of every bar. NaN is no position
+    :param cost:
+    Cost of trading as a fraction of the value traded. Default: 0
+    :return:
+    The BacktestResult over the dates and symbols of targets
+    """
+    market = Market(panel, targets.index, targets.columns)
+    positions, trades, returns = market.trade(targets.to_numpy(dtype=float), cost)
+    return BacktestResult(_frame(positions, targets), _frame(trades, targets),
+                          _frame(np.where(np.nan_to_num(trades) != 0, market.open, np.nan), targets),
+                          _frame(returns, targets))
+
+
+def equity_curves(returns: np.ndarray) -> np.ndarray:
+    """
+    Returns the products of returns, a dates x symbols array with NaN where a
+    symbol has no bar, carrying the last value forward
+    """
+    return np.cumprod(np.where(np.isnan(returns), 1.0, 1 + returns), axis=0)
+
+
+def portfolio_returns(returns: np.ndarray) -> np.ndarray:
+    """
+    Returns the daily returns of holding every symbol with a bar in equal weights,
+    given their returns as a dates x symbols array with NaN where a symbol has no bar
+    """
+    # Summed in one memory order, since numpy orders the additions by layout
+    returns = np.ascontiguousarray(returns)
+    present = ~np.isnan(returns)
+    count = present.sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        return np.where(count > 0, np.where(present, returns, 0.0).sum(axis=1) / count, 0.0)
+
+
+def statistics(returns: np.ndarray, equity: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Returns the total return, annualized volatility, Sharpe ratio and maximum
+    drawdown of every column of returns, a dates x columns array with NaN where
+    a column has no bar, and of equity, their equity curves
+    """
+    returns = np.asfortranarray(returns)
+    present = ~np.isnan(returns)
+    count = present.sum(axis=0)
+    values = np.where(present, returns, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=0) / count
+        std = np.sqrt((np.where(present, returns - mean, 0.0) ** 2).sum(axis=0) / (count - 1))
+        std = np.where(count > 1, std, np.nan)
+        peak = np.maximum.accumulate(equity, axis=0)
+        return {'total_return': equity[-1] - 1 if len(equity) else np.full(equity.shape[1], np.nan),
+                'volatility': std * np.sqrt(TRADING_DAYS),
+                'sharpe': mean / std * np.sqrt(TRADING_DAYS),
+                'max_drawdown': (equity / peak - 1).min(axis=0) if len(equity) else np.full(equity.shape[1], np.nan)}
+
+
+def _frame(values: np.ndarray, like: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(values, index=like.index, columns=like.columns)
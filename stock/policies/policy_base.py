@@ -1,14 +1,116 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from stock.data import data_manager
+from stock.data.date_index import DateLike, normalize, slice_dates
+from stock.policies.backtest import BacktestResult, run_backtest
+from stock.policies.simulator import BarWindow, Simulator
+from stock.policies.walk_forward import walk_forward as _walk_forward
 import pandas as pd
 from datetime import datetime
 
 
 class PolicyBase(ABC):
+    """
+    Base for a trading policy. signal decides the target positions of all symbols
+    of a price panel at once, and is backtested by fit_batch. fit_day decides the
+    target of one symbol bar by bar, and is driven by a Simulator.
 
-    def fit_batch(self, data: pd.DataFrame, start_date: datetime, end_date: datetime):
-        for i in range(*data.index.splice_locs(start_date, end_date)):
-            print(i)
+    Positions are fractions of the capital of a symbol, decided at the close of a
+    bar and filled at the open of the next one (see run_backtest).
 
+    fields are the columns of stock data signal and fit_day read, and lookback the
+    number of bars before the current one fit_day reads.
+    """
+    fields: Tuple[str, ...] = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')
+    lookback: int = 0
 
-    def fit_day(self, data: pd.DataFrame, today: datetime):
+    @abstractmethod
+    def signal(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes the target positions of every symbol of data, a panel with
+        (field, symbol) columns as returned by data_manager.get_panel. The target
+        of a symbol at a date may only depend on its bars up to that date.
+        :return:
+        A dates x symbols data frame with the index of data
+        """
         pass
+
+    @classmethod
+    def sweep_signals(cls, data: pd.DataFrame, params: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], pd.DataFrame]]:
+        """
+        Computes the signal on data of the policy created with each parameters of
+        params, in order. Can be overwritten to share work between parameters.
+        :return:
+        An iterator of the parameters and their signal
+        """
+        for kwargs in params:
+            yield kwargs, cls(**kwargs).signal(data)
+
+    def fit_batch(self, data: pd.DataFrame, start_date: DateLike = None, end_date: DateLike = None,
+                  cost: float = 0.0) -> BacktestResult:
+        """
+        Backtests the policy on data from start_date to end_date inclusive. Signals
+        are computed on all of data, so bars before start_date warm them up, and
+        trading starts flat on the first bar of the range.
+        :param data:
+        A panel with (field, symbol) columns as returned by data_manager.get_panel
+        :param cost:
+        Cost of trading as a fraction of the value traded. Default: 0
+        """
+        data = normalize(data)
+        targets = normalize(self.signal(data)).reindex(data.index)
+        return run_backtest(slice_dates(data, start_date, end_date), slice_dates(targets, start_date, end_date), cost)
+
+    @classmethod
+    def walk_forward(cls, grid: Dict[str, Iterable[Any]], data: pd.DataFrame, train: int, test: int,
+                     step: int = None, start_date: DateLike = None, end_date: DateLike = None, cost: float = 0.0,
+                     metric: str = 'sharpe', workers: int = None, start_method: str = None) -> pd.DataFrame:
+        """
+        Walks forward over data from start_date to end_date with train and test
+        windows of train and test bars, step bars apart, selecting on every train
+        window the parameters of grid with the best metric.
+        See stock.policies.walk_forward.walk_forward
+        :return:
+        A table of the folds, parameters and symbols
+        """
+        return _walk_forward(cls, grid, data, train, test, step, start_date, end_date, cost, metric, workers,
+                             start_method)
+
+    def backtest(self, exchange: str, symbols: Iterable[str], start_date: DateLike = None, end_date: DateLike = None,
+                 cost: float = 0.0) -> BacktestResult:
+        """
+        Backtests the policy on symbols of exchange like fit_batch, reading all
+        their history as one panel of the fields of the policy and the prices
+        run_backtest needs
+        """
+        return self.fit_batch(data_manager.get_panel(exchange, symbols, self._panel_fields()), start_date, end_date, cost)
+
+    def simulate(self, exchange: str, symbols: Iterable[str], start_date: DateLike = None, end_date: DateLike = None,
+                 cost: float = 0.0) -> BacktestResult:
+        """
+        Simulates the policy bar by bar on symbols of exchange with fit_day. The
+        result equals that of backtest if fit_day agrees with signal.
+        """
+        panel = data_manager.get_panel(exchange, symbols, self._panel_fields())
+        return Simulator(self, cost, start_date, end_date).run_panel(panel)
+
+    def _panel_fields(self) -> list:
+        return list(dict.fromkeys(tuple(self.fields) + ('Open', 'Close', 'Adj Close')))
+
+    def fit_day(self, data: BarWindow, today: datetime) -> float:
+        """
+        Decides the target position of a symbol at the close of today. Called on
+        every bar of the symbol in order, with data holding its last lookback + 1
+        bars, today's last. Incremental state of the symbol can be kept in data.state,
+        so a bar costs O(1).
+
+        By default the last target of signal computed on the bars of data, dated on
+        the days up to today, which costs O(lookback) per bar and agrees with signal
+        if its targets only depend on the last lookback + 1 bars of a symbol.
+        :return:
+        The target position
+        """
+        panel = pd.DataFrame({(field, data.symbol): data[field] for field in data.fields},
+                             index=pd.date_range(end=pd.Timestamp(today), periods=len(data), freq='D'))
+        return float(self.signal(panel).iloc[-1, 0])
@@ -0,0 +1,232 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from stock.data.date_index import DateLike, normalize, locate
+from stock.policies.backtest import BacktestResult
+import numpy as np
+import pandas as pd
+
+NAN = float('nan')
+
+
+class BarWindow:
+    """
+    The last size bars of a symbol, given to PolicyBase.fit_day. Every field is
+    stored twice in a ring buffer, so the window of a field is a view of
+    contiguous memory and appending a bar takes O(1).
+
+    state is kept for the policy, which may hold its incremental state of the
+    symbol there. It is None until the policy sets it.
+
+    === Representation Invariants ===
+    the bar appended k-th is at column k % size and k % size + size of _buffer
+    """
+    symbol: str
+    fields: Tuple[str, ...]
+    size: int
+    count: int
+    state: Any
+    _buffer: np.ndarray
+    _rows: Dict[str, int]
+
+    def __init__(self, symbol: str, fields: Sequence[str], size: int):
+        if size < 1:
+            raise ValueError("Window Size Must Be Positive")
+        self.symbol = symbol
+        self.fields = tuple(fields)
+        self.size = size
+        self.count = 0
+        self.state = None
+        self._buffer = np.full((len(self.fields), 2 * size), np.nan)
+        self._rows = {field: i for i, field in enumerate(self.fields)}
+
+    def append(self, values: Sequence[float]) -> None:
+        """
+        Appends a bar, given as the values of fields
+        """
+        pos = self.count % self.size
+        self._buffer[:, pos] = values
+        self._buffer[:, pos + self.size] = values
+        self.count += 1
+
+    def last(self, field: str) -> float:
+        """
+        Returns the value of field in the last bar
+        """
+        return float(self._buffer[self._rows[field], (self.count - 1) % self.size])
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        """
+        Returns a read only view of the values of field in the last min(count, size)
+        bars, oldest first
+        """
+        end = (self.count - 1) % self.size + 1 + self.size
+        res = self._buffer[self._rows[field], end - min(self.count, self.size):end]
+        res.flags.writeable = False
+        return res
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+
+class _Account:
+    """
+    Trading state of one symbol of a Simulator and the record of its bars
+
+    === Representation Invariants ===
+    before is the position held during the last bar traded, or 0 before it
+    target is the position decided at the close of the last bar
+    """
+    window: BarWindow
+    trading: bool
+    close: float
+    before: float
+    target: float
+    rows: List[Tuple[pd.Timestamp, float, float, float, float]]
+
+    def __init__(self, window: BarWindow):
+        self.window = window
+        self.trading = False
+        self.close = NAN
+        self.before = 0.0
+        self.target = 0.0
+        self.rows = []
+
+
+class Simulator:
+    """
+    Event driven simulator feeding bars one at a time to PolicyBase.fit_day. Every
+    symbol has a BarWindow of the last policy.lookback + 1 bars and its own account,
+    so a bar costs O(1) however long the history is. Any number of symbols share
+    one event loop.
+
+    Trading follows run_backtest: the target decided at the close of a bar is
+    filled at the open of the next bar of the symbol. The arithmetic is that of
+    run_backtest, so a policy whose fit_day gives the same targets as its signal
+    has exactly the result of fit_batch.
+    """
+    policy: Any
+    cost: float
+    start_date: Optional[pd.Timestamp]
+    end_date: Optional[pd.Timestamp]
+    _accounts: Dict[str, _Account]
+    _today: Optional[pd.Timestamp]
+    _in_range: bool
+
+    def __init__(self, policy: Any, cost: float = 0.0, start_date: DateLike = None, end_date: DateLike = None):
+        """
+        :param policy: A PolicyBase implementing fit_day
+        :param cost:
+        Cost of trading as a fraction of the value traded. Default: 0
+        :param start_date:
+        First date traded. Earlier bars only warm the policy up. Defaults to the first bar
+        :param end_date:
+        Last date traded. Defaults to the last bar
+        """
+        self.policy = policy
+        self.cost = cost
+        self.start_date = None if start_date is None else pd.Timestamp(start_date)
+        self.end_date = None if end_date is None else pd.Timestamp(end_date)
+        self._accounts = {}
+        self._today = None
+        self._in_range = False
+
+    def on_bar(self, symbol: str, today: pd.Timestamp, bar: Dict[str, float]) -> float:
+        """
+        Processes the next bar of symbol, holding the fields of the policy and Open,
+        Close and, optionally, Adj Close. Bars of a symbol must come in order of date.
+        :return:
+        The position decided at the close of the bar
+        """
+        account = self._accounts.get(symbol)
+        if account is None:
+            account = self._accounts[symbol] = _Account(BarWindow(symbol, self.policy.fields, self.policy.lookback + 1))
+        account.window.append([bar[field] for field in account.window.fields])
+        target = self.policy.fit_day(account.window, today)
+        target = 0.0 if target is None or target != target else target
+        if today is not self._today:
+            # Bars of many symbols share a date, which is compared once
+            self._today = today
+            self._in_range = ((self.start_date is None or today >= self.start_date)
+                              and (self.end_date is None or today <= self.end_date))
+        if self._in_range:
+            self._trade(account, today, bar)
+        account.target = target
+        return target
+
+    def _trade(self, account: _Account, today: pd.Timestamp, bar: Dict[str, float]) -> None:
+        """
+        Fills the position held during bar and records its return, as run_backtest does
+        """
+        close = bar['Close']
+        open_ = bar['Open']
+        adjusted = bar.get('Adj Close', NAN)
+        if adjusted == adjusted:
+            factor = adjusted / close
+            close = close * factor
+            open_ = open_ * factor
+        if open_ != open_:
+            open_ = close
+        if account.trading:
+            held = account.target
+            before = account.before
+            gap = before * (open_ / account.close - 1)
+        else:
+            held = before = gap = 0.0
+        ret = (1 + gap) * (1 + held * (close / open_ - 1)) * (1 - self.cost * abs(held - before)) - 1
+        account.rows.append((today, held, held - before, open_ if held != before else NAN, ret))
+        account.trading = True
+        account.close = close
+        account.before = held
+
+    def run(self, events: Iterable[Tuple[pd.Timestamp, str, Dict[str, float]]]) -> None:
+        """
+        Processes events, tuples of a date, a symbol and a bar, in order
+        """
+        for today, symbol, bar in events:
+            self.on_bar(symbol, today, bar)
+
+    def run_panel(self, data: pd.DataFrame) -> BacktestResult:
+        """
+        Feeds every bar of data, a panel with (field, symbol) columns as returned by
+        data_manager.get_panel, date by date. A symbol has a bar on every date its
+        Close is known.
+        :return:
+        The result over the symbols of data and the dates traded
+        """
+        data = normalize(data)
+        symbols = list(data.columns.unique(level=1))
+        fields = list(dict.fromkeys(tuple(self.policy.fields) + ('Open', 'Close')
+                                    + (('Adj Close',) if 'Adj Close' in data.columns.unique(level=0) else ())))
+        values = np.stack([data[field].reindex(columns=symbols).to_numpy(dtype=float) for field in fields], axis=2)
+        close = fields.index('Close')
+        for row, today in enumerate(data.index):
+            columns = np.flatnonzero(~np.isnan(values[row, :, close]))
+            for column, bar in zip(columns.tolist(), values[row, columns].tolist()):
+                self.on_bar(symbols[column], today, dict(zip(fields, bar)))
+        first = 0 if self.start_date is None else locate(data.index, self.start_date)
+        last = len(data.index) if self.end_date is None else locate(data.index, self.end_date, upper=True)
+        return self.result(symbols, data.index[first:last])
+
+    def result(self, symbols: Iterable[str] = None, index: pd.DatetimeIndex = None) -> BacktestResult:
+        """
+        Returns the result of the bars traded so far
+        :param symbols:
+        Columns of the result. Defaults to every symbol seen, in order of their first bar
+        :param index:
+        Dates of the result. Defaults to every date traded
+        """
+        symbols = list(self._accounts) if symbols is None else list(symbols)
+        if index is None:
+            index = pd.DatetimeIndex(sorted({row[0] for account in self._accounts.values() for row in account.rows}),
+                                     name='Date')
+        frames = [np.full((len(index), len(symbols)), np.nan) for _ in range(4)]
+        for column, symbol in enumerate(symbols):
+            account = self._accounts.get(symbol)
+            if account is None or not account.rows:
+                continue
+            dates, *columns = zip(*account.rows)
+            rows = index.get_indexer(pd.DatetimeIndex(dates))
+            for frame, values in zip(frames, columns):
+                frame[rows, column] = values
+        positions, trades, fill_prices, returns = (pd.DataFrame(frame, index=index, columns=symbols) for frame in frames)
+        return BacktestResult(positions, trades, fill_prices, returns)
@@ -0,0 +1,163 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from stock.data.date_index import DateLike, normalize, locate
+from stock.data.frame_transport import SharedPanel
+from stock.policies.backtest import Market, equity_curves, portfolio_returns, statistics
+import multiprocessing
+import numpy as np
+import pandas as pd
+import os
+
+# Panel last loaded by this worker process, by the name of its block
+_loaded: Dict[str, pd.DataFrame] = {}
+
+# Columns of statistics, in the order of the tables
+STATISTICS = ('total_return', 'volatility', 'sharpe', 'max_drawdown')
+
+
+def sweep(policy: type, grid: Dict[str, Iterable[Any]], data: pd.DataFrame, start_date: DateLike = None,
+          end_date: DateLike = None, cost: float = 0.0, metric: str = 'sharpe', per_symbol: bool = False,
+          workers: int = None, chunk_size: int = 16, start_method: str = None) -> pd.DataFrame:
+    """
+    Backtests policy, a PolicyBase subclass, with every combination of the parameters
+    of grid on data from start_date to end_date, like fit_batch.
+
+    Combinations are split in chunks of chunk_size, in the order of the grid, and
+    the signals of a chunk are computed together by policy.sweep_signals so windows
+    and sums are shared. Chunks run in worker processes with map_shared.
+    Combinations the policy rejects with a ValueError are skipped.
+
+    :param grid:
+    A dictionary mapping parameter names of policy to the values to try
+    :param data:
+    A panel with (field, symbol) columns as returned by data_manager.get_panel
+    :param metric:
+    Column of the table to rank by, highest first. Default: sharpe
+    :param per_symbol:
+    Whether to rank every symbol of every combination instead of every combination's
+    portfolio. Default: False
+    :param workers:
+    Number of worker processes. Defaults to the number of CPUs. Chunks run in this
+    process if 1
+    :return:
+    A table with a row per combination, or per combination and symbol, holding the
+    parameters, total_return, volatility, sharpe, max_drawdown, trades and rank
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk Size Must Be Positive")
+    params = combinations(policy, grid)
+    chunks = [(policy, params[i:i + chunk_size], start_date, end_date, cost, per_symbol)
+              for i in range(0, len(params), chunk_size)]
+    rows = [row for res in map_shared(_sweep_chunk, normalize(data), chunks, workers, start_method) for row in res]
+    columns = list(grid) + (['symbol'] if per_symbol else []) + list(STATISTICS) + ['trades']
+    table = pd.DataFrame(rows, columns=columns)
+    if metric not in table.columns:
+        raise ValueError(f"Unknown Metric {metric}")
+    table = table.sort_values(metric, ascending=False, na_position='last', kind='stable', ignore_index=True)
+    table['rank'] = np.arange(1, len(table) + 1)
+    return table
+
+
+def combinations(policy: type, grid: Dict[str, Iterable[Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns the keyword arguments of every combination of the parameters of grid,
+    the last parameter varying fastest, leaving out those policy rejects with a
+    ValueError
+    """
+    names = list(grid)
+    res = []
+    for values in product(*(list(grid[name]) for name in names)):
+        kwargs = dict(zip(names, values))
+        try:
+            policy(**kwargs)
+        except ValueError:
+            continue
+        res.append(kwargs)
+    return res
+
+
+def map_shared(function: Callable[..., Any], data: pd.DataFrame, tasks: List[tuple], workers: int = None,
+               start_method: str = None) -> List[Any]:
+    """
+    Returns function(data, *task) for every task of tasks, in order. Tasks run in
+    worker processes reading data from one shared memory block, each worker loading
+    it once, or in this process if there is one worker or one task.
+    :param workers:
+    Number of worker processes. Defaults to the number of CPUs
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        return [function(data, *task) for task in tasks]
+    shared = SharedPanel(data)
+    try:
+        context = multiprocessing.get_context(start_method) if start_method else None
+        with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as pool:
+            futures = [pool.submit(_call_shared, function, shared, task) for task in tasks]
+            return [future.result() for future in futures]
+    finally:
+        shared.unlink()
+
+
+def evaluate(market: Market, targets: np.ndarray, cost: float = 0.0,
+             symbols: bool = True) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Trades targets on market, as Market.trade
+    :param symbols:
+    Whether to compute the statistics of every symbol, not only of the portfolio. Default: True
+    :return:
+    The statistics of every symbol if symbols, then of the portfolio, and their numbers of trades
+    """
+    positions, trades, returns = market.trade(targets, cost)
+    daily = portfolio_returns(returns)
+    traded = (np.nan_to_num(trades) != 0).sum(axis=0)
+    if not symbols:
+        return statistics(daily[:, None], np.cumprod(1 + daily)[:, None]), traded.sum(keepdims=True)
+    stats = statistics(np.column_stack([returns, daily]),
+                       np.column_stack([equity_curves(returns), np.cumprod(1 + daily)]))
+    return stats, np.append(traded, traded.sum())
+
+
+def _call_shared(function: Callable[..., Any], shared: SharedPanel, task: tuple) -> Any:
+    """
+    Runs a task in a worker, loading the panel from shared memory once per worker
+    """
+    data = _loaded.get(shared.name)
+    if data is None:
+        _loaded.clear()
+        data = _loaded[shared.name] = shared.load()
+    return function(data, *task)
+
+
+def _sweep_chunk(data: pd.DataFrame, policy: type, params: List[Dict[str, Any]], start_date: DateLike,
+                 end_date: DateLike, cost: float, per_symbol: bool) -> List[tuple]:
+    """
+    Backtests every parameters of params on data
+    :return:
+    A row of the table for every parameters, or for every parameters and symbol
+    """
+    first = locate(data.index, start_date)
+    last = locate(data.index, end_date, upper=True)
+    market: Optional[Market] = None
+    rows = []
+    for kwargs, targets in policy.sweep_signals(data, params):
+        targets = normalize(targets).reindex(data.index).iloc[first:last]
+        if market is None:
+            market = Market(data.iloc[first:last], targets.index, targets.columns)
+        stats, traded = evaluate(market, targets.to_numpy(dtype=float), cost, per_symbol)
+        values = tuple(kwargs.values())
+        columns = enumerate(targets.columns) if per_symbol else [(0, None)]
+        rows.extend(values + (() if symbol is None else (symbol,))
+                    + tuple(float(stats[name][i]) for name in STATISTICS) + (int(traded[i]),)
+                    for i, symbol in columns)
+    return rows
+
+
+if __name__ == '__main__':
+    import sys
+    from stock.data import data_manager
+    from stock.policy.p_ma import DoubleMA
+    # python -m stock.policies.sweep <exchange> <symbol> [<symbol> ...]
+    panel = data_manager.get_panel(sys.argv[1], sys.argv[2:], ('Open', 'Close', 'Adj Close'))
+    print(sweep(DoubleMA, {'fast': range(2, 21), 'slow': range(10, 101, 5)}, panel).head(20))
@@ -0,0 +1,120 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Tuple
+from stock.data.date_index import DateLike, normalize, locate
+from stock.policies.backtest import Market
+from stock.policies.sweep import STATISTICS, combinations, evaluate, map_shared
+import numpy as np
+import pandas as pd
+
+
+def folds(index: pd.DatetimeIndex, train: int, test: int, step: int = None, start_date: DateLike = None,
+          end_date: DateLike = None) -> List[Tuple[int, int, int]]:
+    """
+    Returns the folds of a walk forward over index from start_date to end_date, as
+    the positions in index of the start of the train window, of the start of the
+    test window and of the end of the test window. Windows are counted in bars and
+    the last fold is the last whose test window fits.
+    :param step:
+    Number of bars between the starts of consecutive folds. Defaults to test, so
+    test windows follow each other
+    """
+    step = test if step is None else step
+    if train < 1 or test < 1 or step < 1:
+        raise ValueError("Windows And Step Must Be Positive")
+    first = locate(index, start_date)
+    last = locate(index, end_date, upper=True)
+    return [(start, start + train, start + train + test) for start in range(first, last - train - test + 1, step)]
+
+
+def walk_forward(policy: type, grid: Dict[str, Iterable[Any]], data: pd.DataFrame, train: int, test: int,
+                 step: int = None, start_date: DateLike = None, end_date: DateLike = None, cost: float = 0.0,
+                 metric: str = 'sharpe', workers: int = None, start_method: str = None) -> pd.DataFrame:
+    """
+    Validates policy, a PolicyBase subclass, by walking forward over data: every fold
+    backtests every combination of the parameters of grid on train bars, then on the
+    test bars right after them, and the parameters with the best metric on train are
+    selected for every symbol and for the portfolio.
+
+    Each window is traded like fit_batch from flat, with signals warmed up by every
+    earlier bar. Folds run in worker processes with map_shared, reading data from
+    one shared memory block.
+
+    :param data:
+    A panel with (field, symbol) columns as returned by data_manager.get_panel
+    :param train: Number of bars of the train windows
+    :param test: Number of bars of the test windows
+    :param step:
+    Number of bars between folds. Defaults to test
+    :param metric:
+    Statistic maximized on train. Default: sharpe
+    :param workers:
+    Number of worker processes. Defaults to the number of CPUs. Folds run in this
+    process if 1
+    :return:
+    A table with a row per fold, parameters and symbol, then the portfolio, holding
+    the dates of the test window, the metric on train, the statistics and trades on
+    test, and whether the parameters are selected
+    """
+    if metric not in STATISTICS:
+        raise ValueError(f"Unknown Metric {metric}")
+    data = normalize(data)
+    params = combinations(policy, grid)
+    tasks = [(policy, params, fold, window, cost, metric)
+             for fold, window in enumerate(folds(data.index, train, test, step, start_date, end_date))]
+    parts = map_shared(_walk_fold, data, tasks, workers, start_method)
+    symbols = list(data['Close'].columns) + ['portfolio']
+    if not parts or not params:
+        return pd.DataFrame(columns=['fold', 'test_start', 'test_end'] + list(grid) + ['symbol', f'train_{metric}']
+                            + list(STATISTICS) + ['trades', 'selected'])
+    table = pd.concat(parts, ignore_index=True)
+    table['symbol'] = pd.Categorical.from_codes(table['symbol'].to_numpy(), symbols)
+    # Best parameters on train of every fold and symbol, the first of equals
+    best = table.sort_values(f'train_{metric}', ascending=False, na_position='last', kind='stable') \
+        .groupby(['fold', 'symbol'], observed=True).head(1).index
+    table['selected'] = False
+    table.loc[best, 'selected'] = True
+    return table
+
+
+def _walk_fold(data: pd.DataFrame, policy: type, params: List[Dict[str, Any]], fold: int,
+               window: Tuple[int, int, int], cost: float, metric: str) -> pd.DataFrame:
+    """
+    Backtests every parameters of params on the train and test windows of a fold
+    :return:
+    The rows of the fold, with the codes of the symbols, the portfolio last
+    """
+    start, middle, end = window
+    # Signals only depend on earlier bars, so later ones are not read
+    data = data.iloc[:end]
+    symbols = data['Close'].columns
+    train = Market(data.iloc[start:middle], data.index[start:middle], symbols)
+    tested = Market(data.iloc[middle:end], data.index[middle:end], symbols)
+    size = len(symbols) + 1
+    scores = []
+    stats = {name: [] for name in STATISTICS + ('trades',)}
+    for kwargs, targets in policy.sweep_signals(data, params):
+        targets = normalize(targets).reindex(index=data.index, columns=symbols).to_numpy(dtype=float)
+        scores.append(evaluate(train, targets[start:middle], cost)[0][metric])
+        res, traded = evaluate(tested, targets[middle:end], cost)
+        for name in STATISTICS:
+            stats[name].append(res[name])
+        stats['trades'].append(traded)
+    res = pd.DataFrame({'fold': np.full(len(params) * size, fold, dtype=np.int32),
+                        'test_start': data.index[middle], 'test_end': data.index[end - 1]})
+    for name in params[0] if params else ():
+        res[name] = np.repeat([kwargs[name] for kwargs in params], size)
+    res['symbol'] = np.tile(np.arange(size, dtype=np.int32), len(params))
+    res[f'train_{metric}'] = np.concatenate(scores) if scores else np.empty(0)
+    for name, values in stats.items():
+        res[name] = np.concatenate(values) if values else np.empty(0)
+    return res
+
+
+if __name__ == '__main__':
+    import sys
+    from stock.data import data_manager
+    from stock.policy.p_ma import DoubleMA
+    # python -m stock.policies.walk_forward <exchange> <symbol> [<symbol> ...]
+    panel = data_manager.get_panel(sys.argv[1], sys.argv[2:], ('Open', 'Close', 'Adj Close'))
+    table = walk_forward(DoubleMA, {'fast': range(2, 21, 2), 'slow': range(10, 101, 10)}, panel, 504, 126)
+    print(table[table['selected'] & (table['symbol'] == 'portfolio')])
@@ -1,4 +1,111 @@
 import pandas as pd
-import datetime as dt
-import sqlite3
-from typing import Union
\ No newline at end of file
+import numpy as np
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+from stock.policies.policy_base import PolicyBase
+from stock.policies.simulator import BarWindow
+from stock.processers.ma_processor import CumulativeSums
+
+
+class DoubleMA(PolicyBase):
+    """
+    Holds a symbol while its fast moving average is above its slow one, and
+    shorts it otherwise if short. Averages are taken over the last bars of each
+    symbol, and no position is taken until slow bars are known.
+
+    Averages are differences of cumulative sums relative to the first price in
+    both signal and fit_day, which keeps the first price and the last slow + 1
+    sums of each symbol, so both decide exactly alike.
+    """
+    fast: int
+    slow: int
+    column: str
+    short: bool
+
+    def __init__(self, fast: int = 5, slow: int = 20, column: str = 'Close', short: bool = False):
+        if not 0 < fast < slow:
+            raise ValueError("Fast Window Must Be Positive And Shorter Than Slow Window")
+        self.fast = fast
+        self.slow = slow
+        self.column = column
+        self.short = short
+        self.fields = (column,)
+
+    def signal(self, data: pd.DataFrame) -> pd.DataFrame:
+        prices = data[self.column]
+        sums = _cumulative_sums(prices)
+        return pd.DataFrame(sums.expand(self._decide(sums.mean(self.fast), sums.mean(self.slow)), 0.0),
+                            index=prices.index, columns=prices.columns)
+
+    @classmethod
+    def sweep_signals(cls, data: pd.DataFrame, params: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], pd.DataFrame]]:
+        """
+        Computes the signals of many parameters sharing the cumulative sums of every
+        column and the most recent trailing means of every window. Parameters
+        sharing windows should be next to each other.
+        """
+        sums = {}
+        means = OrderedDict()
+
+        def mean(column: str, window: int) -> np.ndarray:
+            key = (column, window)
+            if key in means:
+                means.move_to_end(key)
+            else:
+                means[key] = sums[column].mean(window)
+                if len(means) > 4:
+                    means.popitem(last=False)
+            return means[key]
+
+        for kwargs in params:
+            policy = cls(**kwargs)
+            if policy.column not in sums:
+                sums[policy.column] = _cumulative_sums(data[policy.column])
+            decided = policy._decide(mean(policy.column, policy.fast), mean(policy.column, policy.slow))
+            yield kwargs, pd.DataFrame(sums[policy.column].expand(decided, 0.0), index=data.index,
+                                       columns=data[policy.column].columns)
+
+    def _decide(self, fast: np.ndarray, slow: np.ndarray) -> np.ndarray:
+        """
+        Returns the targets given the fast and slow means
+        """
+        return np.where(np.isnan(slow), 0.0, np.where(fast > slow, 1.0, -1.0 if self.short else 0.0))
+
+    def fit_day(self, data: BarWindow, today: datetime) -> float:
+        value = data.last(self.column)
+        if value != value:
+            return 0.0
+        if data.state is None:
+            data.state = (value, deque(maxlen=self.slow + 1))
+        offset, sums = data.state
+        sums.append(sums[-1] + (value - offset) if sums else value - offset)
+        slow = _last_mean(sums, offset, self.slow)
+        if slow != slow:
+            return 0.0
+        return 1.0 if _last_mean(sums, offset, self.fast) > slow else -1.0 if self.short else 0.0
+
+
+def _cumulative_sums(prices: pd.DataFrame) -> CumulativeSums:
+    """
+    Returns the cumulative sums of the prices of every column, which skip missing prices
+    """
+    values = prices.to_numpy(dtype=float)
+    return CumulativeSums(values, ~np.isnan(values))
+
+
+def _last_mean(sums: deque, offset: float, window: int) -> float:
+    """
+    Returns the mean of the last window values from sums, their last cumulative
+    sums relative to offset, as CumulativeSums.mean computes it, or NaN if fewer
+    than window are known
+    """
+    if len(sums) > window:
+        return (sums[-1] - sums[-1 - window]) / window + offset
+    return sums[-1] / window + offset if len(sums) == window else float('nan')
+
+
+if __name__ == '__main__':
+    import sys
+    # python -m stock.policy.p_ma <exchange> <symbol> [<symbol> ...]
+    print(DoubleMA().backtest(sys.argv[1], sys.argv[2:]).summary())
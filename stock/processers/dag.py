@@ -0,0 +1,425 @@
+from __future__ import annotations
+from stock.data import data_manager
+from stock.data.cache import CacheView
+from stock.data.date_index import slice_dates
+from stock.processers.processor_base import ProcessorBase, _fingerprint
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple, Union
+import numpy as np
+import pandas as pd
+import operator
+
+Value = Union[pd.Series, pd.DataFrame]
+
+
+class Node(ABC):
+    """
+    Node of a processor graph. Nodes are immutable and identified by their key, the
+    class, parameters and input keys, so sub-expressions shared by several outputs
+    of a graph, such as a common rolling window, are only evaluated once, and their
+    values are reused by every graph evaluated on the same data.
+
+    A node evaluates to a Series indexed by date when the graph is evaluated on
+    the stock data of one symbol, and to a DataFrame with a column per symbol when
+    it is evaluated on a panel from data_manager.get_panel.
+
+    === Representation Invariants ===
+    - sequential nodes combine successive rows of their only input
+    """
+    inputs: Tuple[Node, ...]
+    key: tuple
+    sequential: bool = False
+
+    def __init__(self, *inputs: Node, params: tuple = ()):
+        self.inputs = inputs
+        self.key = (type(self),) + params + tuple(i.key for i in inputs)
+
+    @abstractmethod
+    def evaluate(self, data: pd.DataFrame, *inputs: Value) -> Value:
+        """
+        Computes this node from data, the stock data or panel the graph is
+        evaluated on, and the values of its inputs
+        """
+        pass
+
+    def mean(self, window: int) -> Node:
+        return Rolling(self, window, 'mean')
+
+    def std(self, window: int) -> Node:
+        return Rolling(self, window, 'std')
+
+    def min(self, window: int) -> Node:
+        return Rolling(self, window, 'min')
+
+    def max(self, window: int) -> Node:
+        return Rolling(self, window, 'max')
+
+    def sum(self, window: int) -> Node:
+        return Rolling(self, window, 'sum')
+
+    def shift(self, periods: int = 1) -> Node:
+        return Shift(self, periods)
+
+    def diff(self, periods: int = 1) -> Node:
+        return Diff(self, periods)
+
+    def cumsum(self) -> Node:
+        return Cumsum(self)
+
+    def __add__(self, other: Any) -> Node:
+        return BinaryOp('add', self, _node(other))
+
+    def __radd__(self, other: Any) -> Node:
+        return BinaryOp('add', _node(other), self)
+
+    def __sub__(self, other: Any) -> Node:
+        return BinaryOp('sub', self, _node(other))
+
+    def __rsub__(self, other: Any) -> Node:
+        return BinaryOp('sub', _node(other), self)
+
+    def __mul__(self, other: Any) -> Node:
+        return BinaryOp('mul', self, _node(other))
+
+    def __rmul__(self, other: Any) -> Node:
+        return BinaryOp('mul', _node(other), self)
+
+    def __truediv__(self, other: Any) -> Node:
+        return BinaryOp('truediv', self, _node(other))
+
+    def __rtruediv__(self, other: Any) -> Node:
+        return BinaryOp('truediv', _node(other), self)
+
+    def __gt__(self, other: Any) -> Node:
+        return BinaryOp('gt', self, _node(other))
+
+    def __ge__(self, other: Any) -> Node:
+        return BinaryOp('ge', self, _node(other))
+
+    def __lt__(self, other: Any) -> Node:
+        return BinaryOp('lt', self, _node(other))
+
+    def __le__(self, other: Any) -> Node:
+        return BinaryOp('le', self, _node(other))
+
+    def __and__(self, other: Any) -> Node:
+        return BinaryOp('and_', self, _node(other))
+
+    def __or__(self, other: Any) -> Node:
+        return BinaryOp('or_', self, _node(other))
+
+    def __neg__(self) -> Node:
+        return BinaryOp('sub', Const(0), self)
+
+
+class Field(Node):
+    """
+    A column of the stock data: Open, High, Low, Close, Adj Close or Volume
+    """
+    column: str
+
+    def __init__(self, column: str):
+        Node.__init__(self, params=(column,))
+        self.column = column
+
+    def evaluate(self, data: pd.DataFrame) -> Value:
+        return data[self.column]
+
+
+class Const(Node):
+    """
+    A constant, broadcast by the operations it is used in. Constants are keyed by
+    type and value, so 1, 1.0 and True differ, and unhashable ones are never shared
+    """
+    value: Any
+
+    def __init__(self, value: Any):
+        try:
+            hash(value)
+            params = (type(value), value)
+        except TypeError:
+            params = (object(),)
+        Node.__init__(self, params=params)
+        self.value = value
+
+    def evaluate(self, data: pd.DataFrame) -> Any:
+        return self.value
+
+
+class Processor(Node):
+    """
+    Column of the result of a processor, computed from the stock data the graph
+    is evaluated on rather than data fetched by the processor itself.
+    The first column is used if column is unspecified.
+    """
+    processor: ProcessorBase
+    column: Hashable
+
+    def __init__(self, processor: ProcessorBase, column: Hashable = None):
+        Node.__init__(self, params=(processor, column))
+        self.processor = processor
+        self.column = column
+
+    def evaluate(self, data: pd.DataFrame) -> Value:
+        if not isinstance(data.columns, pd.MultiIndex):
+            return self._column(self.processor.compute(data))
+        res = {symbol: self._column(df) for symbol, df in self.processor.compute_panel(data).items()}
+        return pd.DataFrame(res).reindex(data.index)
+
+    def _column(self, res: pd.DataFrame) -> pd.Series:
+        return res[self.column] if self.column is not None else res.iloc[:, 0]
+
+
+class Rolling(Node):
+    """
+    Rolling aggregation of a node over window rows
+    """
+    window: int
+    how: str
+    sequential = True
+
+    def __init__(self, node: Node, window: int, how: str = 'mean'):
+        if how not in ('mean', 'std', 'min', 'max', 'sum'):
+            raise ValueError("Unknown Rolling Aggregation")
+        Node.__init__(self, node, params=(window, how))
+        self.window = window
+        self.how = how
+
+    def evaluate(self, data: pd.DataFrame, value: Value) -> Value:
+        return getattr(value.rolling(self.window), self.how)()
+
+
+class Shift(Node):
+    periods: int
+    sequential = True
+
+    def __init__(self, node: Node, periods: int = 1):
+        Node.__init__(self, node, params=(periods,))
+        self.periods = periods
+
+    def evaluate(self, data: pd.DataFrame, value: Value) -> Value:
+        return value.shift(self.periods)
+
+
+class Diff(Node):
+    periods: int
+    sequential = True
+
+    def __init__(self, node: Node, periods: int = 1):
+        Node.__init__(self, node, params=(periods,))
+        self.periods = periods
+
+    def evaluate(self, data: pd.DataFrame, value: Value) -> Value:
+        return value.diff(self.periods)
+
+
+class Cumsum(Node):
+    sequential = True
+
+    def __init__(self, node: Node):
+        Node.__init__(self, node)
+
+    def evaluate(self, data: pd.DataFrame, value: Value) -> Value:
+        return value.cumsum()
+
+
+class BinaryOp(Node):
+    """
+    Element wise operation of the operator module on two nodes
+    """
+    op: str
+
+    def __init__(self, op: str, left: Node, right: Node):
+        if op not in ('add', 'sub', 'mul', 'truediv', 'gt', 'ge', 'lt', 'le', 'and_', 'or_'):
+            raise ValueError("Unknown Operator")
+        Node.__init__(self, left, right, params=(op,))
+        self.op = op
+
+    def evaluate(self, data: pd.DataFrame, left: Value, right: Value) -> Value:
+        return getattr(operator, self.op)(left, right)
+
+
+class Where(Node):
+    """
+    Takes the value of if_true where cond holds and the value of if_false elsewhere
+    """
+
+    def __init__(self, cond: Node, if_true: Any, if_false: Any):
+        Node.__init__(self, cond, _node(if_true), _node(if_false))
+
+    def evaluate(self, data: pd.DataFrame, cond: Value, if_true: Any, if_false: Any) -> Value:
+        res = np.where(cond.fillna(False).astype(bool), if_true, if_false)
+        if isinstance(cond, pd.DataFrame):
+            return pd.DataFrame(res, index=cond.index, columns=cond.columns)
+        return pd.Series(res, index=cond.index)
+
+
+class Graph:
+    """
+    Named output nodes evaluated together. Every node reachable from the outputs is
+    evaluated once per key, in topological order, and intermediate results read
+    through get_data are kept in the cache shared with data_manager.
+
+    On a panel, sequential nodes are evaluated per symbol over the rows on which the
+    symbol has a bar, and outputs are missing on the other rows, so results equal
+    those on the stock data of every symbol.
+    """
+    outputs: Dict[str, Node]
+    order: List[Node]
+    data: CacheView
+
+    def __init__(self, **outputs: Any):
+        """
+        Creates a graph
+        :param outputs:
+        The nodes to evaluate, keyed by the names of their columns in the result
+        """
+        self.outputs = {name: _node(node) for name, node in outputs.items()}
+        self.order = _topological_order(self.outputs.values())
+        self.data = data_manager.data.view(Graph)
+
+    def evaluate(self, data: pd.DataFrame, cache: Dict[tuple, Value] = None) -> pd.DataFrame:
+        """
+        Evaluates the outputs on data, the stock data of one symbol or a panel
+        :param cache:
+        Values of nodes already evaluated on data, by node key. Every node evaluated is added to it
+        :return:
+        A pandas DataFrame with a column per output, or with a (output, symbol)
+        column per output and symbol if data is a panel
+        """
+        values = cache if cache is not None else {}
+        present = _present(data) if isinstance(data.columns, pd.MultiIndex) else None
+        for node in self.order:
+            if node.key in values:
+                continue
+            inputs = [values[i.key] for i in node.inputs]
+            if present is not None and node.sequential:
+                values[node.key] = _by_symbol(present, inputs[0], lambda value: node.evaluate(data, value))
+            else:
+                values[node.key] = node.evaluate(data, *inputs)
+        res = {name: values[node.key] for name, node in self.outputs.items()}
+        if present is not None:
+            return pd.concat({name: _broadcast(value, present).where(present) for name, value in res.items()},
+                             axis=1)
+        return pd.DataFrame(res, index=data.index)
+
+    def get_data(self, exchange: str, symbol: str, start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> pd.DataFrame:
+        """
+        Evaluates the outputs on the stock data of symbol at exchange, reusing the
+        intermediate results of every graph evaluated on the same data before
+        :return:
+        A pandas DataFrame containing the data
+        """
+        stock = data_manager.get_frame(exchange, symbol)
+        # Results computed on older or corrected stock data are left to be evicted
+        version = (exchange + '/' + symbol, _fingerprint(stock))
+        values = {}
+        for node in self.order:
+            value = self.data.get((node.key, version))
+            if value is not None:
+                values[node.key] = value
+        missing = [node for node in self.order if node.key not in values]
+        res = self.evaluate(stock, values)
+        for node in missing:
+            if not isinstance(node, (Field, Const)):
+                self.data[(node.key, version)] = values[node.key]
+        return slice_dates(res, start_date, end_date)
+
+    def get_data_multi(self, symbols: Dict[str, Iterable[str]], start_date: str = '0000-00-00',
+                       end_date: str = '9999-99-99') -> Dict[str, Dict[str, pd.DataFrame]]:
+        """
+        Evaluates the outputs on the stock data of symbols
+        :param symbols:
+        A dictionary mapping exchanges to lists of symbols from that exchange
+        :return:
+        A dictionary mapping exchange to data frames
+        """
+        return {exchange: {symbol: self.get_data(exchange, symbol, start_date, end_date) for symbol in symbol_list}
+                for exchange, symbol_list in symbols.items()}
+
+    def get_panel(self, exchange: str, symbols: Iterable[str], start_date: str = '0000-00-00',
+                  end_date: str = '9999-99-99') -> pd.DataFrame:
+        """
+        Evaluates the outputs on the panel of symbols at exchange
+        :return:
+        A pandas DataFrame with a (output, symbol) column per output and symbol
+        """
+        fields = sorted({node.column for node in self.order if isinstance(node, Field)} |
+                        ({'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'}
+                         if any(isinstance(node, Processor) for node in self.order) else set()))
+        panel = data_manager.get_panel(exchange, symbols, fields)
+        return slice_dates(self.evaluate(panel), start_date, end_date)
+
+
+def _node(value: Any) -> Node:
+    """
+    Returns value if it is a node, or a constant node of value
+    """
+    return value if isinstance(value, Node) else Const(value)
+
+
+def _topological_order(outputs: Iterable[Node]) -> List[Node]:
+    """
+    Returns a node of every key reachable from outputs, each after all of its inputs
+    """
+    order = []
+    seen = set()
+    for output in outputs:
+        stack = [(output, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+            elif node.key not in seen:
+                seen.add(node.key)
+                stack.append((node, True))
+                stack.extend((i, False) for i in reversed(node.inputs) if i.key not in seen)
+    return order
+
+
+def _present(panel: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns whether every symbol of panel has a bar at every row, as a boolean
+    DataFrame with a column per symbol
+    """
+    symbols = panel.columns.unique(level=1)
+    present = np.zeros((len(panel), len(symbols)), dtype=bool)
+    for field in panel.columns.unique(level=0):
+        present |= panel[field].reindex(columns=symbols).notna().to_numpy()
+    return pd.DataFrame(present, index=panel.index, columns=symbols)
+
+
+def _by_symbol(present: pd.DataFrame, value: Any, function: Callable[[Value], Value]) -> Any:
+    """
+    Applies function, which combines successive rows, to every column of value over
+    the rows on which its symbol has a bar only. Columns without gaps are done together
+    """
+    if not isinstance(value, pd.DataFrame):
+        return function(value)
+    present = present.reindex(columns=value.columns, fill_value=False)
+    full = present.all(axis=0).to_numpy()
+    res = function(value.loc[:, full]).reindex(columns=value.columns)
+    for symbol in value.columns[~full]:
+        rows = present[symbol].to_numpy()
+        res[symbol] = function(value[symbol][rows]).reindex(value.index)
+    return res
+
+
+def _broadcast(value: Any, present: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns value, the value of an output on a panel, as a DataFrame shaped like present
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.reindex(index=present.index, columns=present.columns)
+    return pd.DataFrame(value, index=present.index, columns=present.columns)
+
+
+if __name__ == '__main__':
+    # Double moving average crossover of the DoubleMA notebook
+    close = Field('Close')
+    signal = close.mean(5) - close.mean(20)
+    last_signal = signal.shift(1)
+    pos = Where((signal > 0) & (last_signal < 0), 10000, Where((signal < 0) & (last_signal > 0), -10000, 0))
+    net_pos = pos.cumsum()
+    net_pl = (net_pos * close.diff()).cumsum()
+    print(Graph(signal=signal, pos=pos, net_pos=net_pos, net_pl=net_pl).get_data('nyse', 'A').tail())
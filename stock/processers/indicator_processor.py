@@ -0,0 +1,285 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+from stock.processers.processor_base import BufferedProcessorBase
+from stock.processers.kernels import Kernel, EMA, RollingMoments, RollingMin, RollingMax, RSI, ATR, VWAP, BollingerBands
+from stock.data.date_index import normalize, locate
+from stock.data.database import RwDatabase
+import numpy as np
+import pandas as pd
+
+
+class KernelProcessorBase(BufferedProcessorBase, ABC):
+    """
+    Base for processors computed by a Kernel on the input columns of stock data.
+
+    The kernel of every table is kept after each extension, so results are
+    extended bar by bar in O(new bars). Results without a kernel, such as stored
+    ones, are extended after running a new kernel on the rows holding the lookback
+    values before the new bars, or on all of them if the kernel depends on the
+    whole history.
+
+    === Representation Invariants ===
+    _states maps tables to the last date of their result and the kernel that computed it
+    """
+    inputs: Tuple[str, ...]
+    names: Tuple[str, ...]
+    _states: Dict[str, Tuple[pd.Timestamp, Kernel]]
+
+    def __init__(self, inputs: Tuple[str, ...], names: Tuple[str, ...]):
+        """
+        :param inputs: Columns of stock data given to the kernel
+        :param names: Columns of the result, one per output of the kernel
+        """
+        if not self.initialized:
+            BufferedProcessorBase.__init__(self)
+            self.inputs = inputs
+            self.names = names
+            self._states = {}
+
+    @abstractmethod
+    def kernel(self) -> Kernel:
+        """
+        Returns a new kernel
+        """
+        pass
+
+    @property
+    def lookback(self) -> Optional[int]:
+        return self.kernel().lookback
+
+    def compute(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes on data
+        :return:
+        A pandas DataFrame containing the result
+        """
+        return self._run(self.kernel(), data)
+
+    def _run(self, kernel: Kernel, data: pd.DataFrame) -> pd.DataFrame:
+        values = kernel.run(*(data[column].to_numpy(dtype=float) for column in self.inputs))
+        return pd.DataFrame(values, index=data.index, columns=list(self.names))
+
+    def _extend(self, tblname: str, data: pd.DataFrame, result: pd.DataFrame) -> pd.DataFrame:
+        """
+        Extends result, the result of tblname, with the kernel that computed it
+        """
+        if result.empty:
+            return self.extend(data, result)
+        pos = locate(data.index, result.index[-1], upper=True)
+        if pos >= len(data):
+            return result
+        with self._lock:
+            state = self._states.get(tblname)
+        if state is not None and state[0] == result.index[-1]:
+            kernel = state[1]
+        else:
+            kernel = self.kernel()
+            self._run(kernel, data.iloc[self._warm_up(kernel, data, pos):pos])
+        new = normalize(self._run(kernel, data.iloc[pos:]))
+        with self._lock:
+            self._states[tblname] = (new.index[-1], kernel)
+        return pd.concat([result, new])
+
+    def _warm_up(self, kernel: Kernel, data: pd.DataFrame, pos: int) -> int:
+        """
+        Returns the row from which a new kernel is run to resume at row pos of data.
+        Kernels skip rows with a NaN input, so that is the row with lookback valid
+        rows from it to pos, or the first row if there are fewer.
+        """
+        if kernel.lookback is None:
+            return 0
+        if kernel.lookback == 0:
+            return pos
+        valid = np.ones(pos, dtype=bool)
+        for column in self.inputs:
+            valid &= ~np.isnan(data[column].to_numpy(dtype=float)[:pos])
+        rows = np.flatnonzero(valid)
+        return int(rows[-kernel.lookback]) if len(rows) >= kernel.lookback else 0
+
+    def _reset(self, tblname: str) -> None:
+        """
+        Drops the kernel of tblname, which ran on stock data that changed since
+        """
+        with self._lock:
+            self._states.pop(tblname, None)
+
+    def _read(self, db: RwDatabase, tblname: str) -> Optional[pd.DataFrame]:
+        """
+        Read the stored data from db and table tblname
+        :return:
+        A pandas DataFrame containing the data or None if the table
+        does not have the data
+        """
+        if all(db.have_column(tblname, name) for name in self.names):
+            res = db.read_column(tblname, ['Date'] + [f'"{name}"' for name in self.names])
+            res.set_index('Date', inplace=True)
+            return res
+
+    def _write(self, db: RwDatabase, tblname: str, data: pd.DataFrame) -> None:
+        """
+        Write data into the table tblname of db
+
+        Precondition:
+        table tblname exists
+        """
+        db.write_columns(tblname, data)
+
+    def _write_many(self, db: RwDatabase, data: Dict[str, pd.DataFrame]) -> None:
+        """
+        Write data, a dictionary mapping table names to data frames, into db
+        with one staged load
+
+        Precondition:
+        every table in data exists in db
+        """
+        db.write_columns_multi(data)
+
+
+class EMAProcessor(KernelProcessorBase):
+    days: float
+    column: str
+
+    def __init__(self, days: float, column: str):
+        """
+        Calculates the exponential moving average of column with span days
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, (column,), (f"ema{days}_{column.lower()}",))
+            self.days = days
+            self.column = column
+
+    def kernel(self) -> Kernel:
+        return EMA(self.days)
+
+
+class RollingStdProcessor(KernelProcessorBase):
+    days: int
+    column: str
+    ddof: int
+
+    def __init__(self, days: int, column: str, ddof: int = 1):
+        """
+        Calculates the rolling standard deviation of column over days values
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, (column,), (f"std{days}_{column.lower()}",))
+            self.days = days
+            self.column = column
+            self.ddof = ddof
+
+    def kernel(self) -> Kernel:
+        return RollingMoments(self.days, self.ddof)
+
+    def _run(self, kernel: Kernel, data: pd.DataFrame) -> pd.DataFrame:
+        variance = kernel.run(data[self.column].to_numpy(dtype=float))[:, 1]
+        return pd.DataFrame({self.names[0]: np.sqrt(variance)}, index=data.index)
+
+
+class RollingMinProcessor(KernelProcessorBase):
+    days: int
+    column: str
+
+    def __init__(self, days: int, column: str):
+        """
+        Calculates the rolling minimum of column over days values
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, (column,), (f"min{days}_{column.lower()}",))
+            self.days = days
+            self.column = column
+
+    def kernel(self) -> Kernel:
+        return RollingMin(self.days)
+
+
+class RollingMaxProcessor(KernelProcessorBase):
+    days: int
+    column: str
+
+    def __init__(self, days: int, column: str):
+        """
+        Calculates the rolling maximum of column over days values
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, (column,), (f"max{days}_{column.lower()}",))
+            self.days = days
+            self.column = column
+
+    def kernel(self) -> Kernel:
+        return RollingMax(self.days)
+
+
+class RSIProcessor(KernelProcessorBase):
+    days: int
+    column: str
+
+    def __init__(self, days: int = 14, column: str = 'Close'):
+        """
+        Calculates the relative strength index of column over days
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, (column,), (f"rsi{days}_{column.lower()}",))
+            self.days = days
+            self.column = column
+
+    def kernel(self) -> Kernel:
+        return RSI(self.days)
+
+
+class ATRProcessor(KernelProcessorBase):
+    days: int
+
+    def __init__(self, days: int = 14):
+        """
+        Calculates the average true range over days
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, ('High', 'Low', 'Close'), (f"atr{days}",))
+            self.days = days
+
+    def kernel(self) -> Kernel:
+        return ATR(self.days)
+
+
+class VWAPProcessor(KernelProcessorBase):
+    days: Optional[int]
+
+    def __init__(self, days: int = None):
+        """
+        Calculates the volume weighted average price over days, or over the whole
+        history if days is unspecified
+        """
+        if not self.initialized:
+            KernelProcessorBase.__init__(self, ('High', 'Low', 'Close', 'Volume'),
+                                         ("vwap" if days is None else f"vwap{days}",))
+            self.days = days
+
+    def kernel(self) -> Kernel:
+        return VWAP(self.days)
+
+
+class BollingerProcessor(KernelProcessorBase):
+    days: int
+    k: float
+    column: str
+
+    def __init__(self, days: int = 20, k: float = 2.0, column: str = 'Close'):
+        """
+        Calculates Bollinger bands of column, the rolling mean over days values and
+        the bands k population standard deviations above and below it
+        """
+        if not self.initialized:
+            prefix = f"bb{days}_{k:g}_{column.lower()}"
+            KernelProcessorBase.__init__(self, (column,), (f"{prefix}_middle", f"{prefix}_upper", f"{prefix}_lower"))
+            self.days = days
+            self.k = k
+            self.column = column
+
+    def kernel(self) -> Kernel:
+        return BollingerBands(self.days, self.k)
+
+
+if __name__ == '__main__':
+    print(RSIProcessor().get_data('nyse', 'A'))
+    print(BollingerProcessor().get_data('nyse', 'A'))
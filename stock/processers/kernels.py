@@ -0,0 +1,551 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+NAN = float('nan')
+
+
+class Kernel(ABC):
+    """
+    Single pass O(n) indicator computation. A kernel keeps its state after the
+    last value it was given, so it can be resumed with later values: running it
+    on two consecutive parts of a series gives the results of running a new
+    kernel on the whole series, up to rounding.
+
+    Rows where any input is NaN give NaN and leave the state unchanged, so
+    windows count values rather than rows: results equal those of pandas on the
+    rows without a NaN input.
+
+    Runs of fewer than vector_min rows, such as appended bars, are stepped value
+    by value in O(1) each. Longer runs are computed at once with numpy and pandas
+    and the state is taken from their last values.
+
+    lookback is the number of preceding values the state depends on, or None if
+    it depends on all of them. A new kernel run on the lookback values before a
+    row has the same state as one run on the whole series up to it.
+    """
+    outputs: Tuple[str, ...]
+    lookback: Optional[int]
+    vector_min: int = 64
+
+    def run(self, *inputs: np.ndarray) -> np.ndarray:
+        """
+        Runs the kernel on inputs, float arrays of the same length
+        :return:
+        An array with a row for every input row and a column for every output
+        """
+        if len(inputs[0]) < self.vector_min:
+            return self._step(*inputs)
+        valid = np.ones(len(inputs[0]), dtype=bool)
+        for values in inputs:
+            valid &= ~np.isnan(values)
+        res = np.full((len(valid), len(self.outputs)), NAN)
+        if valid.any():
+            res[valid] = self._vector(*(values[valid] for values in inputs))
+        return res
+
+    def update(self, *values: float) -> Tuple[float, ...]:
+        """
+        Runs the kernel on one row
+        :return:
+        The outputs of the row
+        """
+        return tuple(self.run(*(np.array([value], dtype=float) for value in values))[0].tolist())
+
+    @abstractmethod
+    def _step(self, *inputs: np.ndarray) -> np.ndarray:
+        """
+        Runs the kernel on inputs value by value
+        :return:
+        An array with a row for every input row and a column for every output
+        """
+        pass
+
+    @abstractmethod
+    def _vector(self, *inputs: np.ndarray) -> np.ndarray:
+        """
+        Runs the kernel on inputs without NaN at once, leaving the state _step would
+
+        Precondition:
+        inputs are not empty
+        :return:
+        An array with a row for every input row and a column for every output
+        """
+        pass
+
+
+class EMA(Kernel):
+    """
+    Exponential moving average, as pd.Series.ewm(span=span, adjust=False).mean()
+    or pd.Series.ewm(alpha=alpha, adjust=False).mean() on the values that are not NaN
+    """
+    outputs = ('ema',)
+    lookback = None
+    alpha: float
+    value: float
+
+    def __init__(self, span: float = None, alpha: float = None):
+        if (span is None) == (alpha is None):
+            raise ValueError("Exactly One Of Span And Alpha Must Be Given")
+        alpha = 2 / (span + 1) if alpha is None else alpha
+        if not 0 < alpha <= 1:
+            raise ValueError("Alpha Must Be In (0, 1]")
+        self.alpha = alpha
+        self.value = NAN
+
+    def _step(self, values: np.ndarray) -> np.ndarray:
+        alpha = self.alpha
+        beta = 1 - alpha
+        ema = self.value
+        res = []
+        append = res.append
+        for x in values.tolist():
+            if x != x:
+                append(NAN)
+                continue
+            ema = x if ema != ema else alpha * x + beta * ema
+            append(ema)
+        self.value = ema
+        return np.array(res, dtype=float).reshape(-1, 1)
+
+    def _vector(self, values: np.ndarray) -> np.ndarray:
+        # Seeded with the last average, the recursion continues from it
+        seeded = self.value == self.value
+        series = pd.Series(np.concatenate([[self.value], values]) if seeded else values)
+        res = series.ewm(alpha=self.alpha, adjust=False).mean().to_numpy()[int(seeded):]
+        self.value = float(res[-1])
+        return res.reshape(-1, 1)
+
+
+class RollingMoments(Kernel):
+    """
+    Rolling mean and variance over window values with Welford's algorithm, as
+    pd.Series.rolling(window).mean() and .var(ddof=ddof) on the values that are not NaN
+
+    === Representation Invariants ===
+    values holds the last min(count, window) values, the oldest at head once full
+    m2 is the sum of squared deviations from mean of values
+    """
+    outputs = ('mean', 'var')
+    window: int
+    ddof: int
+    values: List[float]
+    head: int
+    count: int
+    mean: float
+    m2: float
+
+    def __init__(self, window: int, ddof: int = 1):
+        if window < 1:
+            raise ValueError("Window Must Be Positive")
+        self.window = window
+        self.ddof = ddof
+        self.values = []
+        self.head = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def lookback(self) -> int:
+        return self.window - 1
+
+    def _step(self, values: np.ndarray) -> np.ndarray:
+        window = self.window
+        ddof = self.ddof
+        buf = self.values
+        head, count, mean, m2 = self.head, self.count, self.mean, self.m2
+        means = []
+        variances = []
+        for x in values.tolist():
+            if x != x:
+                means.append(NAN)
+                variances.append(NAN)
+                continue
+            if count < window:
+                buf.append(x)
+                count += 1
+                delta = x - mean
+                mean += delta / count
+                m2 += delta * (x - mean)
+            else:
+                # Replaces the oldest value y by x in one step
+                y = buf[head]
+                buf[head] = x
+                head = head + 1 if head + 1 < window else 0
+                delta = x - y
+                old = mean
+                mean += delta / count
+                m2 += delta * (x - mean + y - old)
+                if m2 < 0:
+                    m2 = 0.0
+            if count == window:
+                means.append(mean)
+                variances.append(m2 / (count - ddof) if count > ddof else NAN)
+            else:
+                means.append(NAN)
+                variances.append(NAN)
+        self.head, self.count, self.mean, self.m2 = head, count, mean, m2
+        return np.array([means, variances], dtype=float).reshape(2, -1).T
+
+    def _vector(self, values: np.ndarray) -> np.ndarray:
+        previous = self.values[self.head:] + self.values[:self.head]
+        series = pd.Series(np.concatenate([previous, values]))
+        rolling = series.rolling(self.window)
+        means = rolling.mean().to_numpy()[len(previous):]
+        variances = rolling.var(ddof=self.ddof).to_numpy()[len(previous):]
+        last = series.to_numpy()[-self.window:]
+        self.values = last.tolist()
+        self.head = 0
+        self.count = len(last)
+        self.mean = float(last.mean())
+        self.m2 = float(((last - self.mean) ** 2).sum())
+        return np.array([means, variances]).T
+
+
+class BollingerBands(RollingMoments):
+    """
+    Rolling mean over window values with bands k standard deviations above and below it
+    """
+    outputs = ('middle', 'upper', 'lower')
+    k: float
+
+    def __init__(self, window: int = 20, k: float = 2.0, ddof: int = 0):
+        RollingMoments.__init__(self, window, ddof)
+        self.k = k
+
+    def _step(self, values: np.ndarray) -> np.ndarray:
+        return self._bands(RollingMoments._step(self, values))
+
+    def _vector(self, values: np.ndarray) -> np.ndarray:
+        return self._bands(RollingMoments._vector(self, values))
+
+    def _bands(self, moments: np.ndarray) -> np.ndarray:
+        mean, var = moments.T
+        width = self.k * np.sqrt(var)
+        return np.array([mean, mean + width, mean - width]).T
+
+
+class RollingExtreme(Kernel):
+    """
+    Rolling minimum or maximum over window values with a monotonic deque, as
+    pd.Series.rolling(window).min() or .max() on the values that are not NaN
+
+    === Representation Invariants ===
+    extremes holds (position, value) of the values of the window that no later
+    value of the window dominates, in order of position
+    """
+    outputs = ('extreme',)
+    window: int
+    maximum: bool
+    extremes: Deque[Tuple[int, float]]
+    count: int
+
+    def __init__(self, window: int, maximum: bool):
+        if window < 1:
+            raise ValueError("Window Must Be Positive")
+        self.window = window
+        self.maximum = maximum
+        self.extremes = deque()
+        self.count = 0
+
+    @property
+    def lookback(self) -> int:
+        return self.window - 1
+
+    def _step(self, values: np.ndarray) -> np.ndarray:
+        window = self.window
+        maximum = self.maximum
+        extremes = self.extremes
+        count = self.count
+        res = []
+        append = res.append
+        for x in values.tolist():
+            if x != x:
+                append(NAN)
+                continue
+            if maximum:
+                while extremes and extremes[-1][1] <= x:
+                    extremes.pop()
+            else:
+                while extremes and extremes[-1][1] >= x:
+                    extremes.pop()
+            extremes.append((count, x))
+            if extremes[0][0] <= count - window:
+                extremes.popleft()
+            count += 1
+            append(extremes[0][1] if count >= window else NAN)
+        self.count = count
+        return np.array(res, dtype=float).reshape(-1, 1)
+
+    def _vector(self, values: np.ndarray) -> np.ndarray:
+        window = self.window
+        count = self.count
+        never = -np.inf if self.maximum else np.inf
+        # The earlier values of the window. A value dominated by a later one is
+        # replaced by the next extreme, which every window over the new values
+        # also holds, as pandas counts infinite values as missing.
+        known = min(count, window - 1)
+        previous = np.full(known, NAN)
+        for position, value in self.extremes:
+            if position >= count - known:
+                previous[position - count + known] = value
+        previous = pd.Series(previous).bfill().to_numpy()
+        series = pd.Series(np.concatenate([previous, values]))
+        rolling = series.rolling(window)
+        res = (rolling.max() if self.maximum else rolling.min()).to_numpy()[known:]
+        # Values of the last window not dominated by a later one
+        last = series.to_numpy()[-window:]
+        if self.maximum:
+            later = np.append(np.maximum.accumulate(last[::-1])[::-1][1:], never)
+            kept = last > later
+        else:
+            later = np.append(np.minimum.accumulate(last[::-1])[::-1][1:], never)
+            kept = last < later
+        self.count = count + len(values)
+        first = self.count - len(last)
+        self.extremes = deque((first + int(i), float(last[i])) for i in np.flatnonzero(kept))
+        return res.reshape(-1, 1)
+
+
+class RollingMin(RollingExtreme):
+    outputs = ('min',)
+
+    def __init__(self, window: int):
+        RollingExtreme.__init__(self, window, False)
+
+
+class RollingMax(RollingExtreme):
+    outputs = ('max',)
+
+    def __init__(self, window: int):
+        RollingExtreme.__init__(self, window, True)
+
+
+class RSI(Kernel):
+    """
+    Relative strength index with Wilder's smoothing. The averages of the first
+    period changes are simple means. Undefined for the first period values.
+    """
+    outputs = ('rsi',)
+    lookback = None
+    period: int
+    previous: float
+    count: int
+    gain: float
+    loss: float
+
+    def __init__(self, period: int = 14):
+        if period < 1:
+            raise ValueError("Period Must Be Positive")
+        self.period = period
+        self.previous = NAN
+        self.count = 0
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def _step(self, values: np.ndarray) -> np.ndarray:
+        period = self.period
+        previous, count, gain, loss = self.previous, self.count, self.gain, self.loss
+        res = []
+        append = res.append
+        for x in values.tolist():
+            if x != x:
+                append(NAN)
+                continue
+            if previous != previous:
+                previous = x
+                append(NAN)
+                continue
+            change = x - previous
+            previous = x
+            up = change if change > 0 else 0.0
+            down = -change if change < 0 else 0.0
+            count += 1
+            if count < period:
+                gain += up
+                loss += down
+                append(NAN)
+                continue
+            if count == period:
+                gain = (gain + up) / period
+                loss = (loss + down) / period
+            else:
+                gain = (gain * (period - 1) + up) / period
+                loss = (loss * (period - 1) + down) / period
+            append(100 * gain / (gain + loss) if gain + loss > 0 else 50.0)
+        self.previous, self.count, self.gain, self.loss = previous, count, gain, loss
+        return np.array(res, dtype=float).reshape(-1, 1)
+
+    def _vector(self, values: np.ndarray) -> np.ndarray:
+        # The first value ever has no change
+        lead = int(self.previous != self.previous)
+        changes = np.diff(values) if lead else np.diff(values, prepend=self.previous)
+        gains, count, self.gain = _wilder(np.where(changes > 0, changes, 0.0), self.period, self.count, self.gain)
+        losses, self.count, self.loss = _wilder(np.where(changes < 0, -changes, 0.0), self.period, self.count, self.loss)
+        self.previous = float(values[-1])
+        total = gains + losses
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsi = np.where(np.isnan(total), NAN, np.where(total > 0, 100 * gains / total, 50.0))
+        return np.concatenate([np.full(lead, NAN), rsi]).reshape(-1, 1)
+
+
+class ATR(Kernel):
+    """
+    Average true range of high, low and close with Wilder's smoothing. The first
+    average is the simple mean of the first period true ranges.
+    """
+    outputs = ('atr',)
+    lookback = None
+    period: int
+    previous: float
+    count: int
+    average: float
+
+    def __init__(self, period: int = 14):
+        if period < 1:
+            raise ValueError("Period Must Be Positive")
+        self.period = period
+        self.previous = NAN
+        self.count = 0
+        self.average = 0.0
+
+    def _step(self, high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+        period = self.period
+        previous, count, average = self.previous, self.count, self.average
+        res = []
+        append = res.append
+        for h, l, c in zip(high.tolist(), low.tolist(), close.tolist()):
+            if h != h or l != l or c != c:
+                append(NAN)
+                continue
+            tr = h - l if previous != previous else max(h - l, abs(h - previous), abs(l - previous))
+            previous = c
+            count += 1
+            if count < period:
+                average += tr
+                append(NAN)
+                continue
+            average = (average + tr) / period if count == period else (average * (period - 1) + tr) / period
+            append(average)
+        self.previous, self.count, self.average = previous, count, average
+        return np.array(res, dtype=float).reshape(-1, 1)
+
+    def _vector(self, high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+        previous = np.concatenate([[self.previous], close[:-1]])
+        # fmax ignores the unknown close before the first value
+        tr = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        res, self.count, self.average = _wilder(tr, self.period, self.count, self.average)
+        self.previous = float(close[-1])
+        return res.reshape(-1, 1)
+
+
+class VWAP(Kernel):
+    """
+    Volume weighted average of the typical price (high + low + close) / 3, over
+    all values, or over the last window values if window is set
+    """
+    outputs = ('vwap',)
+    window: Optional[int]
+    values: List[Tuple[float, float]]
+    head: int
+    price_volume: float
+    volume: float
+
+    def __init__(self, window: int = None):
+        if window is not None and window < 1:
+            raise ValueError("Window Must Be Positive")
+        self.window = window
+        self.values = []
+        self.head = 0
+        self.price_volume = 0.0
+        self.volume = 0.0
+
+    @property
+    def lookback(self) -> Optional[int]:
+        return None if self.window is None else self.window - 1
+
+    def _step(self, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+        window = self.window
+        buf = self.values
+        head, price_volume, total = self.head, self.price_volume, self.volume
+        res = []
+        append = res.append
+        for h, l, c, v in zip(high.tolist(), low.tolist(), close.tolist(), volume.tolist()):
+            if h != h or l != l or c != c or v != v:
+                append(NAN)
+                continue
+            pv = (h + l + c) / 3 * v
+            price_volume += pv
+            total += v
+            if window is not None:
+                if len(buf) < window:
+                    buf.append((pv, v))
+                else:
+                    old_pv, old_v = buf[head]
+                    buf[head] = (pv, v)
+                    head = head + 1 if head + 1 < window else 0
+                    price_volume -= old_pv
+                    total -= old_v
+                if len(buf) < window:
+                    append(NAN)
+                    continue
+            append(price_volume / total if total > 0 else NAN)
+        self.head, self.price_volume, self.volume = head, price_volume, total
+        return np.array(res, dtype=float).reshape(-1, 1)
+
+    def _vector(self, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+        window = self.window
+        pv = (high + low + close) / 3 * volume
+        if window is None:
+            price_volume = self.price_volume + np.cumsum(pv)
+            total = self.volume + np.cumsum(volume)
+            self.price_volume, self.volume = float(price_volume[-1]), float(total[-1])
+        else:
+            previous = self.values[self.head:] + self.values[:self.head]
+            pvs = np.concatenate([[entry[0] for entry in previous], pv])
+            volumes = np.concatenate([[entry[1] for entry in previous], volume])
+            price_volume = pd.Series(pvs).rolling(window).sum().to_numpy()[len(previous):]
+            total = pd.Series(volumes).rolling(window).sum().to_numpy()[len(previous):]
+            self.values = list(zip(pvs[-window:].tolist(), volumes[-window:].tolist()))
+            self.head = 0
+            self.price_volume, self.volume = float(pvs[-window:].sum()), float(volumes[-window:].sum())
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, price_volume / total, NAN).reshape(-1, 1)
+
+
+def _wilder(values: np.ndarray, period: int, count: int, average: float) -> Tuple[np.ndarray, int, float]:
+    """
+    Returns Wilder's average over period of values following count earlier ones,
+    NaN until period are known, then the count and average after values. While
+    fewer than period values are known, average is their sum, and the first
+    average is their simple mean.
+    """
+    res = np.full(len(values), NAN)
+    if not len(values):
+        return res, count, average
+    # Position in values of the value completing the first period
+    first = period - count - 1
+    if first >= len(values):
+        return res, count + len(values), average + float(values.sum())
+    if first >= 0:
+        seed = (average + float(values[:first + 1].sum())) / period
+        res[first] = seed
+        rest = values[first + 1:]
+    else:
+        seed = average
+        rest = values
+    if len(rest):
+        res[len(values) - len(rest):] = pd.Series(np.concatenate([[seed], rest])) \
+            .ewm(alpha=1 / period, adjust=False).mean().to_numpy()[1:]
+    return res, count + len(values), float(res[-1])
+
+
+if __name__ == '__main__':
+    series = pd.Series(np.random.default_rng(0).standard_normal(1000).cumsum() + 100)
+    print(np.allclose(EMA(10).run(series.to_numpy())[:, 0], series.ewm(span=10, adjust=False).mean(), equal_nan=True))
+    print(np.allclose(RollingMoments(20).run(series.to_numpy())[:, 1], series.rolling(20).var(), equal_nan=True))
+    print(np.allclose(RollingMax(20).run(series.to_numpy())[:, 0], series.rolling(20).max(), equal_nan=True))
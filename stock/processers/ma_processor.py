@@ -1,6 +1,8 @@
 from stock.processers.processor_base import BufferedProcessorBase
+import numpy as np
 import pandas as pd
-from typing import Union, List, Any, Dict, Optional
+from typing import Union, List, Any, Dict, Optional, Tuple
+import inspect
 from stock.data.database import RwDatabase
 
 
@@ -36,7 +38,49 @@ class MovingAverageProcessor(BufferedProcessorBase):
         :return:
         A pandas DataFrame containing the result
         """
-        return data[self.column].rolling(self.days, *self.args, **self.kwargs).mean().to_frame().rename(columns={"Close": f"ma{self.days}_{self.column.lower()}"})
+        return data[self.column].rolling(self.days, *self.args, **self.kwargs).mean().to_frame(f"ma{self.days}_{self.column.lower()}")
+
+    def compute_panel(self, panel: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        Computes on every symbol of panel with one rolling mean per group of symbols
+        having data on the same dates. pandas averages every column of a frame on
+        its own, so the results equal those of compute exactly.
+        :return:
+        A dictionary mapping symbols to their results
+        """
+        symbols = panel[self.column].columns
+        present = np.zeros((len(panel), len(symbols)), dtype=bool)
+        for field in panel.columns.unique(level=0):
+            present |= panel[field].reindex(columns=symbols).notna().to_numpy()
+        dates, groups = np.unique(present.T, axis=0, return_inverse=True)
+        values = panel[self.column].reindex(columns=symbols)
+        name = f"ma{self.days}_{self.column.lower()}"
+        res = {}
+        for i, rows in enumerate(dates):
+            columns = np.flatnonzero(groups == i)
+            means = values.iloc[rows, columns].rolling(self.days, *self.args, **self.kwargs).mean()
+            for symbol in means.columns:
+                res[symbol] = means[symbol].to_frame(name)
+        return {symbol: res[symbol] for symbol in symbols}
+
+    @property
+    def lookback(self) -> Optional[int]:
+        """
+        Number of preceding rows every average depends on, or None for the windows
+        it does not model: time based, centered, weighted and stepped ones
+        """
+        try:
+            params = inspect.signature(pd.Series.rolling).bind(None, self.days, *self.args, **self.kwargs).arguments
+        except TypeError:
+            return None
+        if not isinstance(self.days, int) or params.get('center') or params.get('win_type') is not None \
+                or params.get('step') not in (None, 1):
+            return None
+        closed = params.get('closed')
+        if closed in (None, 'right', 'neither'):
+            return self.days - 1
+        if closed in ('left', 'both'):
+            return self.days
 
     def _read(self, db: RwDatabase, tblname: str) -> Optional[pd.DataFrame]:
         """
@@ -59,6 +103,83 @@ class MovingAverageProcessor(BufferedProcessorBase):
         """
         db.write_columns(tblname, data)
 
+    def _write_many(self, db: RwDatabase, data: Dict[str, pd.DataFrame]) -> None:
+        """
+        Write data, a dictionary mapping table names to data frames, into db
+        with one staged load
+
+        Precondition:
+        every table in data exists in db
+        """
+        db.write_columns_multi(data)
+
+
+class CumulativeSums:
+    """
+    Cumulative sums of the values of every column of a dates x columns array over
+    the rows where present, from which the trailing means of any window are
+    differences. NaN values at present rows count as rows but not as values.
+    Sums are taken relative to the first value of each column, which loses less
+    precision.
+
+    === Representation Invariants ===
+    present is the transpose of the present rows, a row per column
+    sums and counts hold the sums and numbers of values that are not NaN at the
+    present rows of the first column, then of the second, ...
+    starts holds the position in sums of the first present row of the column of each entry
+    offsets holds the value the sums of each entry are relative to
+    """
+    shape: Tuple[int, int]
+    present: np.ndarray
+    sums: np.ndarray
+    counts: np.ndarray
+    starts: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(self, values: np.ndarray, present: np.ndarray):
+        # One row per column, so every pass below runs over contiguous memory
+        values = np.ascontiguousarray(values.T)
+        self.present = np.ascontiguousarray(present.T)
+        self.shape = values.shape
+        finite = self.present & ~np.isnan(values)
+        offset = np.nan_to_num(values[np.arange(len(values)), self.present.argmax(axis=1)])[:, None]
+        self.sums = np.cumsum(np.where(finite, values - offset, 0), axis=1)[self.present]
+        self.counts = np.cumsum(finite, axis=1)[self.present]
+        lengths = self.present.sum(axis=1)
+        self.starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        self.offsets = np.repeat(offset[:, 0], lengths)
+
+    def mean(self, window: int, min_periods: int = None) -> np.ndarray:
+        """
+        Returns the mean of the values among the last window present rows up to
+        every present row, in the order of sums. Equals pd.Series.rolling(window,
+        min_periods).mean() on the present rows of each column up to rounding.
+        :param min_periods:
+        Number of values needed for a mean. Defaults to window
+        """
+        min_periods = window if min_periods is None else min_periods
+        low = np.arange(len(self.sums)) - window
+        inside = low >= self.starts
+        total = self.sums - np.where(inside, self.sums[np.maximum(low, 0)], 0)
+        count = self.counts - np.where(inside, self.counts[np.maximum(low, 0)], 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count >= max(min_periods, 1), total / count + self.offsets, np.nan)
+
+    def split(self, values: np.ndarray) -> List[np.ndarray]:
+        """
+        Returns values, in the order of sums, split into the values of every column
+        """
+        return np.split(values, np.cumsum(self.present.sum(axis=1))[:-1])
+
+    def expand(self, values: np.ndarray, fill: float) -> np.ndarray:
+        """
+        Returns values, in the order of sums, as a dates x columns array with fill
+        where a column has no present row
+        """
+        res = np.full(self.shape, fill)
+        res[self.present] = values
+        return res.T
+
 
 if __name__ == '__main__':
     print(MovingAverageProcessor(5, 'Close').get_data('nyse', 'A'))
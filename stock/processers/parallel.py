@@ -0,0 +1,171 @@
+from __future__ import annotations
+from stock.data import data_manager
+from stock.data.date_index import normalize, slice_dates
+from stock.data.frame_transport import SharedFrames
+from stock.processers.processor_base import ProcessorBase, BufferedProcessorBase
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Union
+import multiprocessing
+import pandas as pd
+import os
+
+
+class ParallelExecutor:
+    """
+    Computes processors over many symbols with a pool of worker processes.
+
+    Symbols are sharded into chunks of chunk_size. The stock data of every chunk is
+    handed to a worker in one shared memory block, and results come back the same
+    way, so price data is never pickled. Workers only run compute; results are merged
+    into the cache of the processor and, for buffered processors, stored by its
+    write-behind thread. Results are exactly those of the serial path. Symbols whose
+    result is in the result cache of the processor are not sent to the workers.
+
+    Processors are sent to workers by their constructor arguments (see
+    ProcessorBase.__reduce__), so their classes must be importable.
+    """
+    workers: int
+    chunk_size: int
+    start_method: Optional[str]
+    _pool: Optional[ProcessPoolExecutor]
+
+    def __init__(self, workers: int = None, chunk_size: int = 32, start_method: str = None):
+        """
+        Creates an executor. The pool is started on first use.
+        :param workers:
+        Number of worker processes. Defaults to the number of CPUs
+        :param chunk_size:
+        Number of symbols sent to a worker at once. Default: 32
+        :param start_method:
+        multiprocessing start method of the workers. Defaults to the platform default
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk Size Must Be Positive")
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.start_method = start_method
+        self._pool = None
+
+    def get_data_multi(self, processor: ProcessorBase, symbols: Dict[str, Iterable[str]], start_date: str = '0000-00-00',
+                       end_date: str = '9999-99-99') -> Dict[str, Dict[str, pd.DataFrame]]:
+        """
+        Get the computed data of symbols like processor.get_data_multi, computing the
+        symbols without a result in the worker processes
+        :param symbols:
+        A dictionary mapping exchanges to lists of symbols from that exchange
+        :return:
+        A dictionary mapping exchange to data frames
+        """
+        res = {}
+        for exchange, symbol_list in symbols.items():
+            symbol_list = list(symbol_list)
+            missing = [symbol for symbol in symbol_list if not processor._have_result(exchange + '/' + symbol)]
+            stock = {symbol: data_manager.get_frame(exchange, symbol) for symbol in missing}
+            computed = {}
+            keys = {}
+            if processor.result_cache is not None:
+                for symbol, df in stock.items():
+                    keys[symbol] = processor.result_cache.key(processor, df)
+                    df = processor.result_cache.get(keys[symbol])
+                    if df is not None:
+                        computed[symbol] = df
+            for symbol, df in self.compute(processor, {symbol: df for symbol, df in stock.items()
+                                                       if symbol not in computed}).items():
+                computed[symbol] = normalize(df)
+                if symbol in keys:
+                    processor.result_cache.put(keys[symbol], computed[symbol])
+            for symbol, df in computed.items():
+                processor._store_result(exchange + '/' + symbol, df, stock[symbol])
+            res[exchange] = {symbol: slice_dates(computed[symbol], start_date, end_date) if symbol in computed
+                             else processor.get_data(exchange, symbol, start_date, end_date) for symbol in symbol_list}
+        return res
+
+    def compute(self, processor: ProcessorBase, data: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """
+        Runs processor.compute on every frame of data in the worker processes
+        :param data:
+        A dictionary mapping keys to stock data
+        :return:
+        A dictionary mapping the same keys to the results
+        """
+        keys = list(data)
+        chunks = [keys[i:i + self.chunk_size] for i in range(0, len(keys), self.chunk_size)]
+        if not chunks:
+            return {}
+        pool = self._get_pool()
+        shared = []
+        res = {}
+        try:
+            futures = []
+            for chunk in chunks:
+                frames = SharedFrames({key: data[key] for key in chunk})
+                shared.append(frames)
+                futures.append(pool.submit(_compute_chunk, processor, frames))
+            for future in futures:
+                res.update(_receive(future.result()))
+        finally:
+            for frames in shared:
+                frames.unlink()
+        return {key: res[key] for key in keys}
+
+    def close(self) -> None:
+        """
+        Shuts the worker processes down
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            context = multiprocessing.get_context(self.start_method) if self.start_method else None
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker)
+        return self._pool
+
+    def __enter__(self) -> ParallelExecutor:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _init_worker() -> None:
+    # Workers only compute, so buffered processors created in them never write
+    BufferedProcessorBase.write_behind = False
+
+
+def _compute_chunk(processor: ProcessorBase, frames: SharedFrames) -> Union[SharedFrames, Dict[str, pd.DataFrame]]:
+    """
+    Computes on every frame of frames in a worker
+    :return:
+    The results in a new shared memory block owned by the caller, or as a dictionary
+    if they do not fit one
+    """
+    with frames.attach() as data:
+        res = {key: processor.compute(df) for key, df in data.items()}
+        try:
+            return SharedFrames(res)
+        except ValueError:
+            return {key: _detach(df) for key, df in res.items()}
+
+
+def _detach(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a copy of df sharing no memory with it, index included
+    """
+    res = df.copy(deep=True)
+    res.index = df.index.copy(deep=True)
+    return res
+
+
+def _receive(res: Union[SharedFrames, Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """
+    Copies results out of their shared memory block and frees it
+    """
+    if not isinstance(res, SharedFrames):
+        return res
+    try:
+        with res.attach() as frames:
+            return {key: _detach(df) for key, df in frames.items()}
+    finally:
+        res.unlink()
@@ -2,12 +2,20 @@ from __future__ import annotations
 from stock.data import data_manager
 from abc import ABC, abstractmethod
 from collections.abc import Hashable
-from typing import Dict, Iterable, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from stock.data.database import RwDatabase
+from stock.data.cache import CacheView
+from stock.data.date_index import normalize, slice_dates, locate
+from stock.processers.result_cache import ResultCache, fingerprint
 from sqlite3 import Cursor
 import pandas as pd
+import threading
+import weakref
 import atexit
 
+# Fingerprints of the stock data frames of data_manager, by their ids
+_fingerprints: Dict[int, Tuple[weakref.ref, str]] = {}
+
 
 class ProcessorBase(ABC):
     """
@@ -15,15 +23,40 @@ class ProcessorBase(ABC):
     for __init__ will refer to the same object.
 
     Initializing Code in __init__ should only be ran if initialized == False
+
+    Computed data is kept in the memory bounded cache shared with data_manager
+
+    Processors whose rows only depend on a bounded number of preceding input rows
+    should set lookback to that number. Results are then extended with the bars
+    added since they were computed by computing only the new rows. Otherwise the
+    whole history is recomputed once new bars arrive.
+
+    Results are only extended while the stock data they were computed on is
+    unchanged, which is checked with a fingerprint of its rows. Results of changed
+    stock data, such as corrected prices, are recomputed.
+
+    If result_cache is set, results computed from a whole history are stored in it
+    and reused by any process computing the same processor on the same history.
+    Subclasses should increase version whenever compute changes its results.
+
+    === Representation Invariants ===
+    _inputs maps tables to the number of rows and the fingerprint of the stock data
+    their result was computed on
     """
     objs: Dict[tuple, ProcessorBase] = None
-    data: Dict[str, pd.DataFrame]
+    data: CacheView
     initialized: bool
+    _inputs: Dict[str, Tuple[int, str]]
+    _args: Tuple[tuple, Dict[str, Any]]
+    lookback: Optional[int] = None
+    result_cache: Optional[ResultCache] = None
+    version: int = 0
 
     def __init__(self):
         if not self.initialized:
             self.initialized = True
-            self.data = {}
+            self.data = data_manager.data.view(self)
+            self._inputs = {}
             cls = self.__class__
             if not hasattr(cls, 'registered_cleanup') or not cls.registered_cleanup:
                 cls.registered_cleanup = True
@@ -38,27 +71,113 @@ class ProcessorBase(ABC):
         A pandas DataFrame containing the data
         """
         tblname = exchange + '/' + symbol
-        if tblname not in self.data:
-            self.data[tblname] = self.compute(data_manager.get_data(exchange, symbol))
-        df = self.data[tblname]
-        return df[(start_date <= df.index) & (df.index <= end_date)]
+        stock = data_manager.get_frame(exchange, symbol)
+        df = self.data.get(tblname)
+        if df is not None and self._input_changed(tblname, stock):
+            self._reset(tblname)
+            df = None
+        res = self._compute_full(stock) if df is None else self._extend(tblname, stock, df)
+        if res is not df:
+            self.data[tblname] = res
+            self._inputs[tblname] = _input(stock)
+        return slice_dates(res, start_date, end_date)
 
     def get_data_multi(self, symbols: Dict[str, Iterable[str]], start_date: str = '0000-00-00',
-                       end_date: str = '9999-99-99') -> Dict[str, Dict[str, pd.DataFrame]]:
+                       end_date: str = '9999-99-99', batch: bool = False, executor: Any = None) -> Dict[str, Dict[str, pd.DataFrame]]:
         """
         Get the computed data of symbols. Stock data is directly obtained from data_manager
         :param symbols:
         A dictionary mapping exchanges to lists of symbols from that exchange
         :param start_date: Start of data
         :param end_date: End of data
+        :param batch:
+        Whether or not to read the symbols without a result as one panel and compute
+        them with compute_panel. Default: False
+        :param executor:
+        A ParallelExecutor computing the symbols without a result in worker processes.
+        Ignored if batch. Default: None
         :return:
         A dictionary mapping exchange to data frames
         """
+        if executor is not None and not batch:
+            return executor.get_data_multi(self, symbols, start_date, end_date)
         res = {}
         for exchange, symbol_list in symbols.items():
-            res[exchange] = {symbol: self.get_data(exchange, symbol, start_date, end_date) for symbol in symbol_list}
+            symbol_list = list(symbol_list)
+            computed = self._compute_batch(exchange, symbol_list) if batch else {}
+            res[exchange] = {symbol: slice_dates(computed[symbol], start_date, end_date) if symbol in computed
+                             else self.get_data(exchange, symbol, start_date, end_date) for symbol in symbol_list}
         return res
 
+    def compute_panel(self, panel: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        Computes on every symbol of panel, a data frame with (field, symbol) columns
+        as returned by data_manager.get_panel. Every symbol is computed on the dates
+        it has data on, so the results equal those of compute.
+        Can be overwritten with an implementation computing all symbols at once.
+        :return:
+        A dictionary mapping symbols to their results
+        """
+        return {symbol: self.compute(panel.xs(symbol, axis=1, level=1).dropna(how='all'))
+                for symbol in panel.columns.unique(level=1)}
+
+    def _compute_batch(self, exchange: str, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Computes the symbols of exchange without a result with compute_panel and stores their results
+        :return:
+        A dictionary mapping the symbols computed to their results
+        """
+        missing = [symbol for symbol in symbols if not self._have_result(exchange + '/' + symbol)]
+        if not missing:
+            return {}
+        computed = {}
+        keys = {}
+        if self.result_cache is not None:
+            for symbol in missing:
+                keys[symbol] = self.result_cache.key(self, data_manager.get_frame(exchange, symbol))
+                df = self.result_cache.get(keys[symbol])
+                if df is not None:
+                    computed[symbol] = df
+            missing = [symbol for symbol in missing if symbol not in computed]
+        if missing:
+            for symbol, df in self.compute_panel(data_manager.get_panel(exchange, missing)).items():
+                computed[symbol] = normalize(df)
+                if symbol in keys:
+                    self.result_cache.put(keys[symbol], computed[symbol])
+        for symbol, df in computed.items():
+            self._store_result(exchange + '/' + symbol, df, data_manager.get_frame(exchange, symbol))
+        return computed
+
+    def _have_result(self, tblname: str) -> bool:
+        """
+        Returns whether a result of tblname is available without computing it
+        """
+        return tblname in self.data
+
+    def _store_result(self, tblname: str, data: pd.DataFrame, stock: pd.DataFrame) -> None:
+        """
+        Stores data, computed from stock, all stock data of tblname
+        """
+        self.data[tblname] = data
+        self._inputs[tblname] = _input(stock)
+
+    def _input_changed(self, tblname: str, data: pd.DataFrame) -> bool:
+        """
+        Returns whether the stock data the result of tblname was computed on is
+        unknown or no longer the first rows of data, the current stock data
+        """
+        entry = self._inputs.get(tblname)
+        if entry is None or entry[0] > len(data):
+            return True
+        return (_fingerprint(data) if entry[0] == len(data) else fingerprint(data.iloc[:entry[0]])) != entry[1]
+
+    def _reset(self, tblname: str) -> None:
+        """
+        Called before the result of tblname is recomputed because its stock data
+        changed. Can be overwritten to drop state kept by _extend.
+        """
+        pass
+
     @abstractmethod
     def compute(self, data: pd.DataFrame) -> pd.DataFrame:
         """
@@ -68,19 +187,75 @@ class ProcessorBase(ABC):
         """
         pass
 
+    def _compute_full(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes on data, all stock data of a symbol, reusing the result stored in
+        result_cache for the same data if there is one
+        """
+        if self.result_cache is None:
+            return normalize(self.compute(data))
+        key = self.result_cache.key(self, data)
+        res = self.result_cache.get(key)
+        if res is None:
+            res = normalize(self.compute(data))
+            self.result_cache.put(key, res)
+        return res
+
+    def extend(self, data: pd.DataFrame, result: pd.DataFrame) -> pd.DataFrame:
+        """
+        Extends result, computed on a prefix of data, with the rows of data after
+        its last date. Only the new rows and the lookback rows before them are
+        computed if lookback is set.
+
+        Precondition:
+        data and result are indexed by sorted DatetimeIndexes
+        :return:
+        result itself if data has no rows after it, otherwise a new data frame
+        """
+        if result.empty:
+            return self._compute_full(data) if len(data) else result
+        pos = locate(data.index, result.index[-1], upper=True)
+        if pos >= len(data):
+            return result
+        if self.lookback is None:
+            return self._compute_full(data)
+        first = max(0, pos - self.lookback)
+        new = normalize(self.compute(data.iloc[first:])).iloc[pos - first:]
+        return pd.concat([result, new])
+
+    def _extend(self, tblname: str, data: pd.DataFrame, result: pd.DataFrame) -> pd.DataFrame:
+        """
+        Extends result, the result of tblname, like extend. Can be overwritten to
+        keep state between extensions of the same table.
+        """
+        return self.extend(data, result)
+
     def __new__(cls, *args, **kwargs) -> ProcessorBase:
         """
-        If an object with the same hashable args have not been created before, it is created. Otherwise
-        the same object is returned.
+        If an object with the same hashable args and kwargs have not been created before, it is created.
+        Otherwise the same object is returned.
         """
-        hashable_args = tuple(map(lambda x: x if isinstance(x, Hashable) else None, args))
+        hashable_args = (tuple(map(lambda x: x if isinstance(x, Hashable) else None, args)),
+                         tuple(sorted((k, v if isinstance(v, Hashable) else None) for k, v in kwargs.items())))
         if cls.objs is None:
             cls.objs = {}
         if hashable_args not in cls.objs:
             cls.objs[hashable_args] = object.__new__(cls)
             cls.objs[hashable_args].initialized = False
+            cls.objs[hashable_args]._args = (args, kwargs)
         return cls.objs[hashable_args]
 
+    def __repr__(self) -> str:
+        args, kwargs = self._args
+        return f"{self.__class__.__name__}({', '.join([repr(arg) for arg in args] + [f'{k}={v!r}' for k, v in kwargs.items()])})"
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickles the processor as the arguments it was created with, so unpickling
+        it in another process creates or returns the processor with the same parameters
+        """
+        return _new_processor, (self.__class__,) + self._args
+
     @classmethod
     def _clean_up(cls) -> None:
         """
@@ -89,12 +264,62 @@ class ProcessorBase(ABC):
         pass
 
 
+def _new_processor(cls: type, args: tuple, kwargs: Dict[str, Any]) -> ProcessorBase:
+    return cls(*args, **kwargs)
+
+
+def _input(data: pd.DataFrame) -> Tuple[int, str]:
+    """
+    Returns the number of rows and the fingerprint of data, the stock data a result is computed on
+    """
+    return len(data), _fingerprint(data)
+
+
+def _fingerprint(data: pd.DataFrame) -> str:
+    """
+    Returns the fingerprint of data, a frame returned by data_manager.get_frame,
+    computing it once per frame
+    """
+    key = id(data)
+    entry = _fingerprints.get(key)
+    if entry is not None and entry[0]() is data:
+        return entry[1]
+    digest = fingerprint(data)
+    _fingerprints[key] = (weakref.ref(data, lambda ref: _fingerprints.pop(key, None)), digest)
+    return digest
+
+
 class BufferedProcessorBase(ProcessorBase, ABC):
     """
-    Variant of Processor Base that will store data to file on program exit to
-    avoid recomputation
+    Variant of Processor Base that stores computed data in a database to avoid
+    recomputation
+
+    Only dirty tables, those with rows computed since they were last stored, are
+    written. _dirty maps every dirty table to the last date already stored, or None
+    if nothing is, to the data to store, to the rows and fingerprint of the stock
+    data it was computed on and to the number of times it was recomputed while
+    dirty. Dirty data therefore stays in memory after it is evicted from the cache
+    until it is stored. Fingerprints are stored in the INPUTS table with the data.
+
+    If write_behind, a background thread with its own connection writes all dirty
+    tables in one transaction every flush_interval seconds, or as soon as an object
+    has flush_threshold dirty tables. flush writes them right away. Whatever is left
+    is written on program exit.
     """
+    INPUTS: str = '_inputs'
     database: RwDatabase = None
+    write_behind: bool = True
+    flush_interval: float = 30.0
+    flush_threshold: int = 64
+    _db_args: Tuple[str, str]
+    _flusher: Optional[threading.Thread] = None
+    _flush_cond: threading.Condition
+    _flush_requested: int
+    _flush_completed: int
+    _flush_stopping: bool
+    _flush_error: Optional[BaseException]
+    _dirty: Dict[str, Tuple[Optional[pd.Timestamp], pd.DataFrame, Tuple[int, str], int]]
+    _lock: threading.Lock
 
     def __init__(self, db_path: str = 'comdata/', db_name: str = None):
         """
@@ -110,23 +335,81 @@ class BufferedProcessorBase(ProcessorBase, ABC):
                 db_name = self.__class__.__name__ + '.db'
             cls = self.__class__
             cls.database = RwDatabase(db_path, db_name)
+            cls._db_args = (db_path, db_name)
+            self._dirty = {}
+            self._lock = threading.Lock()
+            if cls.write_behind and cls.__dict__.get('_flusher') is None:
+                cls._start_flusher()
 
     def get_data(self, exchange: str, symbol: str, start_date: str = '0000-00-00', end_date: str = '9999-99-99') -> pd.DataFrame:
         """
         Get the computed data of symbol at exchange. Stock data is directly obtained from data_manager
+        Stored results are extended with the bars added since they were stored.
         :param start_date: Start of data
         :param end_date: End of data
         :return:
         A pandas DataFrame containing the data
         """
         tblname = exchange + '/' + symbol
-        if tblname not in self.data:
-            if self.database.have_table(tblname):
-                self.data[tblname] = self._read(self.database, tblname)
-            if tblname not in self.data or self.data[tblname] is None:
-                self.data[tblname] = self.compute(data_manager.get_data(exchange, symbol))
-        df = self.data[tblname]
-        return df[(start_date <= df.index) & (df.index <= end_date)]
+        stock = data_manager.get_frame(exchange, symbol)
+        df = self.data.get(tblname)
+        cached = df is not None
+        if df is None:
+            df = self._load(tblname)
+        if df is None or self._input_changed(tblname, stock):
+            if df is not None:
+                self._reset(tblname)
+            res = self._compute_full(stock)
+            self._mark_dirty(tblname, None, res, _input(stock), replace=True)
+        else:
+            res = self._extend(tblname, stock, df)
+            if res is not df:
+                self._mark_dirty(tblname, df.index[-1] if len(df) else None, res, _input(stock))
+        if not cached or res is not df:
+            self.data[tblname] = res
+        return slice_dates(res, start_date, end_date)
+
+    def _load(self, tblname: str) -> Optional[pd.DataFrame]:
+        """
+        Returns the dirty or stored result of tblname, or None if there is none.
+        The rows and fingerprint of the stock data of a stored result are read
+        into _inputs.
+        """
+        with self._lock:
+            if tblname in self._dirty:
+                return self._dirty[tblname][1]
+        if not self.database.have_table(tblname):
+            return None
+        df = self._read(self.database, tblname)
+        if df is None:
+            return None
+        entry = self._read_input(self.database, tblname)
+        if entry is None:
+            self._inputs.pop(tblname, None)
+        else:
+            self._inputs[tblname] = entry
+        return normalize(df)
+
+    def _read_input(self, db: RwDatabase, tblname: str) -> Optional[Tuple[int, str]]:
+        """
+        Returns the rows and fingerprint of the stock data the stored result of
+        tblname was computed on, or None if they are not stored
+        """
+        if not db.have_table(self.INPUTS):
+            return None
+        db.cursor.execute(f'SELECT Rows, Fingerprint FROM "{self.INPUTS}" WHERE Tbl = ? AND Processor = ?;',
+                          (tblname, repr(self)))
+        row = db.cursor.fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def _write_inputs(self, db: RwDatabase, inputs: Dict[str, Tuple[int, str]]) -> None:
+        """
+        Writes the rows and fingerprints of the stock data of the tables of inputs into db
+        """
+        db.ensure_table(self.INPUTS, {'Tbl': 'TEXT', 'Processor': 'TEXT', 'Rows': 'INTEGER', 'Fingerprint': 'TEXT'},
+                        primary_key=('Tbl', 'Processor'))
+        db.cursor.executemany(f'INSERT OR REPLACE INTO "{self.INPUTS}" VALUES (?, ?, ?, ?);',
+                              ((tblname, repr(self), rows, digest) for tblname, (rows, digest) in inputs.items()))
 
     @abstractmethod
     def _read(self, db: RwDatabase, tblname: str) -> Optional[pd.DataFrame]:
@@ -148,23 +431,198 @@ class BufferedProcessorBase(ProcessorBase, ABC):
         """
         pass
 
-    def _write_all(self, db: RwDatabase) -> None:
+    def _write_many(self, db: RwDatabase, data: Dict[str, pd.DataFrame]) -> None:
+        """
+        Write data, a dictionary mapping table names to data frames, into db.
+        Can be overwritten to write all tables at once.
+
+        Precondition:
+        every table in data exists in db
+        """
+        for tblname, df in data.items():
+            self._write(db, tblname, df)
+
+    def _have_result(self, tblname: str) -> bool:
+        """
+        Returns whether a result of tblname is cached, dirty or stored. Stored results
+        are read into the cache.
+        """
+        if tblname in self.data:
+            return True
+        df = self._load(tblname)
+        if df is not None:
+            self.data[tblname] = df
+            return True
+        return False
+
+    def _store_result(self, tblname: str, data: pd.DataFrame, stock: pd.DataFrame) -> None:
+        """
+        Caches data, computed from stock, and marks it to be stored
+        """
+        self._mark_dirty(tblname, None, data, _input(stock), replace=True)
+        self.data[tblname] = data
+
+    def _mark_dirty(self, tblname: str, stored: Optional[pd.Timestamp], data: pd.DataFrame,
+                    stock: Tuple[int, str], replace: bool = False) -> None:
+        """
+        Records data, computed from stock data with the rows and fingerprint of stock,
+        as the result of tblname, whose rows up to stored are already stored. If
+        tblname is already dirty, its older stored date is kept unless replace.
+        :param replace:
+        Whether data was recomputed from all stock data and replaces every stored row. Default: False
+        """
+        with self._lock:
+            recomputed = 0
+            if tblname in self._dirty:
+                previous = self._dirty[tblname]
+                recomputed = previous[3] + replace
+                if not replace:
+                    stored = previous[0]
+            self._dirty[tblname] = (stored, data, stock, recomputed)
+            self._inputs[tblname] = stock
+            full = len(self._dirty) >= self.flush_threshold
+        if full:
+            self._request_flush()
+
+    def _take_dirty(self) -> Tuple[Dict[str, Tuple[Optional[pd.Timestamp], pd.DataFrame, Tuple[int, str], int]],
+                                   Dict[str, pd.DataFrame]]:
+        """
+        Returns a snapshot of _dirty and the rows of every dirty table that need to be stored
+        """
+        with self._lock:
+            snapshot = dict(self._dirty)
+        rows = {}
+        for tblname, (stored, df, stock, recomputed) in snapshot.items():
+            if stored is not None:
+                df = df.iloc[locate(df.index, stored, upper=True):]
+            if len(df):
+                rows[tblname] = df
+        return snapshot, rows
+
+    def _mark_clean(self, snapshot: Dict[str, Tuple[Optional[pd.Timestamp], pd.DataFrame, Tuple[int, str], int]]) -> None:
+        """
+        Marks the tables of snapshot, taken by _take_dirty, as stored. Tables that
+        were extended since stay dirty from the last date stored, and those that
+        were recomputed since stay dirty as a whole.
+        """
+        with self._lock:
+            for tblname, entry in snapshot.items():
+                current = self._dirty.get(tblname)
+                if current is entry:
+                    del self._dirty[tblname]
+                elif current is not None and current[3] == entry[3] and len(entry[1]):
+                    self._dirty[tblname] = (entry[1].index[-1],) + current[1:]
+
+    @classmethod
+    def flush(cls, timeout: float = None) -> None:
+        """
+        Stores the dirty tables of every object of this class and waits until they
+        are committed. Raises the first error of the background writes since the
+        last flush, if any failed.
+        :param timeout:
+        Seconds to wait for the background thread. Waits forever if unspecified
+        """
+        flusher = cls.__dict__.get('_flusher')
+        if flusher is None or not flusher.is_alive():
+            cls._write_dirty(cls.database)
+            return
+        with cls._flush_cond:
+            cls._flush_requested += 1
+            target = cls._flush_requested
+            cls._flush_cond.notify_all()
+            if not cls._flush_cond.wait_for(lambda: cls._flush_completed >= target or not flusher.is_alive(), timeout):
+                raise TimeoutError("Flush Timed Out")
+            error, cls._flush_error = cls._flush_error, None
+        if error is not None:
+            raise error
+
+    @classmethod
+    def _write_dirty(cls, db: RwDatabase) -> None:
+        """
+        Writes the dirty tables of every object of this class into db in one transaction
+        """
+        written = []
+        try:
+            for obj in list((cls.objs or {}).values()):
+                if not obj.initialized:
+                    continue
+                snapshot, rows = obj._take_dirty()
+                for tblname in rows:
+                    db.ensure_table(tblname, {'Date': 'TEXT'}, primary_key='Date')
+                if rows:
+                    obj._write_many(db, rows)
+                if snapshot:
+                    obj._write_inputs(db, {tblname: entry[2] for tblname, entry in snapshot.items()})
+                written.append((obj, snapshot))
+            db.commit()
+        except BaseException:
+            # Discards the partial transaction. Tables stay dirty
+            db.close(commit=False)
+            db.open()
+            raise
+        for obj, snapshot in written:
+            obj._mark_clean(snapshot)
+
+    @classmethod
+    def _start_flusher(cls) -> None:
+        cls._flush_cond = threading.Condition()
+        cls._flush_requested = 0
+        cls._flush_completed = 0
+        cls._flush_stopping = False
+        cls._flush_error = None
+        cls._flusher = threading.Thread(target=cls._run_flusher, name=f'{cls.__name__} write-behind', daemon=True)
+        cls._flusher.start()
+
+    @classmethod
+    def _request_flush(cls) -> None:
+        if cls.__dict__.get('_flusher') is not None:
+            with cls._flush_cond:
+                cls._flush_requested += 1
+                cls._flush_cond.notify_all()
+
+    @classmethod
+    def _run_flusher(cls) -> None:
         """
-        Write all data that need to be stored into db
+        Body of the write-behind thread
         """
-        for tblname, data in self.data.items():
-            db.ensure_table(tblname, {'Date': 'TEXT'})
-            self._write(db, tblname, data)
+        db = RwDatabase(*cls._db_args)
+        try:
+            while True:
+                with cls._flush_cond:
+                    cls._flush_cond.wait_for(lambda: cls._flush_requested > cls._flush_completed or cls._flush_stopping,
+                                             cls.flush_interval)
+                    target = cls._flush_requested
+                    stopping = cls._flush_stopping
+                error = None
+                try:
+                    cls._write_dirty(db)
+                except Exception as e:
+                    error = e
+                with cls._flush_cond:
+                    # The first error is kept until flush reports it, even if later cycles succeed
+                    if cls._flush_error is None:
+                        cls._flush_error = error
+                    cls._flush_completed = target
+                    cls._flush_cond.notify_all()
+                if stopping:
+                    return
+        finally:
+            db.close()
 
     @classmethod
     def _clean_up(cls) -> None:
         """
         Can be overwritten to customize behavior on program exit
         """
-        for a in cls.objs.values():
-            obj: BufferedProcessorBase = a
-            obj._write_all(cls.database)
+        flusher = cls.__dict__.get('_flusher')
+        if flusher is not None:
+            with cls._flush_cond:
+                cls._flush_stopping = True
+                cls._flush_cond.notify_all()
+            flusher.join()
         if hasattr(cls, 'database') and isinstance(cls.database, RwDatabase):
+            # Writes whatever the background thread could not
+            cls._write_dirty(cls.database)
             cls.database.close()
 
 
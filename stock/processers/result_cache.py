@@ -0,0 +1,162 @@
+from __future__ import annotations
+from typing import Any, List, Optional, Tuple
+import pandas as pd
+import numpy as np
+import threading
+import tempfile
+import hashlib
+import pickle
+import os
+
+
+class ResultCache:
+    """
+    Content addressed cache of processor results on disk.
+
+    A result is stored under a hash of the processor class and version, every
+    argument it was created with and a fingerprint of the input data, so results
+    are reused whenever the same computation is repeated, in any process, and a
+    changed input never returns a stale result.
+
+    Entries are written to a temporary file and renamed into place, so processes
+    sharing the directory never read a partial entry. When the entries exceed
+    max_bytes, the least recently used ones, by modification time, are removed.
+
+    === Representation Invariants ===
+    _nbytes is an estimate of the size of the entries in directory, or None
+    if it has not been measured yet
+    """
+    directory: str
+    max_bytes: int
+    _nbytes: Optional[int]
+    _lock: threading.Lock
+
+    def __init__(self, directory: str = 'comdata/results/', max_bytes: int = 2 ** 32):
+        """
+        Creates a cache stored in directory
+        :param max_bytes:
+        Size budget of the entries. Default: 4 GiB
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._nbytes = None
+        self._lock = threading.Lock()
+
+    def key(self, processor: Any, data: pd.DataFrame) -> str:
+        """
+        Returns the key of the result of processor computed on data
+        """
+        cls = processor.__class__
+        args, kwargs = getattr(processor, '_args', ((), {}))
+        params = repr((cls.__module__, cls.__qualname__, getattr(cls, 'version', 0), args, sorted(kwargs.items())))
+        return hashlib.sha256(params.encode() + fingerprint(data).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Returns the result stored under key and marks it as recently used,
+        or None if there is none
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                res = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return res
+
+    def put(self, key: str, data: pd.DataFrame) -> None:
+        """
+        Stores data under key, evicting least recently used entries if the
+        budget is exceeded
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes += size
+        if self._size() > self.max_bytes:
+            self.evict()
+
+    def evict(self, max_bytes: int = None) -> None:
+        """
+        Removes the least recently used entries until they fit in max_bytes,
+        which defaults to 90% of the budget
+        """
+        max_bytes = int(self.max_bytes * 0.9) if max_bytes is None else max_bytes
+        entries = self._entries()
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in sorted(entries, key=lambda entry: entry[2]):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+            total -= size
+        with self._lock:
+            self._nbytes = total
+
+    def clear(self) -> None:
+        """
+        Removes every entry
+        """
+        self.evict(0)
+
+    def _size(self) -> int:
+        with self._lock:
+            if self._nbytes is not None:
+                return self._nbytes
+        total = sum(size for path, size, mtime in self._entries())
+        with self._lock:
+            self._nbytes = total
+        return total
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        """
+        Returns the path, size and modification time of every entry
+        """
+        res = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pkl'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    res.append((os.path.join(root, name), stat.st_size, stat.st_mtime))
+        return res
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+
+def fingerprint(data: pd.DataFrame) -> str:
+    """
+    Returns a fingerprint of data made of its row count, its first and last
+    dates and a checksum of its index, columns and values
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((list(data.columns), [str(dtype) for dtype in data.dtypes])).encode())
+    digest.update(np.ascontiguousarray(data.index.to_numpy()).view(np.uint8) if data.index.dtype.kind in 'biufcmM'
+                  else repr(list(data.index)).encode())
+    for column in data.columns:
+        values = data[column].to_numpy()
+        digest.update(np.ascontiguousarray(values).view(np.uint8) if values.dtype.kind in 'biufcmM'
+                      else repr(values.tolist()).encode())
+    first, last = (data.index[0], data.index[-1]) if len(data) else (None, None)
+    return f'{len(data)}:{first}:{last}:{digest.hexdigest()}'
@@ -0,0 +1,63 @@
+from __future__ import annotations
+from typing import Callable, Iterator, List
+from stock.data.data_source import SyntheticDataSource
+from stock.data.database import ExchangeDatabase
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir(tmp_path_factory: pytest.TempPathFactory) -> Iterator[str]:
+    """
+    Runs the tests in a temporary directory, which holds the findata/ and
+    comdata/ databases they create
+    """
+    cwd = os.getcwd()
+    path = tmp_path_factory.mktemp('work')
+    os.chdir(path)
+    yield str(path)
+    os.chdir(cwd)
+
+
+def _panel(symbols: int = 6, bars: int = 400, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns a panel of random walks with (field, symbol) columns like
+    data_manager.get_panel, with late listings, gaps and missing prices
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2015-01-01', periods=bars, freq='B')
+    frames = {}
+    for i in range(symbols):
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+        df = pd.DataFrame({'Open': close * np.exp(rng.normal(0, 0.005, bars)), 'Close': close,
+                           'Adj Close': close}, index=index)
+        if i % 3 == 1:
+            df = df.iloc[40 + 10 * i:]
+        if i % 3 == 2:
+            df = df.drop(df.index[100:120])
+            df.iloc[150:153, df.columns.get_loc('Close')] = np.nan
+        frames[f'S{i}'] = df
+    return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+
+@pytest.fixture(scope='session')
+def panel() -> pd.DataFrame:
+    return _panel()
+
+
+@pytest.fixture(scope='session')
+def write_stock() -> Callable[..., List[str]]:
+    """
+    Returns a function writing synthetic histories up to end into the database of
+    exchange and returning their symbols
+    """
+    def write(exchange: str, n_symbols: int = 2, end: str = '2016-01-01', first_date: str = '2015-01-01') -> List[str]:
+        source = SyntheticDataSource(n_symbols, first_date=first_date)
+        with ExchangeDatabase(exchange) as db:
+            for symbol in source.symbols():
+                db.write_stock_data(symbol, source.download(symbol, 0, int(time.mktime(pd.Timestamp(end).timetuple()))))
+        return source.symbols()
+    return write
@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import Optional
+from stock.data import data_manager
+from stock.data.async_updater import TokenBucket, download_all, update_database_async
+from stock.data.data_source import SyntheticDataSource
+from stock.data.database import ExchangeDatabase, MetadataDatabase
+import asyncio
+import datetime as dt
+import pandas as pd
+import pytest
+import time
+
+SOURCE = SyntheticDataSource(6, first_date='2024-01-01')
+
+
+class AsyncFlakySource:
+    """
+    Coroutine fetch failing the first attempt of every other symbol
+    """
+    calls: dict
+
+    def __init__(self):
+        self.calls = {}
+
+    async def __call__(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        self.calls[symbol] = self.calls.get(symbol, 0) + 1
+        await asyncio.sleep(0.001)
+        if int(symbol[-1]) % 2 and self.calls[symbol] == 1:
+            raise ConnectionError("Connection Reset")
+        return SOURCE.download(symbol, start, end, interval)
+
+
+def _register(exchange: str) -> None:
+    with MetadataDatabase() as metadb:
+        metadb.write_exchange(exchange, '', pd.DataFrame({'symbol': SOURCE.symbols() + ['UNKNOWN']}))
+
+
+def test_update_writes_every_history(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr('stock.data.async_updater.backoff_delay', lambda attempt: 0.0)
+    _register('asyncx')
+    fetch = AsyncFlakySource()
+    update_database_async('asyncx', fetch=fetch, concurrency=3, attempts=2)
+    with ExchangeDatabase('asyncx', read_only=True) as db:
+        for symbol in SOURCE.symbols():
+            expected = SOURCE.download(symbol, 0, int(time.mktime(dt.date.today().timetuple())))
+            pd.testing.assert_frame_equal(db.read_stock_data(symbol), expected, check_dtype=False)
+        assert not db.have_table('UNKNOWN')
+    with MetadataDatabase() as metadb:
+        watermarks = metadb.get_watermarks('asyncx')
+        assert metadb.get_exchange_metadata('asyncx')[2] == pd.Timestamp.today().strftime('%Y-%m-%d')
+    assert watermarks.loc['UNKNOWN', 'status'] == 'failed' and (watermarks.loc[SOURCE.symbols(), 'status'] == 'ok').all()
+    assert fetch.calls['SYN00001'] == 2 and fetch.calls['SYN00000'] == 1
+    assert not data_manager.get_data('asyncx', 'SYN00000').empty
+
+
+def test_download_all_bounds_concurrency_and_rate() -> None:
+    active = []
+    peak = []
+    written = {}
+
+    async def fetch(symbol: str, start: int, end: int, interval: str) -> pd.DataFrame:
+        active.append(symbol)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(symbol)
+        return pd.DataFrame({'Close': [float(start)]})
+
+    symbols = [(f'S{i}', f'S{i}', i) for i in range(12)]
+    begin = time.monotonic()
+    # A burst of 8 requests, then one every 1 / 8 seconds
+    asyncio.run(download_all(symbols, written.__setitem__, 0, fetch, concurrency=4, rate=8.0))
+    assert max(peak) <= 4 and len(written) == 12
+    assert all(written[f'S{i}']['Close'].iloc[0] == i for i in range(12))
+    assert time.monotonic() - begin >= 0.9 * (12 - 8) / 8
+
+
+def test_token_bucket_limits_the_rate() -> None:
+    async def take(bucket: TokenBucket, count: int) -> float:
+        begin = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - begin
+
+    assert asyncio.run(take(TokenBucket(50.0, 5), 5)) < 0.05
+    assert asyncio.run(take(TokenBucket(50.0, 5), 15)) >= 0.9 * 10 / 50
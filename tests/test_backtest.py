@@ -0,0 +1,76 @@
+from __future__ import annotations
+from stock.policies.backtest import run_backtest
+from stock.policy.p_ma import DoubleMA
+import numpy as np
+import pandas as pd
+import pytest
+
+DATES = pd.date_range('2015-01-05', periods=5, freq='B')
+
+
+def _panel() -> pd.DataFrame:
+    """
+    Returns two symbols over five dates. B has no bar on the third date, no open
+    on the fourth and splits 2 for 1 before the last, which Adj Close adjusts
+    """
+    frames = {'A': pd.DataFrame({'Open': [10.0, 11.0, 12.0, 11.0, 13.0], 'Close': [10.0, 12.0, 11.0, 12.0, 13.0]},
+                                index=DATES),
+              'B': pd.DataFrame({'Open': [20.0, 21.0, np.nan, np.nan, 11.0], 'Close': [20.0, 22.0, np.nan, 24.0, 12.0]},
+                                index=DATES)}
+    panel = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+    adjusted = panel['Close'].copy()
+    adjusted.loc[DATES[:4], 'B'] /= 2
+    for symbol in adjusted.columns:
+        panel[('Adj Close', symbol)] = adjusted[symbol]
+    return panel.sort_index(axis=1)
+
+
+def _expected(panel: pd.DataFrame, targets: pd.DataFrame, cost: float) -> pd.DataFrame:
+    """
+    Returns the returns of trading towards targets, computed bar by bar
+    """
+    res = pd.DataFrame(np.nan, index=targets.index, columns=targets.columns)
+    for symbol in targets.columns:
+        factor = panel[('Adj Close', symbol)] / panel[('Close', symbol)]
+        close = panel[('Close', symbol)] * factor
+        open_ = panel[('Open', symbol)].fillna(panel[('Close', symbol)]) * factor
+        held = previous_close = None
+        for date in close.dropna().index:
+            before, held = (0.0, 0.0) if held is None else (held, np.nan_to_num(targets.loc[previous, symbol]))
+            gap = 0.0 if previous_close is None else before * (open_[date] / previous_close - 1)
+            res.loc[date, symbol] = (1 + gap) * (1 + held * (close[date] / open_[date] - 1)) \
+                * (1 - cost * abs(held - before)) - 1
+            previous, previous_close = date, close[date]
+    return res
+
+
+@pytest.mark.parametrize('cost', [0.0, 0.01])
+def test_run_backtest_arithmetic(cost: float) -> None:
+    panel = _panel()
+    targets = pd.DataFrame({'A': [1.0, 1.0, 0.0, -1.0, 1.0], 'B': [0.5, np.nan, 1.0, 1.0, 0.0]}, index=DATES)
+    res = run_backtest(panel, targets, cost)
+    expected = _expected(panel, targets, cost)
+    pd.testing.assert_frame_equal(res.returns, expected, rtol=1e-12)
+    # A holds 1 from the open of the second bar: 12 / 11 - 1 less the cost of buying
+    assert res.returns.loc[DATES[1], 'A'] == pytest.approx(12 / 11 * (1 - cost) - 1)
+    assert np.isnan(res.positions.loc[DATES[2], 'B'])
+    assert res.positions.loc[DATES[3], 'B'] == 0.0
+    np.testing.assert_array_equal(res.trades['A'], [0.0, 1.0, 0.0, -1.0, -1.0])
+    np.testing.assert_array_equal(res.fill_prices['A'], [np.nan, 11.0, np.nan, 11.0, 13.0])
+    pd.testing.assert_frame_equal(res.equity, (1 + expected.fillna(0)).cumprod(), rtol=1e-12)
+    portfolio = expected.mean(axis=1)
+    pd.testing.assert_series_equal(res.portfolio, (1 + portfolio).cumprod(), rtol=1e-12, check_names=False,
+                                   check_freq=False)
+    summary = res.summary()
+    assert summary.loc['A', 'total_return'] == pytest.approx(res.equity['A'].iloc[-1] - 1)
+    assert summary.loc['B', 'volatility'] == pytest.approx(expected['B'].std() * np.sqrt(252))
+    assert list(summary['trades']) == [3, 3, 6]
+
+
+def test_fit_batch_starts_flat_on_signals_warmed_up_before(panel: pd.DataFrame) -> None:
+    policy = DoubleMA(5, 20)
+    res = policy.fit_batch(panel, '2015-03-02', '2015-06-30')
+    targets = policy.signal(panel).reindex(panel.index).loc['2015-03-02':'2015-06-30']
+    pd.testing.assert_frame_equal(res.returns, run_backtest(panel.loc['2015-03-02':'2015-06-30'], targets).returns,
+                                  check_exact=True, check_freq=False)
+    assert (res.positions.iloc[0].fillna(0) == 0).all()
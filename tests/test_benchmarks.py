@@ -0,0 +1,52 @@
+from __future__ import annotations
+from stock.benchmarks.suite import BENCHMARKS, compare, run_suite
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_cli(*args: str) -> subprocess.CompletedProcess:
+    """
+    Runs the suite from the command line in a new process, since processor classes
+    stay bound to the databases of the directory the suite ran in
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, '-m', 'stock.benchmarks.suite', '--symbols', '3', '--years', '1', *args],
+                          env=env, capture_output=True, text=True, timeout=300)
+
+
+def test_suite_runs_every_benchmark(tmp_path: str) -> None:
+    output = os.path.join(tmp_path, 'results.json')
+    proc = _run_cli('--repeat', '2', '--output', output)
+    assert proc.returncode == 0, proc.stderr
+    with open(output) as f:
+        res = json.load(f)
+    assert res['meta']['symbols'] == 3 and res['meta']['rows'] > 0
+    assert list(res['results']) == list(BENCHMARKS)
+    for timing in res['results'].values():
+        assert len(timing['times']) == 2 and 0 < timing['min'] <= timing['median']
+
+    # Any time is a regression against a baseline of zeros
+    baseline = os.path.join(tmp_path, 'baseline.json')
+    with open(baseline, 'w') as f:
+        json.dump({'results': {'read_stock_data': {'min': 0.0}}}, f)
+    proc = _run_cli('--repeat', '1', '--only', 'read_stock_data', '--output', output, '--baseline', baseline)
+    assert proc.returncode == 1 and 'REGRESSION read_stock_data' in proc.stdout
+
+
+def test_unknown_benchmark_raises() -> None:
+    cwd = os.getcwd()
+    with pytest.raises(ValueError):
+        run_suite(names=['missing'])
+    assert os.getcwd() == cwd
+
+
+def test_compare_reports_regressions() -> None:
+    baseline = {'results': {'a': {'min': 1.0}, 'b': {'min': 2.0}, 'c': {'min': 0.0}}}
+    results = {'results': {'a': {'min': 1.05}, 'b': {'min': 3.0}, 'd': {'min': 1.0}}}
+    assert compare(results, baseline) == [('b', 2.0, 3.0, 1.5)]
+    assert compare(results, baseline, tolerance=0.01) == [('a', 1.0, 1.05, pytest.approx(1.05)), ('b', 2.0, 3.0, 1.5)]
@@ -0,0 +1,58 @@
+from __future__ import annotations
+from typing import Any, Hashable, List, Tuple
+from stock.data.cache import DataCache
+import numpy as np
+import threading
+
+
+def _array(kib: int) -> np.ndarray:
+    return np.zeros(kib * 128)
+
+
+def test_least_recently_used_entries_are_evicted() -> None:
+    cache = DataCache(max_bytes=3 * 1024)
+    evicted: List[Tuple[Hashable, Any]] = []
+    cache.add_listener(lambda key, value: evicted.append((key, len(value))))
+    for key in 'abc':
+        cache[key] = _array(1)
+    assert cache.get('a') is not None
+    cache['d'] = _array(1)
+    assert evicted == [('b', 128)]
+    assert 'b' not in cache and list(key for key, value in cache.items()) == ['c', 'a', 'd']
+    cache.resize(1024)
+    assert [key for key, value in evicted] == ['b', 'c', 'a']
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'evictions': 3, 'entries': 1, 'nbytes': 1024, 'max_bytes': 1024}
+
+
+def test_last_entry_is_kept_over_budget() -> None:
+    cache = DataCache(max_bytes=1024)
+    cache['a'] = _array(1)
+    cache['big'] = _array(4)
+    assert 'a' not in cache and 'big' in cache and cache.nbytes == 4096
+    assert cache.pop('big') is not None and cache.nbytes == 0
+
+
+def test_listeners_are_called_unlocked() -> None:
+    cache = DataCache(max_bytes=1024)
+    seen = []
+
+    def listener(key: Hashable, value: Any) -> None:
+        # Another thread can only use the cache if this one released its lock
+        reader = threading.Thread(target=lambda: seen.append(cache.get('b') is not None))
+        reader.start()
+        reader.join(timeout=5)
+        seen.append(reader.is_alive())
+    cache.add_listener(listener)
+    cache['a'] = _array(1)
+    cache['b'] = _array(1)
+    assert seen == [True, False]
+
+
+def test_views_share_the_budget() -> None:
+    cache = DataCache(max_bytes=2 * 1024)
+    first, second = cache.view('first'), cache.view('second')
+    first['x'] = _array(1)
+    second['x'] = _array(1)
+    assert 'x' in first and 'x' in second and len(first) == 1
+    first['y'] = _array(1)
+    assert 'x' not in first and list(first) == ['y'] and list(second) == ['x']
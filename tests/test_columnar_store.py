@@ -0,0 +1,86 @@
+from __future__ import annotations
+from pathlib import Path
+from stock.data.columnar_store import ColumnarStore
+from stock.data.data_source import SyntheticDataSource
+import numpy as np
+import pandas as pd
+import pytest
+import time
+
+
+def _history(symbol: str = 'SYN00000', end: str = '2016-01-01') -> pd.DataFrame:
+    return SyntheticDataSource(4, first_date='2015-01-01').download(symbol, 0, int(time.mktime(pd.Timestamp(end).timetuple())))
+
+
+def _assert_holds(store: ColumnarStore, symbol: str, df: pd.DataFrame) -> None:
+    arrays = store.read_symbol(symbol)
+    assert np.array_equal(arrays['Date'], pd.to_datetime(df.index).values.astype('datetime64[D]'))
+    for field in df.columns:
+        assert np.array_equal(arrays[field], df[field].to_numpy(dtype=float))
+
+
+def test_read_symbol_slices_views(tmp_path: Path) -> None:
+    store = ColumnarStore('nyse', str(tmp_path))
+    assert not ColumnarStore.exists('nyse', str(tmp_path))
+    df = _history()
+    store.write_symbol('SYN00000', df)
+    assert ColumnarStore.exists('NYSE', str(tmp_path)) and store.symbols() == ('SYN00000',)
+    _assert_holds(store, 'SYN00000', df)
+    arrays = store.read_symbol('SYN00000', '2015-03-01', '2015-03-31', ['Date', 'Close'])
+    assert list(arrays) == ['Date', 'Close'] and not arrays['Close'].flags.writeable
+    assert np.array_equal(arrays['Close'], df.loc['2015-03-01':'2015-03-31', 'Close'].to_numpy())
+    assert len(store.read_symbol('SYN00000', '0000-00-00', '9999-99-99')['Date']) == len(df)
+    with pytest.raises(KeyError):
+        store.read_symbol('SYN00001')
+
+
+def test_appends_are_written_in_place(tmp_path: Path) -> None:
+    store = ColumnarStore('nyse', str(tmp_path))
+    df = _history()
+    store.write_symbol('SYN00000', df.iloc[:200])
+    store.write_symbol('SYN00001', _history('SYN00001'))
+    location, rows = store._index['SYN00000'], store._rows
+    for i in range(200, len(df), 7):
+        store.update_symbol('SYN00000', df.iloc[i:i + 7])
+    assert store._index['SYN00000'][:1] == location[:1] and store._rows == rows
+    _assert_holds(store, 'SYN00000', df)
+    _assert_holds(store, 'SYN00001', _history('SYN00001'))
+
+
+def test_updates_replace_rows_and_relocate(tmp_path: Path) -> None:
+    store = ColumnarStore('nyse', str(tmp_path))
+    df = _history()
+    store.write_symbol('SYN00000', df.iloc[:100])
+    store.write_symbol('SYN00001', _history('SYN00001'))
+    corrected = df.iloc[90:].copy()
+    corrected['Close'] *= 2
+    store.update_symbol('SYN00000', corrected)
+    assert store._index['SYN00000'][0] > store._index['SYN00001'][0]
+    _assert_holds(store, 'SYN00000', pd.concat([df.iloc[:90], corrected]))
+    # Outgrowing the capacity of a segment moves it too
+    offset = store._index['SYN00001'][0]
+    longer = _history('SYN00001', '2017-06-01')
+    store.update_symbol('SYN00001', longer.iloc[len(_history('SYN00001')):])
+    assert store._index['SYN00001'][0] != offset
+    _assert_holds(store, 'SYN00001', longer)
+    _assert_holds(ColumnarStore('nyse', str(tmp_path)), 'SYN00000', pd.concat([df.iloc[:90], corrected]))
+
+
+def test_stale_rows_are_compacted(tmp_path: Path) -> None:
+    store = ColumnarStore('nyse', str(tmp_path))
+    frames = {symbol: _history(symbol) for symbol in ('SYN00000', 'SYN00001', 'SYN00002')}
+    for symbol, df in frames.items():
+        store.write_symbol(symbol, df)
+    for i in range(20):
+        symbol = f'SYN0000{i % 3}'
+        frames[symbol] = frames[symbol] * 1.01
+        store.write_symbol(symbol, frames[symbol])
+    assert store._rows <= 3 * sum(capacity for _, _, capacity in store._index.values())
+    reader = ColumnarStore('nyse', str(tmp_path))
+    for symbol, df in frames.items():
+        _assert_holds(store, symbol, df)
+        _assert_holds(reader, symbol, df)
+    store.compact()
+    assert store._rows == sum(capacity for _, _, capacity in store._index.values())
+    for symbol, df in frames.items():
+        _assert_holds(reader, symbol, df)
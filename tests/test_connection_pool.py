@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import Callable, List
+from stock.data import data_manager
+from stock.data.connection_pool import DatabasePool
+from stock.data.database import RwDatabase
+import threading
+import time
+import pytest
+
+
+def _pool(opened: List[RwDatabase], max_size: int = 4, idle_timeout: float = 300.0) -> DatabasePool:
+    RwDatabase('pool/', 'pool.db').close()
+
+    def factory() -> RwDatabase:
+        db = RwDatabase('pool/', 'pool.db', read_only=True)
+        opened.append(db)
+        return db
+    return DatabasePool(factory, max_size, idle_timeout)
+
+
+def test_databases_are_reused() -> None:
+    opened = []
+    pool = _pool(opened)
+    with pool.database() as db:
+        assert db.is_open()
+    with pool.database() as again:
+        assert again is db
+    assert len(opened) == 1
+
+
+def test_checkout_blocks_at_max_size() -> None:
+    opened = []
+    pool = _pool(opened, max_size=2)
+    first, second = pool.checkout(), pool.checkout()
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.05)
+    threading.Timer(0.05, pool.checkin, (first,)).start()
+    assert pool.checkout(timeout=5) is first
+    pool.checkin(first)
+    pool.checkin(second)
+
+
+def test_idle_databases_are_closed() -> None:
+    opened = []
+    pool = _pool(opened, idle_timeout=0.01)
+    with pool.database():
+        pass
+    time.sleep(0.05)
+    pool.evict_idle()
+    assert not opened[0].is_open()
+
+
+def test_resize_closes_idle_databases_above_the_limit() -> None:
+    opened = []
+    pool = _pool(opened, max_size=4)
+    databases = [pool.checkout() for _ in range(4)]
+    for db in databases[:3]:
+        pool.checkin(db)
+    pool.resize(2)
+    assert [db.is_open() for db in databases] == [False, False, True, True]
+    pool.checkin(databases[3])
+    assert databases[3].is_open()
+    held = [pool.checkout(), pool.checkout()]
+    pool.resize(1)
+    pool.checkin(held[0])
+    assert not held[0].is_open()
+    pool.checkin(held[1])
+    assert held[1].is_open()
+    pool.close()
+    assert not any(db.is_open() for db in opened)
+
+
+def test_configure_pool_resizes_existing_pools(write_stock: Callable[..., List[str]]) -> None:
+    symbol = write_stock('pooled')[0]
+    pool = data_manager._pool('pooled')
+    databases = [pool.checkout() for _ in range(3)]
+    for db in databases:
+        pool.checkin(db)
+    try:
+        data_manager.configure_pool(max_size=1)
+        assert pool.max_size == 1 and sum(db.is_open() for db in databases) == 1
+        assert not data_manager.get_data('pooled', symbol).empty
+    finally:
+        data_manager.configure_pool()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+from typing import Callable, List
+from stock.data import data_manager
+from stock.processers.dag import Graph, Field, Const, Where
+import pandas as pd
+import sqlite3
+
+
+def _graph() -> Graph:
+    close = Field('Close')
+    signal = close.mean(5) - close.mean(20)
+    return Graph(signal=signal, spread=close.std(10) / close.mean(10), change=close.diff(), total=close.cumsum(),
+                 side=Where(signal > 0, 1.0, -1.0), previous=signal.shift())
+
+
+def test_panel_equals_symbols(panel: pd.DataFrame) -> None:
+    graph = _graph()
+    res = graph.evaluate(panel)
+    for symbol in panel.columns.unique(level=1):
+        data = panel.xs(symbol, axis=1, level=1).dropna(how='all')
+        expected = graph.evaluate(data)
+        got = res.xs(symbol, axis=1, level=1).loc[data.index, list(expected.columns)]
+        pd.testing.assert_frame_equal(got, expected, check_exact=True, check_freq=False, check_names=False)
+
+
+def test_shared_nodes_have_one_key() -> None:
+    close = Field('Close')
+    graph = Graph(a=close.mean(5) - close.mean(20), b=close.mean(5) / close.mean(20))
+    assert len([node for node in graph.order if node.key == close.mean(5).key]) == 1
+    assert len(graph.order) == 5
+    assert Const(1).key != Const(1.0).key != Const(True).key
+    assert Const([1]).key != Const([1]).key
+
+
+def test_get_data_follows_corrected_prices(write_stock: Callable[..., List[str]]) -> None:
+    symbol = write_stock('dag')[0]
+    graph = Graph(ma=Field('Close').mean(5))
+    before = graph.get_data('dag', symbol)
+    pd.testing.assert_frame_equal(before, graph.evaluate(data_manager.get_data('dag', symbol)))
+    with sqlite3.connect('findata/dag.db') as connection:
+        connection.execute(f'UPDATE "{symbol}" SET Close = Close * 2 WHERE Date = (SELECT MAX(Date) FROM "{symbol}")')
+    data_manager.invalidate('dag', symbol)
+    after = graph.get_data('dag', symbol)
+    pd.testing.assert_frame_equal(after, graph.evaluate(data_manager.get_data('dag', symbol)))
+    assert after['ma'].iloc[-1] != before['ma'].iloc[-1]
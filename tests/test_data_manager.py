@@ -0,0 +1,35 @@
+from __future__ import annotations
+from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+from stock.data import data_manager
+from stock.data.database import ExchangeDatabase
+import numpy as np
+import os
+
+
+def _assert_arrays_equal(arrays: dict, exchange: str, symbol: str, start_date: str, end_date: str) -> None:
+    df = data_manager.get_data(exchange, symbol, start_date, end_date)
+    assert np.array_equal(arrays['Date'], df.index.values.astype('datetime64[D]'))
+    for column in df.columns:
+        assert np.array_equal(arrays[column], df[column].to_numpy(dtype=float))
+
+
+def test_get_arrays_reads_without_creating_a_store(write_stock: Callable[..., List[str]]) -> None:
+    symbol = write_stock('rows')[0]
+    arrays = data_manager.get_arrays('rows', symbol, '2015-03-01', '2015-06-30')
+    _assert_arrays_equal(arrays, 'rows', symbol, '2015-03-01', '2015-06-30')
+    assert not os.path.exists('findata/rows.columns') and 'rows' not in data_manager.stores
+
+
+def test_get_arrays_reads_the_columnar_store(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('cols')
+    with ExchangeDatabase('cols', columnar=True) as db:
+        db.rebuild_columns()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda symbol: data_manager.get_arrays('cols', symbol, '2015-03-01', '2015-06-30'),
+                                    symbols * 4))
+    store = data_manager.stores['cols']
+    for symbol, arrays in zip(symbols * 4, results):
+        assert not arrays['Close'].flags.writeable
+        _assert_arrays_equal(arrays, 'cols', symbol, '2015-03-01', '2015-06-30')
+    assert data_manager._store('cols') is store
@@ -0,0 +1,75 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import List, Optional
+from stock.data import database_updater
+from stock.data.data_source import DataSource, ReplayDataSource, SyntheticDataSource, write_fixtures
+import pandas as pd
+import pytest
+import time
+
+
+def _timestamp(date: str) -> int:
+    return int(time.mktime(pd.Timestamp(date).timetuple()))
+
+
+class FlakySource(DataSource):
+    """
+    Raises on the first failures downloads, then downloads from a synthetic source
+    """
+    failures: int
+    calls: int
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("Connection Reset")
+        return SyntheticDataSource(1).download(symbol, start, end, interval)
+
+
+def test_download_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        DataSource()
+
+
+def test_synthetic_downloads_agree() -> None:
+    source = SyntheticDataSource(3, first_date='2015-01-01')
+    full = source.download('SYN00001', 0, _timestamp('2016-01-01'))
+    assert list(full.columns) == ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+    assert full.index.name == 'Date' and full.index[0] == '2015-01-01' and full.index[-1] < '2016-01-01'
+    later = source('SYN00001', _timestamp('2015-06-01'), _timestamp('2016-03-01'))
+    pd.testing.assert_frame_equal(later.loc[:full.index[-1]], full.loc['2015-06-01':])
+    assert source.download('SYN00003', 0, _timestamp('2016-01-01')) is None
+    assert source.download('AAPL', 0, _timestamp('2016-01-01')) is None
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_replay_serves_fixtures(tmp_path: Path, file_format: str) -> None:
+    if file_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    source = SyntheticDataSource(2, first_date='2015-01-01')
+    assert write_fixtures(str(tmp_path), source, ['SYN00000', 'SYN00001', 'SYN00002'], 0, _timestamp('2016-01-01'),
+                          file_format) == ['SYN00000', 'SYN00001']
+    replay = ReplayDataSource(str(tmp_path))
+    assert replay.symbols() == ['SYN00000', 'SYN00001']
+    hist = replay.download('SYN00001', _timestamp('2015-03-01'), _timestamp('2015-09-01'))
+    expected = source.download('SYN00001', _timestamp('2015-03-01'), _timestamp('2015-09-01'))
+    pd.testing.assert_frame_equal(hist, expected, check_dtype=False)
+    assert replay.download('SYN00002', 0, _timestamp('2016-01-01')) is None
+    with pytest.raises(ValueError):
+        ReplayDataSource(str(tmp_path / 'missing'))
+
+
+@pytest.mark.parametrize('failures, attempts, sleeps', [(0, 3, 0), (2, 3, 2), (3, 3, 2), (5, 1, 0)])
+def test_download_retries_and_sleeps_between_attempts(monkeypatch: pytest.MonkeyPatch, failures: int, attempts: int,
+                                                      sleeps: int) -> None:
+    slept: List[float] = []
+    monkeypatch.setattr(database_updater.time, 'sleep', slept.append)
+    source = FlakySource(failures)
+    hist = database_updater._download('SYN00000', 0, _timestamp('2016-01-01'), attempts=attempts, source=source)
+    assert source.calls == min(failures + 1, attempts)
+    assert (hist is None) == (failures >= attempts)
+    assert len(slept) == sleeps
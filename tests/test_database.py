@@ -0,0 +1,143 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, List
+from stock.data import data_manager
+from stock.data.data_source import SyntheticDataSource
+from stock.data.database import RwDatabase, ExchangeDatabase
+import pandas as pd
+import pytest
+import sqlite3
+import time
+
+
+def _history(symbol: str = 'SYN00000', end: str = '2016-01-01') -> pd.DataFrame:
+    return SyntheticDataSource(4, first_date='2015-01-01').download(symbol, 0, int(time.mktime(pd.Timestamp(end).timetuple())))
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    return str(tmp_path) + '/'
+
+
+def test_symbol_tables_are_clustered_on_date(path: str) -> None:
+    with ExchangeDatabase('nyse', path=path) as db:
+        assert db.schema_version == RwDatabase.SCHEMA_VERSION
+        db.write_stock_data('SYN00000', _history())
+        assert db.have_primary_key('SYN00000')
+        db.cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'SYN00000';")
+        assert db.cursor.fetchone()[0].endswith('PRIMARY KEY ("Date")) WITHOUT ROWID')
+        db.cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM "SYN00000" WHERE Date BETWEEN ? AND ?;', ('2015-03-01', '2015-04-01'))
+        assert 'SEARCH' in db.cursor.fetchone()[-1]
+        df = db.read_stock_data('SYN00000', '2015-03-01', '2015-03-31')
+        pd.testing.assert_frame_equal(df, _history().loc['2015-03-01':'2015-03-31'], check_dtype=False)
+
+
+def test_migration_keys_legacy_tables(path: str) -> None:
+    with sqlite3.connect(path + 'nyse.db') as connection:
+        connection.execute('CREATE TABLE "A" (Date TEXT, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, '
+                           'Volume INTEGER);')
+        connection.executemany('INSERT INTO "A" VALUES (?, 1, 1, 1, ?, ?, 100);',
+                               [('2015-01-02', 1.0, 1.0), ('2015-01-05', 2.0, 2.0), ('2015-01-02', 3.0, 3.0),
+                                (None, 4.0, 4.0)])
+        connection.execute('CREATE TABLE "notes" (Text TEXT);')
+    with ExchangeDatabase('nyse', path=path) as db:
+        assert db.schema_version == 0 and not db.have_primary_key('A')
+        assert db.migrate() == 1
+        assert db.schema_version == RwDatabase.SCHEMA_VERSION and db.have_primary_key('A')
+        assert db.read_stock_data('A')['Close'].to_dict() == {'2015-01-02': 3.0, '2015-01-05': 2.0}
+        assert not db.migrate_table('A') and not db.migrate_table('notes')
+
+
+def test_read_panel_reads_symbols_in_one_pass(path: str) -> None:
+    with ExchangeDatabase('nyse', path=path) as db:
+        for symbol in ('SYN00000', 'SYN00001'):
+            db.write_stock_data(symbol, _history(symbol))
+        long = db.read_panel(['SYN00001', 'MISSING', 'SYN00000'], ['Close', 'Volume'], '2015-03-01', '2015-03-31')
+        assert list(long.columns) == ['Symbol', 'Date', 'Close', 'Volume']
+        for symbol, rows in long.groupby('Symbol'):
+            pd.testing.assert_frame_equal(rows.set_index('Date')[['Close', 'Volume']],
+                                          db.read_stock_data(symbol, '2015-03-01', '2015-03-31')[['Close', 'Volume']])
+        assert set(long['Symbol']) == {'SYN00000', 'SYN00001'}
+        assert db.read_panel(['MISSING']).empty
+        with pytest.raises(ValueError):
+            db.read_panel(['SYN00000'], ['Close; DROP TABLE x'])
+
+
+def test_get_panel_aligns_symbols(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('panel', 2)
+    with ExchangeDatabase('panel') as db:
+        late = SyntheticDataSource(3, first_date='2015-06-01')
+        db.write_stock_data('SYN00002', late.download('SYN00002', 0, int(time.mktime(pd.Timestamp('2016-01-01').timetuple()))))
+    panel = data_manager.get_panel('panel', symbols + ['SYN00002'], ['Close', 'Volume'], '2015-05-01')
+    assert isinstance(panel.index, pd.DatetimeIndex) and panel.index.is_monotonic_increasing
+    assert list(panel.columns) == [(field, symbol) for field in ('Close', 'Volume') for symbol in symbols + ['SYN00002']]
+    for symbol in symbols + ['SYN00002']:
+        expected = data_manager.get_data('panel', symbol, '2015-05-01')
+        got = panel.xs(symbol, axis=1, level=1).dropna(how='all')
+        pd.testing.assert_frame_equal(got, expected[['Close', 'Volume']], check_dtype=False, check_freq=False,
+                                      check_names=False)
+    assert panel['Close']['SYN00002'].loc[:'2015-05-29'].isna().all()
+
+
+def test_bulk_load_upserts_in_batches(path: str) -> None:
+    history = _history()
+    with ExchangeDatabase('nyse', path=path) as db:
+        db.write_stock_data('SYN00000', history.iloc[:100])
+        db.cursor.execute('PRAGMA synchronous;')
+        synchronous = db.cursor.fetchone()[0]
+        corrected = history.iloc[50:].copy()
+        corrected['Close'] *= 2
+        with db.bulk_load(batch_size=2):
+            with pytest.raises(ValueError):
+                with db.bulk_load():
+                    pass
+            db.write_stock_data('SYN00000', corrected)
+            db.write_stock_data('SYN00001', _history('SYN00001'))
+            # The batch of two was merged but is not committed until the block exits
+            assert len(db.read_stock_data('SYN00000')) == len(history)
+            db.write_stock_data('SYN00002', _history('SYN00002'))
+            assert not db.have_table('SYN00002')
+        db.cursor.execute('PRAGMA journal_mode;')
+        assert db.cursor.fetchone()[0] == 'wal'
+        db.cursor.execute('PRAGMA synchronous;')
+        assert db.cursor.fetchone()[0] == synchronous
+    with ExchangeDatabase('nyse', path=path, read_only=True) as db:
+        pd.testing.assert_frame_equal(db.read_stock_data('SYN00000'), pd.concat([history.iloc[:50], corrected]),
+                                      check_dtype=False)
+        for symbol in ('SYN00001', 'SYN00002'):
+            pd.testing.assert_frame_equal(db.read_stock_data(symbol), _history(symbol), check_dtype=False)
+
+
+def test_bulk_load_rolls_back_on_error(path: str) -> None:
+    with ExchangeDatabase('nyse', path=path) as db:
+        db.write_stock_data('SYN00000', _history().iloc[:100])
+        with pytest.raises(RuntimeError):
+            with db.bulk_load(batch_size=1):
+                db.write_stock_data('SYN00000', _history() * 2)
+                db.write_stock_data('SYN00001', _history('SYN00001'))
+                raise RuntimeError("Download Failed")
+        assert not db.have_table('SYN00001')
+        pd.testing.assert_frame_equal(db.read_stock_data('SYN00000'), _history().iloc[:100], check_dtype=False)
+        with db.bulk_load():
+            db.write_stock_data('SYN00001', _history('SYN00001'))
+        assert len(db.read_stock_data('SYN00001')) == len(_history('SYN00001'))
+
+
+@pytest.mark.parametrize('primary_key', ['Date', None])
+def test_write_columns_multi_adds_columns_and_dates(path: str, primary_key: str) -> None:
+    index = pd.date_range('2015-01-01', periods=6, freq='B')
+    with RwDatabase(path, 'results.db') as db:
+        for table in ('a', 'b', 'c'):
+            db.ensure_table(table, {'Date': 'TEXT'}, primary_key)
+        db.write_columns('a', pd.DataFrame({'x': [1.0, 2.0, 3.0]}, index=index[:3]))
+        db.write_columns_multi({'a': pd.DataFrame({'x': [20.0, 40.0, 50.0], 'y': [0.5, None, 0.25]}, index=index[[1, 3, 4]]),
+                                'b': pd.DataFrame({'x': [7.0]}, index=index[5:]),
+                                'c': pd.DataFrame({'z': [8.0, 9.0]}, index=index[:2])})
+        a = db.read_column('a', ['Date', 'x', 'y']).set_index('Date').sort_index()
+        assert a.index.tolist() == [date.strftime('%Y-%m-%d') for date in index[:5]]
+        assert a['x'].tolist() == [1.0, 20.0, 3.0, 40.0, 50.0]
+        assert a['y'].isna().tolist() == [True, False, True, True, False]
+        assert db.read_column('b', ['Date', 'x']).values.tolist() == [[index[5].strftime('%Y-%m-%d'), 7.0]]
+        assert db.read_column('c', 'z')['z'].tolist() == [8.0, 9.0] and not db.have_column('c', 'x')
+        db.cursor.execute("SELECT name FROM sqlite_temp_master WHERE name = 'column_staging';")
+        assert db.cursor.fetchone() is None
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from typing import Dict, Optional
+from stock.data import database_updater
+from stock.data.database_updater import _plan_update, _timestamp, clear_update_record
+from stock.data.data_source import SyntheticDataSource
+from stock.data.database import ExchangeDatabase, MetadataDatabase
+from stock.data.frame_transport import SharedFrames
+import datetime as dt
+import multiprocessing
+import pandas as pd
+import pytest
+import queue
+import threading
+
+SOURCE = SyntheticDataSource(4, first_date='2024-01-01')
+TODAY = dt.date.today().strftime('%Y-%m-%d')
+
+
+def _register(exchange: str) -> None:
+    with MetadataDatabase() as metadb:
+        metadb.write_exchange(exchange, '', pd.DataFrame({'symbol': SOURCE.symbols()}))
+
+
+def test_watermarks_never_move_back() -> None:
+    with MetadataDatabase() as metadb:
+        metadb.write_watermarks('marks', [('A', '2024-03-01', 'ok'), ('B', None, 'empty')], attempt='2024-03-02')
+        metadb.write_watermarks('marks', [('A', '2024-02-01', 'ok'), ('B', None, 'failed')], attempt='2024-03-03')
+        metadb.write_watermarks('marks', [('A', None, 'failed')], attempt='2024-03-04')
+        watermarks = metadb.get_watermarks('marks')
+        assert watermarks.loc['A'].tolist() == ['2024-03-01', '2024-03-04', 'failed']
+        assert pd.isna(watermarks.loc['B', 'last_date']) and watermarks.loc['B', 'status'] == 'failed'
+        assert metadb.get_watermarks('other').empty
+
+
+def test_plan_resumes_every_symbol_after_its_watermark() -> None:
+    _register('plan')
+    with ExchangeDatabase('plan') as db:
+        db.write_stock_data('SYN00003', SOURCE.download('SYN00003', 0, _timestamp('2024-05-01')))
+    with MetadataDatabase() as metadb:
+        metadb.write_watermarks('plan', [('SYN00000', '2024-04-01', 'ok')], attempt='2024-04-02')
+        metadb.write_watermarks('plan', [('SYN00001', '2024-04-01', 'ok'), ('SYN00002', '2024-04-01', 'failed')],
+                                attempt=TODAY)
+        ext, plan, end = _plan_update(metadb, 'plan')
+        assert ext == '' and end == _timestamp(dt.date.today())
+        assert dict(plan) == {'SYN00000': _timestamp('2024-04-02'), 'SYN00002': _timestamp('2024-04-02'),
+                              'SYN00003': _timestamp('2024-05-01')}
+        assert dict(_plan_update(metadb, 'plan', '2024-01-15')[1]) == dict.fromkeys(SOURCE.symbols(), _timestamp('2024-01-15'))
+        with pytest.raises(ValueError):
+            _plan_update(metadb, 'missing')
+    clear_update_record('plan')
+    with MetadataDatabase() as metadb:
+        assert metadb.get_watermarks('plan').empty
+        assert dict(_plan_update(metadb, 'plan')[1])['SYN00000'] == _timestamp('1970-01-01')
+
+
+def test_updates_only_download_missing_ranges(monkeypatch: pytest.MonkeyPatch) -> None:
+    _register('resume')
+    starts = []
+
+    class RecordingSource(SyntheticDataSource):
+        def download(self, symbol: str, start: int, end: int, interval: str = '1d') -> Optional[pd.DataFrame]:
+            starts.append((symbol, start))
+            return SyntheticDataSource.download(self, symbol, start, end, interval)
+
+    source = RecordingSource(4, first_date='2024-01-01')
+    database_updater.update_database('resume', threads=1, source=source)
+    assert sorted(starts) == [(symbol, _timestamp('1970-01-01')) for symbol in SOURCE.symbols()]
+    starts.clear()
+    database_updater.update_database('resume', threads=1, source=source)
+    assert starts == []
+    with MetadataDatabase() as metadb:
+        watermarks = metadb.get_watermarks('resume')
+        metadb.write_watermarks('resume', [(symbol, '2024-06-28', 'ok') for symbol in SOURCE.symbols()],
+                                attempt='2024-07-01')
+    assert (watermarks['status'] == 'ok').all() and (watermarks['last_attempt'] == TODAY).all()
+    with ExchangeDatabase('resume') as db:
+        last = db.get_last_dates(SOURCE.symbols())
+    assert all(watermarks.loc[symbol, 'last_date'] == last[symbol] for symbol in SOURCE.symbols())
+    # Lower watermarks do not replace the stored ones, so downloads resume after the last stored bar
+    database_updater.update_database('resume', threads=1, source=source)
+    day_after = {symbol: _timestamp(dt.datetime.strptime(date, '%Y-%m-%d') + dt.timedelta(days=1))
+                 for symbol, date in last.items()}
+    assert all(start == day_after[symbol] for symbol, start in starts)
+
+
+def _read_back(frames: SharedFrames) -> Dict[str, pd.DataFrame]:
+    with frames.attach() as attached:
+        return {key: df.copy() for key, df in attached.items()}
+
+
+def test_shared_frames_round_trip_through_a_process() -> None:
+    hist = SOURCE.download('SYN00000', 0, _timestamp('2024-06-01'))
+    frames = SharedFrames({'SYN00000': hist, 'dated': hist.set_axis(pd.to_datetime(hist.index).rename('Date')),
+                           'empty': hist.iloc[:0]})
+    try:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            copies = pool.apply(_read_back, (frames,))
+    finally:
+        frames.unlink()
+    pd.testing.assert_frame_equal(copies['SYN00000'], hist)
+    pd.testing.assert_frame_equal(copies['dated'], hist.set_axis(pd.to_datetime(hist.index).rename('Date')))
+    assert copies['empty'].empty and list(copies['empty'].columns) == list(hist.columns)
+    with pytest.raises(ValueError):
+        SharedFrames({'text': pd.DataFrame({'Name': ['a']}, index=['2024-01-02'])})
+
+
+@pytest.mark.parametrize('threads, multiprocess_write', [(1, False), (3, False), (3, True)])
+def test_writer_hand_off_stores_every_history(threads: int, multiprocess_write: bool) -> None:
+    exchange = {(1, False): 'serial', (3, False): 'threaded', (3, True): 'process'}[(threads, multiprocess_write)]
+    _register(exchange)
+    database_updater.update_database(exchange, threads=threads, multiprocess_write=multiprocess_write, commit_every=3,
+                                     source=SOURCE)
+    with ExchangeDatabase(exchange, read_only=True) as db:
+        for symbol in SOURCE.symbols():
+            pd.testing.assert_frame_equal(db.read_stock_data(symbol), SOURCE.download(symbol, 0, _timestamp(dt.date.today())),
+                                          check_dtype=False)
+    with MetadataDatabase() as metadb:
+        assert (metadb.get_watermarks(exchange).loc[SOURCE.symbols(), 'status'] == 'ok').all()
+
+
+def test_writer_commits_data_before_watermarks() -> None:
+    _register('batched')
+    with ExchangeDatabase('batched') as exdb, MetadataDatabase() as metadb, exdb.bulk_load():
+        writer = database_updater._Writer('batched', exdb, metadb, commit_every=2, commit_interval=3600)
+        for symbol in SOURCE.symbols()[:3]:
+            writer.write(symbol, SOURCE.download(symbol, 0, _timestamp('2024-06-01')))
+        with ExchangeDatabase('batched', read_only=True) as reader, MetadataDatabase(read_only=True) as metareader:
+            assert metareader.get_watermarks('batched').index.tolist() == SOURCE.symbols()[:2]
+            assert reader.have_table('SYN00001') and not reader.have_table('SYN00002')
+        writer.write('SYN00003', None)
+        assert len(writer.rows) == 0
+    with MetadataDatabase() as metadb:
+        assert metadb.get_watermarks('batched')['status'].tolist() == ['ok', 'ok', 'ok', 'failed']
+
+
+def test_put_raises_once_the_writer_stopped() -> None:
+    q = queue.Queue(1)
+    q.put(('SYN00000', None))
+    writer = threading.Thread(target=lambda: None)
+    writer.start()
+    writer.join()
+    with pytest.raises(RuntimeError):
+        database_updater._put(q, ('SYN00001', None), writer, timeout=0.01)
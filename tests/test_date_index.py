@@ -0,0 +1,37 @@
+from __future__ import annotations
+from stock.data.date_index import DateLike, normalize, locate, slice_dates
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    index = pd.Index(['2015-01-07', '2015-01-02', '2015-01-05', '2015-01-06', '2015-01-08'], name='Date')
+    return pd.DataFrame({'Close': np.arange(5.0)}, index=index)
+
+
+def test_normalize_sorts_a_datetime_index(frame: pd.DataFrame) -> None:
+    df = normalize(frame)
+    assert isinstance(df.index, pd.DatetimeIndex) and df.index.name == 'Date' and df.index.is_monotonic_increasing
+    assert df['Close'].tolist() == [1.0, 2.0, 3.0, 0.0, 4.0]
+    assert normalize(df) is df
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    ('2015-01-05', '2015-01-07'), ('2015-01-03', '2015-01-06'), ('2015-01-06', None), (None, '2015-01-05'),
+    ('0000-00-00', '9999-99-99'), ('2014-01-01', '2014-12-31'), ('2016-01-01', '2016-12-31'),
+    (pd.Timestamp('2015-01-06'), '2015-01-06'), ('2015-01-07', '2015-01-05'),
+])
+def test_slice_dates_equals_boolean_selection(frame: pd.DataFrame, start_date: DateLike, end_date: DateLike) -> None:
+    df = normalize(frame)
+    low = pd.Timestamp('1900-01-01') if start_date in (None, '0000-00-00') else pd.Timestamp(start_date)
+    high = pd.Timestamp('2200-01-01') if end_date in (None, '9999-99-99') else pd.Timestamp(end_date)
+    pd.testing.assert_frame_equal(slice_dates(df, start_date, end_date), df[(df.index >= low) & (df.index <= high)])
+
+
+def test_locate_bounds(frame: pd.DataFrame) -> None:
+    index = normalize(frame).index
+    assert locate(index, '2015-01-06') == 2 and locate(index, '2015-01-06', upper=True) == 3
+    assert locate(index, None) == 0 and locate(index, None, upper=True) == 5
+    assert locate(index[:0], '2015-01-06') == 0
@@ -0,0 +1,111 @@
+from __future__ import annotations
+from typing import Callable, List
+from stock.processers.kernels import Kernel, EMA, RollingMoments, BollingerBands, RollingMin, RollingMax, RSI, ATR, VWAP
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _prices(rows: int = 500, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns random high, low, close and volume columns with NaN in some rows
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, rows))
+    df = pd.DataFrame({'high': close + rng.random(rows), 'low': close - rng.random(rows), 'close': close,
+                       'volume': rng.integers(1, 1000, rows).astype(float)})
+    for column in df.columns:
+        df.loc[rng.random(rows) < 0.05, column] = np.nan
+    df.iloc[200:215] = np.nan
+    return df
+
+
+def _on_valid(df: pd.DataFrame, function: Callable[[pd.DataFrame], pd.DataFrame]) -> np.ndarray:
+    """
+    Returns function applied by pandas to the rows of df without NaN, NaN elsewhere
+    """
+    return function(df.dropna()).reindex(df.index).to_numpy(dtype=float)
+
+
+def _wilder(values: pd.Series, period: int) -> pd.Series:
+    seeded = values.iloc[period - 1:].copy()
+    seeded.iloc[0] = values.iloc[:period].mean()
+    return seeded.ewm(alpha=1 / period, adjust=False).mean().reindex(values.index)
+
+
+def _rsi(df: pd.DataFrame, period: int) -> pd.DataFrame:
+    change = df['close'].diff().iloc[1:]
+    gain = _wilder(change.clip(lower=0), period)
+    loss = _wilder((-change).clip(lower=0), period)
+    return (100 * gain / (gain + loss)).where(gain + loss > 0, 50.0).where(gain.notna()).to_frame()
+
+
+def _atr(df: pd.DataFrame, period: int) -> pd.DataFrame:
+    previous = df['close'].shift()
+    ranges = pd.concat([df['high'] - df['low'], (df['high'] - previous).abs(), (df['low'] - previous).abs()], axis=1)
+    return _wilder(ranges.max(axis=1), period).to_frame()
+
+
+def _vwap(df: pd.DataFrame, window: int = None) -> pd.DataFrame:
+    pv = (df['high'] + df['low'] + df['close']) / 3 * df['volume']
+    if window is None:
+        return (pv.cumsum() / df['volume'].cumsum()).to_frame()
+    return (pv.rolling(window).sum() / df['volume'].rolling(window).sum()).to_frame()
+
+
+def _bands(close: pd.Series, window: int, k: float) -> pd.DataFrame:
+    mean = close.rolling(window).mean()
+    std = close.rolling(window).std(ddof=0)
+    return pd.DataFrame({'middle': mean, 'upper': mean + k * std, 'lower': mean - k * std})
+
+
+CASES = [
+    (lambda: EMA(10), ['close'], lambda df: df['close'].ewm(span=10, adjust=False).mean().to_frame()),
+    (lambda: EMA(alpha=1.0), ['close'], lambda df: df['close'].to_frame()),
+    (lambda: RollingMoments(20), ['close'],
+     lambda df: pd.concat([df['close'].rolling(20).mean(), df['close'].rolling(20).var()], axis=1)),
+    (lambda: BollingerBands(20, 2.0), ['close'], lambda df: _bands(df['close'], 20, 2.0)),
+    (lambda: RollingMin(15), ['close'], lambda df: df['close'].rolling(15).min().to_frame()),
+    (lambda: RollingMax(15), ['close'], lambda df: df['close'].rolling(15).max().to_frame()),
+    (lambda: RSI(14), ['close'], lambda df: _rsi(df, 14)),
+    (lambda: ATR(14), ['high', 'low', 'close'], lambda df: _atr(df, 14)),
+    (lambda: VWAP(), ['high', 'low', 'close', 'volume'], _vwap),
+    (lambda: VWAP(20), ['high', 'low', 'close', 'volume'], lambda df: _vwap(df, 20)),
+]
+
+
+def _run(kernel: Kernel, df: pd.DataFrame, sizes: List[int]) -> np.ndarray:
+    """
+    Runs kernel on the rows of df in consecutive parts of the sizes, cycled
+    """
+    parts = []
+    start = 0
+    while start < len(df):
+        size = sizes[len(parts) % len(sizes)]
+        parts.append(kernel.run(*(df[column].to_numpy()[start:start + size] for column in df.columns)))
+        start += size
+    return np.concatenate(parts)
+
+
+@pytest.mark.parametrize('make, columns, expected', CASES)
+@pytest.mark.parametrize('sizes', [[500], [1], [3, 70, 1, 150, 7]], ids=['vector', 'step', 'mixed'])
+def test_kernel_equals_pandas_on_valid_rows(make: Callable[[], Kernel], columns: List[str],
+                                           expected: Callable[[pd.DataFrame], pd.DataFrame], sizes: List[int]) -> None:
+    df = _prices()[columns]
+    res = _run(make(), df, sizes)
+    assert np.allclose(res, _on_valid(df, expected), equal_nan=True, rtol=1e-9, atol=1e-9)
+    assert np.isnan(res[df.isna().any(axis=1).to_numpy()]).all()
+
+
+@pytest.mark.parametrize('make, columns, expected', CASES)
+def test_kernel_resumes_on_lookback_values(make: Callable[[], Kernel], columns: List[str],
+                                           expected: Callable[[pd.DataFrame], pd.DataFrame]) -> None:
+    kernel = make()
+    if kernel.lookback is None:
+        pytest.skip('depends on the whole history')
+    df = _prices()[columns].dropna()
+    full = kernel.run(*(df[column].to_numpy() for column in columns))
+    resumed = make()
+    resumed.run(*(df[column].to_numpy()[300 - kernel.lookback:300] for column in columns))
+    res = resumed.run(*(df[column].to_numpy()[300:] for column in columns))
+    assert np.allclose(res, full[300:], equal_nan=True, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,54 @@
+from __future__ import annotations
+from typing import Any, Dict, Tuple
+from stock.processers.ma_processor import MovingAverageProcessor
+from stock.processers.processor_base import ProcessorBase
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('args, kwargs', [
+    ((5, 'Close'), {}),
+    ((20, 'Close'), {'min_periods': 3}),
+    ((4, 'Open', 2, True), {}),
+    ((6, 'Close'), {'closed': 'left'}),
+    (('10D', 'Close'), {}),
+])
+def test_compute_panel_equals_compute(panel: pd.DataFrame, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> None:
+    processor = MovingAverageProcessor(*args, **kwargs)
+    res = processor.compute_panel(panel)
+    expected = ProcessorBase.compute_panel(processor, panel)
+    assert list(res) == list(expected)
+    for symbol, df in expected.items():
+        pd.testing.assert_frame_equal(res[symbol], df, check_exact=True, check_freq=False)
+
+
+@pytest.mark.parametrize('args, kwargs, lookback', [
+    ((5, 'Close'), {}, 4),
+    ((5, 'Close'), {'min_periods': 1}, 4),
+    ((5, 'Close', 2, False, None, None, 'left'), {}, 5),
+    ((5, 'Close'), {'closed': 'both', 'min_periods': 1}, 5),
+    ((5, 'Close'), {'closed': 'neither', 'min_periods': 1}, 4),
+])
+def test_lookback_is_exact(args: Tuple[Any, ...], kwargs: Dict[str, Any], lookback: int) -> None:
+    processor = MovingAverageProcessor(*args, **kwargs)
+    assert processor.lookback == lookback
+    data = pd.DataFrame({'Close': np.random.default_rng(0).normal(size=100)},
+                        index=pd.date_range('2015-01-01', periods=100, freq='B'))
+    full = processor.compute(data)
+    resumed = processor.compute(data.iloc[60 - lookback:])
+    pd.testing.assert_frame_equal(resumed.iloc[lookback:], full.iloc[60:], rtol=1e-12)
+    shorter = processor.compute(data.iloc[61 - lookback:])
+    assert not np.allclose(shorter.iloc[lookback - 1:], full.iloc[60:], equal_nan=True)
+
+
+@pytest.mark.parametrize('args, kwargs', [
+    (('10D', 'Close'), {}),
+    ((5, 'Close', None, True), {}),
+    ((5, 'Close'), {'center': True}),
+    ((5, 'Close', None, False, 'triang'), {}),
+    ((5, 'Close'), {'win_type': 'triang'}),
+    ((5, 'Close'), {'step': 2}),
+])
+def test_lookback_is_none_for_other_windows(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> None:
+    assert MovingAverageProcessor(*args, **kwargs).lookback is None
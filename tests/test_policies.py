@@ -0,0 +1,75 @@
+from __future__ import annotations
+from stock.policies.policy_base import PolicyBase
+from stock.policies.simulator import Simulator
+from stock.policies.sweep import STATISTICS, sweep
+from stock.policy.p_ma import DoubleMA
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('policy, start_date, end_date, cost', [
+    (DoubleMA(5, 20), None, None, 0.0),
+    (DoubleMA(3, 30, short=True), '2015-03-02', '2016-03-31', 0.001),
+])
+def test_simulator_equals_fit_batch(panel: pd.DataFrame, policy: DoubleMA, start_date: str, end_date: str,
+                                    cost: float) -> None:
+    batch = policy.fit_batch(panel, start_date, end_date, cost)
+    streamed = Simulator(policy, cost, start_date, end_date).run_panel(panel)
+    for name in ('positions', 'trades', 'fill_prices', 'returns', 'equity'):
+        pd.testing.assert_frame_equal(getattr(batch, name), getattr(streamed, name), check_exact=True, check_freq=False)
+    pd.testing.assert_series_equal(batch.portfolio, streamed.portfolio, check_exact=True, check_freq=False)
+
+
+GRID = {'fast': [3, 5, 10], 'slow': [10, 20], 'short': [False, True]}
+
+
+@pytest.mark.parametrize('per_symbol', [False, True])
+def test_sweep_serial_equals_parallel_and_fit_batch(panel: pd.DataFrame, per_symbol: bool) -> None:
+    serial = sweep(DoubleMA, GRID, panel, '2015-03-02', '2016-03-31', 0.001, per_symbol=per_symbol, workers=1)
+    parallel = sweep(DoubleMA, GRID, panel, '2015-03-02', '2016-03-31', 0.001, per_symbol=per_symbol, workers=2,
+                     chunk_size=2)
+    pd.testing.assert_frame_equal(serial, parallel, check_exact=True)
+    assert len(serial) == (5 if not per_symbol else 5 * 6) * 2
+    for row in serial.itertuples():
+        summary = DoubleMA(row.fast, row.slow, short=row.short).fit_batch(panel, '2015-03-02', '2016-03-31', 0.001) \
+            .summary().loc[row.symbol if per_symbol else 'portfolio']
+        assert np.array_equal([summary[name] for name in STATISTICS], [getattr(row, name) for name in STATISTICS],
+                              equal_nan=True)
+        assert summary['trades'] == row.trades
+
+
+def test_walk_forward_serial_equals_parallel(panel: pd.DataFrame) -> None:
+    serial = DoubleMA.walk_forward(GRID, panel, 120, 60, start_date='2015-02-02', cost=0.001, workers=1)
+    parallel = DoubleMA.walk_forward(GRID, panel, 120, 60, start_date='2015-02-02', cost=0.001, workers=2)
+    pd.testing.assert_frame_equal(serial, parallel, check_exact=True)
+    first = panel.index.get_loc(pd.Timestamp('2015-02-02'))
+    assert serial['fold'].nunique() == (len(panel) - first - 180) // 60 + 1
+    assert serial['test_start'].min() == panel.index[first + 120]
+    assert (serial.groupby(['fold', 'symbol'], observed=True)['selected'].sum() == 1).all()
+
+
+class AboveMean(PolicyBase):
+    """
+    Holds a symbol while its close is above the mean of its last lookback + 1 closes,
+    with fit_day left to its default
+    """
+    fields = ('Close',)
+
+    def __init__(self, lookback: int):
+        self.lookback = lookback
+
+    def signal(self, data: pd.DataFrame) -> pd.DataFrame:
+        close = data['Close']
+        return (close > close.rolling(self.lookback + 1).mean()).astype(float)
+
+
+@pytest.mark.parametrize('lookback', [0, 9])
+def test_default_fit_day_follows_signal(panel: pd.DataFrame, lookback: int) -> None:
+    # Symbols without gaps, whose last lookback + 1 bars are the last rows of the panel
+    panel = panel.loc[:, (slice(None), ['S0', 'S1', 'S3', 'S4'])]
+    policy = AboveMean(lookback)
+    batch = policy.fit_batch(panel, '2015-03-02', None, 0.001)
+    streamed = Simulator(policy, 0.001, '2015-03-02').run_panel(panel)
+    for name in ('positions', 'trades', 'returns', 'equity'):
+        pd.testing.assert_frame_equal(getattr(batch, name), getattr(streamed, name), check_exact=True, check_freq=False)
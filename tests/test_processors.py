@@ -0,0 +1,136 @@
+from __future__ import annotations
+from typing import Callable, List
+from stock.data import data_manager
+from stock.data.date_index import normalize
+from stock.processers.indicator_processor import KernelProcessorBase, EMAProcessor, RollingMinProcessor, RSIProcessor, VWAPProcessor
+from stock.processers.ma_processor import MovingAverageProcessor
+from stock.processers.parallel import ParallelExecutor
+from stock.processers.result_cache import ResultCache
+import numpy as np
+import pandas as pd
+import pytest
+import sqlite3
+import os
+
+
+def _calls(processor: MovingAverageProcessor, monkeypatch: pytest.MonkeyPatch) -> List[int]:
+    """
+    Records the number of rows of every call of processor.compute
+    """
+    calls = []
+    compute = processor.compute
+
+    def counted(data: pd.DataFrame) -> pd.DataFrame:
+        calls.append(len(data))
+        return compute(data)
+    monkeypatch.setattr(processor, 'compute', counted)
+    return calls
+
+
+def test_get_data_extends_with_new_bars(write_stock: Callable[..., List[str]], monkeypatch: pytest.MonkeyPatch) -> None:
+    symbol = write_stock('extend', 1, end='2015-07-01')[0]
+    processor = MovingAverageProcessor(10, 'Close')
+    before = processor.get_data('extend', symbol)
+    write_stock('extend', 1, end='2015-08-01')
+    data_manager.invalidate('extend', symbol)
+    calls = _calls(processor, monkeypatch)
+    after = processor.get_data('extend', symbol)
+    stock = data_manager.get_data('extend', symbol)
+    assert calls == [len(stock) - len(before) + 9]
+    pd.testing.assert_frame_equal(after.iloc[:len(before)], before, check_exact=True, check_freq=False)
+    pd.testing.assert_frame_equal(after, processor.compute(stock), rtol=1e-12, check_freq=False)
+
+
+def test_get_data_recomputes_corrected_prices(write_stock: Callable[..., List[str]]) -> None:
+    symbol = write_stock('correct', 1, end='2015-07-01')[0]
+    processor = MovingAverageProcessor(10, 'Close')
+    before = processor.get_data('correct', symbol)
+    write_stock('correct', 1, end='2015-08-01')
+    with sqlite3.connect('findata/correct.db') as connection:
+        connection.execute(f'UPDATE "{symbol}" SET Close = Close * 2 WHERE Date = (SELECT MIN(Date) FROM "{symbol}" '
+                           f'WHERE Date > "2015-03-01")')
+    data_manager.invalidate('correct', symbol)
+    after = processor.get_data('correct', symbol)
+    pd.testing.assert_frame_equal(after, processor.compute(data_manager.get_data('correct', symbol)),
+                                  check_exact=True, check_freq=False)
+    assert not after.iloc[:len(before)].equals(before)
+
+
+def test_flush_stores_results_and_inputs(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('flush', 2, end='2015-07-01')
+    processor = MovingAverageProcessor(15, 'Close')
+    results = {symbol: processor.get_data('flush', symbol) for symbol in symbols}
+    MovingAverageProcessor.flush(timeout=30)
+    assert not processor._dirty
+    for symbol, df in results.items():
+        tblname = 'flush/' + symbol
+        stored = normalize(processor._read(processor.database, tblname))
+        pd.testing.assert_frame_equal(stored, df, check_exact=True, check_freq=False)
+        assert processor._read_input(processor.database, tblname) == processor._inputs[tblname]
+        # A result evicted from the cache is reloaded from the database
+        processor.data.pop(tblname)
+        pd.testing.assert_frame_equal(processor.get_data('flush', symbol), df, check_exact=True, check_freq=False)
+        assert tblname in processor.data
+
+
+@pytest.mark.parametrize('make', [lambda: EMAProcessor(8, 'Close'), lambda: RollingMinProcessor(6, 'Close'),
+                                  lambda: RSIProcessor(5), lambda: VWAPProcessor(), lambda: VWAPProcessor(4)],
+                         ids=['ema', 'min', 'rsi', 'vwap', 'vwap4'])
+def test_kernel_processor_extends_across_missing_rows(make: Callable[[], KernelProcessorBase]) -> None:
+    processor = make()
+    rng = np.random.default_rng(1)
+    close = 100 + np.cumsum(rng.normal(size=120))
+    data = pd.DataFrame({'High': close + 1, 'Low': close - 1, 'Close': close, 'Volume': rng.integers(1, 100, 120)},
+                        index=pd.date_range('2015-01-01', periods=120, freq='B'), dtype=float)
+    data.iloc[75:79] = np.nan
+    data.iloc[83, 2] = np.nan
+    full = processor.compute(data)
+    for pos in (60, 80, 85, 119):
+        res = processor._extend('kernel/' + str(pos), data, full.iloc[:pos])
+        pd.testing.assert_frame_equal(res, full, rtol=1e-12, check_freq=False)
+
+
+def test_batch_and_parallel_equal_serial(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('batch', 3, end='2015-07-01')
+    serial = MovingAverageProcessor(11, 'Close')
+    expected = {symbol: serial.compute(data_manager.get_data('batch', symbol)) for symbol in symbols}
+    batch = MovingAverageProcessor(12, 'Close').get_data_multi({'batch': symbols}, batch=True)['batch']
+    with ParallelExecutor(workers=2, chunk_size=2) as executor:
+        parallel = MovingAverageProcessor(11, 'Close').get_data_multi({'batch': symbols}, executor=executor)['batch']
+    assert list(parallel) == list(batch) == symbols
+    for symbol in symbols:
+        pd.testing.assert_frame_equal(parallel[symbol], expected[symbol], check_exact=True, check_freq=False)
+        pd.testing.assert_frame_equal(batch[symbol], MovingAverageProcessor(12, 'Close').compute(
+            data_manager.get_data('batch', symbol)), check_exact=True, check_freq=False)
+
+
+def test_result_cache_keys_reuse_and_eviction(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = ResultCache(str(tmp_path))
+    data = pd.DataFrame({'Close': np.arange(10.0)}, index=pd.date_range('2015-01-01', periods=10))
+    processor = MovingAverageProcessor(3, 'Close')
+    key = cache.key(processor, data)
+    assert key == cache.key(MovingAverageProcessor(3, 'Close'), data.copy())
+    changed = data.copy()
+    changed.iloc[4, 0] = -1.0
+    assert len({key, cache.key(processor, changed), cache.key(MovingAverageProcessor(4, 'Close'), data)}) == 3
+    assert cache.get(key) is None
+    result = processor.compute(data)
+    cache.put(key, result)
+    pd.testing.assert_frame_equal(cache.get(key), result)
+
+    # Results computed on the same data come from the cache
+    monkeypatch.setattr(processor, 'result_cache', cache)
+    cache.put(key, result * 2)
+    pd.testing.assert_frame_equal(processor._compute_full(data), result * 2, check_freq=False)
+
+    keys = [cache.key(MovingAverageProcessor(i, 'Close'), data) for i in range(5, 9)]
+    for i, other in enumerate(keys):
+        cache.put(other, result)
+        os.utime(cache._path(other), (i + 1, i + 1))
+    size = os.path.getsize(cache._path(key))
+    cache.get(keys[0])
+    cache.evict(size * 3)
+    assert [cache.get(other) is not None for other in keys] == [True, False, False, True]
+    assert cache.get(key) is not None
+    cache.clear()
+    assert cache._entries() == []
@@ -0,0 +1,72 @@
+from __future__ import annotations
+from typing import Callable, List
+from stock.data import data_manager
+from stock.data.database import ExchangeDatabase
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _expected(exchange: str, symbols: List[str]) -> pd.DataFrame:
+    """
+    Returns the snapshot rows of symbols computed by pandas on their whole histories
+    """
+    rows = {}
+    for symbol in symbols:
+        data = data_manager.get_data(exchange, symbol)
+        close, volume = data['Close'], data['Volume'].astype(float)
+        v_ma5 = volume.rolling(5).mean()
+        rows[symbol] = {'Date': data.index[-1], **data.iloc[-1][ExchangeDatabase.FIELDS].to_dict(),
+                        'change': close.pct_change().iloc[-1], 'ma5': close.rolling(5).mean().iloc[-1],
+                        'ma20': close.rolling(20).mean().iloc[-1], 'std20': close.rolling(20).std().iloc[-1],
+                        'v_ma5': v_ma5.iloc[-1], 'v_ma20': volume.rolling(20).mean().iloc[-1],
+                        'v_change': (volume - v_ma5).iloc[-1], 'v_ratio': (volume / v_ma5).iloc[-1]}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def _assert_rows(res: pd.DataFrame, expected: pd.DataFrame) -> None:
+    assert list(res.index) == list(expected.index)
+    assert list(res['Date']) == list(expected['Date'])
+    numeric = [column for column in expected.columns if column != 'Date']
+    assert np.allclose(res[numeric].to_numpy(dtype=float), expected[numeric].to_numpy(dtype=float), rtol=1e-9,
+                       equal_nan=True)
+
+
+def test_snapshot_follows_writes(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('snap', 3, end='2015-03-01')
+    with ExchangeDatabase('snap') as db:
+        db.ensure_snapshot()
+        db.commit()
+    _assert_rows(data_manager.get_snapshot('snap').loc[symbols], _expected('snap', symbols))
+    write_stock('snap', 3, end='2015-04-01')
+    for symbol in symbols:
+        data_manager.invalidate('snap', symbol)
+    snapshot = data_manager.get_snapshot('snap', symbols[1:])
+    _assert_rows(snapshot.sort_index(), _expected('snap', symbols[1:]))
+    assert (snapshot['Date'] == pd.Timestamp('2015-03-31')).all()
+
+
+def test_snapshot_of_short_histories(write_stock: Callable[..., List[str]]) -> None:
+    symbols = write_stock('snapshort', 2, end='2015-01-15')
+    with ExchangeDatabase('snapshort') as db:
+        db.rebuild_snapshot()
+        db.commit()
+    snapshot = data_manager.get_snapshot('snapshort')
+    _assert_rows(snapshot.loc[symbols], _expected('snapshort', symbols))
+    assert snapshot[['ma20', 'std20', 'v_ma20']].isna().all().all() and snapshot['ma5'].notna().all()
+
+
+def test_screen_sorts_and_bounds(write_stock: Callable[..., List[str]]) -> None:
+    write_stock('screen', 6, end='2015-03-01')
+    with ExchangeDatabase('screen') as db:
+        db.ensure_snapshot()
+        db.commit()
+    snapshot = data_manager.get_snapshot('screen')
+    top = data_manager.screen('screen', by='change', n=3)
+    pd.testing.assert_frame_equal(top, snapshot.sort_values('change', ascending=False).iloc[:3])
+    low = data_manager.screen('screen', by='v_ratio', n=10, ascending=True, bounds={'change': (0, None)})
+    pd.testing.assert_frame_equal(low, snapshot[snapshot['change'] >= 0].sort_values('v_ratio'))
+    with pytest.raises(ValueError):
+        data_manager.screen('screen', by='missing')
+    with pytest.raises(ValueError):
+        data_manager.screen('screen', n=0)